@@ -1,13 +1,35 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, make_response
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
 import pandas as pd
+import numpy as np
 import os
+import uuid
+import multiprocessing
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import json
-from s3_client import get_s3_client
+from s3_client import get_s3_client, object_checksums
+from http_client import get_http_session
+from dataset_cache import DatasetCache, DatasetSnapshot
+from dataset_format import SNAPSHOT_FILE, read_snapshot
+from manifest import MANIFEST_FILE, format_of, load_object, parse_manifest, read_manifest_from_s3, select_object
+from downloads import download_to_file, http_range_fetcher
+from disk_cache import get_disk_cache
+from label_log import GroupCommitWriter, LabelLog, make_label_event
+from label_store import LabelStore
+from partitions import PartitionSet, base_version, channel_keys, hot_window_start, load_partitions, read_partitions, select_partitions
+from preprocessing import DERIVED_COLUMNS, normalize_messages
+from filter_index import FilterIndex
+from query_cache import QueryCache, make_query_key
+from pagination import CursorError, fetch_page
+from query import QueryError, QueryPlan, parse_query, run_query
+from serialization import CARD_COLUMNS, API_COLUMNS, to_records, to_json_records, iter_ndjson
+from export import EXPORT_FORMATS, ExportSources, export_columns, iter_export
+from jobs import JOB_DESTINATIONS, JOB_DONE, JOB_FAILED, JobError, JobRunner, run_export, run_export_relevants
+from uploads import multipart_upload
 from auth import auth_bp
 from models import db
 from config import Config
@@ -22,6 +44,10 @@ logger = logging.getLogger(__name__)
 MESSAGES_LIMIT = 48
 S3_BUCKET = os.environ.get('S3_BUCKET', 'monitoria-data')
 S3_KEY = 'telegram_messages.json'
+PUBLIC_BASE_URL = 'https://monitoria-data.s3.eu-north-1.amazonaws.com'
+PUBLIC_DATA_URL = f'{PUBLIC_BASE_URL}/telegram_messages.json'
+PUBLIC_SNAPSHOT_URL = f'{PUBLIC_BASE_URL}/{SNAPSHOT_FILE}'
+PUBLIC_MANIFEST_URL = f'{PUBLIC_BASE_URL}/{MANIFEST_FILE}'
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -41,23 +67,227 @@ db.init_app(app)
 # Registrar blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 
+# Los trabajos (`jobs.py`) no importan este módulo, pero los procesos 'spawn' de su pool
+# vuelven a ejecutar el script principal cuando el servidor se arranca con `python app.py`:
+# la inicialización del servidor (tablas, refresco del dataset) solo ocurre en el proceso principal
+SERVER_PROCESS = multiprocessing.parent_process() is None
+
 # Crear tablas de base de datos
-with app.app_context():
-    db.create_all()
+if SERVER_PROCESS:
+    with app.app_context():
+        db.create_all()
+
+# Clave en S3 del archivo de mensajes, localizada por `find_messages_file()`
+_s3_messages_file = None
+
+def find_messages_file(s3_client):
+    """Busca el archivo de mensajes en el bucket (prioridad: snapshot Arrow, luego JSON, luego CSV)."""
+    global _s3_messages_file
+    files = s3_client.list_files()
+    logger.info(f"Archivos disponibles en S3: {files}")
+
+    _s3_messages_file = None
+    for extension in ('.arrow', '.json', '.csv'):
+        candidates = [file for file in files if 'telegram_messages' in file.lower() and file.endswith(extension)]
+        if candidates:
+            _s3_messages_file = candidates[0]
+            break
+    return _s3_messages_file
+
+def fetch_manifest(http):
+    """Lee el manifiesto del dataset (URL pública o S3). Devuelve (manifest, origen) o (None, None)."""
+    try:
+        response = http.get(PUBLIC_MANIFEST_URL, timeout=10)
+        if response.status_code == 200:
+            return parse_manifest(response.content), 'public'
+    except Exception as e:
+        logger.warning(f"No se pudo leer el manifiesto desde URL pública: {e}")
 
-def load_data():
-    """Carga los datos desde S3 y maneja posibles errores."""
     try:
-        # Intentar cargar desde URL pública primero (más rápido)
+        manifest = read_manifest_from_s3(get_s3_client())
+        if manifest is not None:
+            return manifest, 's3'
+    except Exception as e:
+        logger.warning(f"No se pudo leer el manifiesto desde S3: {e}")
+    return None, None
+
+def fetch_manifest_object(entry, source, http, version):
+    """Ruta local de un objeto del manifiesto, desde la caché en disco o descargándolo a ella."""
+    # Otro proceso del host (o un arranque anterior) pudo dejar ya este objeto en disco
+    cache = get_disk_cache()
+    path = cache.lookup(S3_BUCKET, entry['key'], entry['sha256'], entry['sha256'])
+    if path is None:
+        if source == 'public':
+            fetch_range = http_range_fetcher(http, f"{PUBLIC_BASE_URL}/{entry['key']}")
+        else:
+            fetch_range = get_s3_client().range_fetcher(entry['key'])
+        # El tamaño lo da el manifiesto: las partes se piden en paralelo con peticiones de rango
+        path = cache.store(
+            S3_BUCKET, entry['key'], entry['sha256'],
+            lambda tmp_path: download_to_file(fetch_range, entry['size'], tmp_path, label=entry['key']),
+            sha256=entry['sha256'],
+            version=version
+        )
+    return path
+
+def fetch_data_from_manifest(version, http):
+    """
+    Carga el objeto que indica el manifiesto si su versión difiere de `version`.
+    Si el manifiesto describe particiones, solo se cargan las de la ventana caliente.
+    Devuelve None si el bucket no tiene manifiesto.
+    """
+    manifest, source = fetch_manifest(http)
+    if manifest is None:
+        return None
+    if version and base_version(version) == manifest['version']:
+        return None, version
+
+    if manifest.get('partitions'):
+        # Solo las particiones de los últimos DATASET_HOT_DAYS días; el resto, bajo demanda
+        selected = select_partitions(manifest['partitions'], hot_window_start(Config.DATASET_HOT_DAYS))
+        logger.info(f"Cargando {len(selected)} de {len(manifest['partitions'])} particiones "
+                    f"(versión {manifest['version']})")
+        df = load_partitions(selected, lambda entry: fetch_manifest_object(entry, source, http, manifest['version']))
+        partitions = PartitionSet(manifest, [entry['key'] for entry in selected], source)
+        return df, partitions.version, partitions
+
+    entry = select_object(manifest)
+    logger.info(f"Cargando {entry['key']} según el manifiesto (versión {manifest['version']})")
+    df = load_object(entry, fetch_manifest_object(entry, source, http, manifest['version']))
+    if len(df) != manifest['rows']:
+        logger.warning(f"El manifiesto indica {manifest['rows']} filas pero se cargaron {len(df)}")
+    return df, manifest['version']
+
+# Intentos de ampliar el snapshot cuando otra petición publica uno nuevo mientras se cargan particiones
+PARTITION_EXTEND_ATTEMPTS = 5
+
+def ensure_partitions(snapshot, plan):
+    """
+    Amplía el snapshot con las particiones anteriores a la ventana caliente que necesita
+    una consulta con fecha de inicio explícita. Las consultas sin fecha de inicio (el
+    feed por defecto, /api/messages sin filtros, la búsqueda de /label) se resuelven
+    sobre las particiones cargadas: así DATASET_HOT_DAYS acota la memoria y solo un
+    rango de fechas pedido expresamente carga histórico. Si mientras se cargan se
+    publica otro snapshot, se vuelve a calcular lo que falta sobre ese, reutilizando
+    las particiones ya leídas.
+    """
+    filters = plan.filters
+    if filters['date_start'] is None:
+        return snapshot
+    frames = {}
+    http = None
+    for _ in range(PARTITION_EXTEND_ATTEMPTS):
+        partitions = snapshot.partitions
+        if partitions is None:
+            return snapshot
+        missing = partitions.missing(filters['date_start'], filters['date_end'], filters['channels'])
+        if not missing:
+            return snapshot
+        pending = [entry for entry in missing if entry['key'] not in frames]
+        if pending:
+            http = http or get_http_session()
+            manifest_version = partitions.manifest['version']
+            frames.update(zip(
+                [entry['key'] for entry in pending],
+                read_partitions(pending, lambda entry: fetch_manifest_object(
+                    entry, partitions.source, http, manifest_version))
+            ))
+        frame = pd.concat([frames[entry['key']] for entry in missing], ignore_index=True)
+        loaded = partitions.with_loaded(missing)
+        extended = dataset_cache.extend(snapshot, frame, loaded.version, loaded)
+        if extended is not None:
+            return extended
+        # Otra petición (o el refresco) publicó un snapshot: puede que ya incluya parte de lo que faltaba
+        snapshot = dataset_cache.snapshot
+    logger.warning(f"No se pudo ampliar el snapshot tras {PARTITION_EXTEND_ATTEMPTS} intentos; "
+                   f"la consulta se resuelve sobre las particiones cargadas")
+    return snapshot
+
+def store_public_snapshot(response):
+    """
+    Guarda el snapshot público descargado en la caché en disco y devuelve su ruta. Nunca
+    se escribe sobre SNAPSHOT_FILE, que es el dataset local de `load_data_local()` y del
+    scraper. Con un checksum verificable en la respuesta (el ETag MD5 o las cabeceras
+    x-amz-checksum-*) es una entrada más de la caché, que sirve también de fallback sin
+    conexión; sin él se guarda en un archivo de trabajo aparte que no se reutiliza.
+    """
+    headers = response.headers
+    checksums = object_checksums({
+        'ETag': headers.get('ETag'),
+        'ChecksumSHA256': headers.get('x-amz-checksum-sha256'),
+        'ChecksumCRC32': headers.get('x-amz-checksum-crc32'),
+        'ChecksumType': headers.get('x-amz-checksum-type'),
+        'ServerSideEncryption': headers.get('x-amz-server-side-encryption')
+    })
+
+    def fill(path):
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+
+    cache = get_disk_cache()
+    if checksums:
+        return cache.store(S3_BUCKET, SNAPSHOT_FILE, headers.get('ETag'), fill, checksums=checksums)
+    logger.warning(f"{PUBLIC_SNAPSHOT_URL} no publica un checksum verificable: se descarga sin guardarlo en la caché")
+    directory = os.path.join(cache.directory, 'public')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    # Temporal único (el refresco y otros workers pueden descargar a la vez) y reemplazo
+    # atómico bajo el bloqueo de la caché: el snapshot anterior puede seguir mapeado en memoria
+    tmp_path = f"{path}.{uuid.uuid4().hex}.download"
+    try:
+        fill(tmp_path)
+        with cache.exclusive():
+            os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+def fetch_data(version=None):
+    """
+    Descarga los datos desde S3 si su versión difiere de `version`: la del manifiesto
+    si el bucket lo tiene, o el ETag del objeto en buckets sin manifiesto.
+    Devuelve una tupla (df, version); df es None si los datos no han cambiado.
+    """
+    try:
+        http = get_http_session()
+
+        # Un objeto pequeño indica qué descargar y si la caché sigue al día
+        try:
+            result = fetch_data_from_manifest(version, http)
+            if result is not None:
+                return result
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el dataset según el manifiesto: {e}")
+
+        headers = {'If-None-Match': version} if version else {}
+
+        # Intentar primero el snapshot columnar público: se descarga a disco y se mapea en memoria
+        try:
+            logger.info("Intentando cargar snapshot columnar desde URL pública de S3")
+            response = http.get(PUBLIC_SNAPSHOT_URL, headers=dict(headers, **{'x-amz-checksum-mode': 'ENABLED'}),
+                                timeout=30, stream=True)
+            if response.status_code == 304:
+                return None, version
+            if response.status_code == 200:
+                df = read_snapshot(store_public_snapshot(response))
+                logger.info(f"Snapshot cargado desde URL pública, filas: {len(df)}")
+                return df, response.headers.get('ETag')
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el snapshot desde URL pública: {e}")
+
+        # Intentar cargar el JSON heredado desde URL pública
         try:
             logger.info("Intentando cargar desde URL pública de S3")
-            import requests
-            response = requests.get('https://monitoria-data.s3.eu-north-1.amazonaws.com/telegram_messages.json', timeout=30)
+            response = http.get(PUBLIC_DATA_URL, headers=headers, timeout=30)
+            if response.status_code == 304:
+                return None, version
             if response.status_code == 200:
                 data = response.json()
                 df = pd.DataFrame(data['messages'])
                 logger.info(f"Datos cargados desde URL pública, filas: {len(df)}")
-                return df
+                return df, response.headers.get('ETag')
         except Exception as e:
             logger.warning(f"No se pudo cargar desde URL pública: {e}")
         
@@ -67,93 +297,167 @@ def load_data():
         # Verificar conexión con S3
         if not s3_client.check_connection():
             logger.warning("No se pudo conectar con S3, intentando cargar desde archivo local")
-            return load_data_local()
-        
-        # Listar archivos disponibles en S3
-        files = s3_client.list_files()
-        logger.info(f"Archivos disponibles en S3: {files}")
-        
-        # Buscar archivo de mensajes (prioridad: JSON, luego CSV)
-        messages_file = None
-        for file in files:
-            if 'telegram_messages' in file.lower():
-                if file.endswith('.json'):
-                    messages_file = file
-                    break
-                elif file.endswith('.csv') and not messages_file:
-                    messages_file = file
+            return fetch_data_offline(version)
         
+        # El archivo de mensajes se localiza una vez; después basta con head_object
+        messages_file = _s3_messages_file or find_messages_file(s3_client)
         if not messages_file:
             logger.warning("No se encontró archivo de mensajes en S3, intentando archivo local")
-            return load_data_local()
+            return fetch_data_offline(version)
         
+        # Revalidar con head_object antes de descargar el archivo completo
+        try:
+            head = s3_client.head_file(messages_file)
+        except ClientError:
+            # El archivo recordado ya no existe: volver a listar el bucket
+            messages_file = find_messages_file(s3_client)
+            if not messages_file:
+                return fetch_data_offline(version)
+            head = s3_client.head_file(messages_file)
+        etag = head.get('ETag')
+        if version and etag == version:
+            return None, version
+
         logger.info(f"Cargando datos desde S3: {messages_file}")
         
-        # Cargar datos según el formato del archivo
-        if messages_file.endswith('.json'):
-            data = s3_client.load_json_from_s3(messages_file)
+        # Cargar datos según el formato del archivo, a través de la caché en disco
+        size = head.get('ContentLength')
+        if messages_file.endswith('.arrow'):
+            df = read_snapshot(s3_client.get_cached_path(messages_file, etag, size))
+        elif messages_file.endswith('.json'):
+            data = s3_client.load_json_from_s3(messages_file, size, etag)
             df = pd.DataFrame(data['messages'])
         elif messages_file.endswith('.csv'):
-            df = s3_client.load_csv_from_s3(messages_file)
+            df = s3_client.load_csv_from_s3(messages_file, size, etag)
         else:
             logger.error(f"Formato de archivo no soportado: {messages_file}")
-            return load_data_local()
-        
-        # Verificar y limpiar la columna Title (usada como Channel)
-        if 'Title' in df.columns:
-            # Limpiar valores nulos o vacíos
-            df['Title'] = df['Title'].fillna('Desconocido')
-            df['Title'] = df['Title'].replace('', 'Desconocido')
-        
-        # Convertir columnas de fecha si existen
-        date_columns = ['Date', 'Date Sent', 'Creation Date', 'Edit Date']
-        for col in date_columns:
-            if col in df.columns:
-                try:
-                    # Convertir a datetime y eliminar zona horaria
-                    df[col] = pd.to_datetime(df[col]).dt.tz_localize(None)
-                except Exception as e:
-                    logger.warning(f"Error al convertir la columna '{col}': {e}")
-                    if col in df.columns:
-                        del df[col]
+            return fetch_data_offline(version)
         
         logger.info(f"Datos cargados desde S3 exitosamente: {len(df)} mensajes")
-        return df
+        return df, etag
 
     except Exception as e:
         logger.error(f"Error al cargar datos desde S3: {e}")
-        logger.info("Intentando cargar desde archivo local como fallback")
-        return load_data_local()
+        logger.info("Intentando cargar desde la caché en disco o el archivo local como fallback")
+        return fetch_data_offline(version)
+
+def fetch_data_cached(version=None):
+    """
+    Carga la última versión del dataset guardada en la caché en disco, para cuando S3
+    no responde. Devuelve None si la caché no tiene ninguna.
+    """
+    cache = get_disk_cache()
+    for key in (SNAPSHOT_FILE, S3_KEY):
+        cached = cache.latest(S3_BUCKET, key)
+        if cached is None:
+            continue
+        path, meta = cached
+        if version and meta['version'] == version:
+            return None, version
+        logger.info(f"Cargando {key} desde la caché en disco (versión {meta['version']})")
+        return load_object({'key': key, 'format': format_of(key)}, path), meta['version']
+    return None
+
+def fetch_data_offline(version=None):
+    """Sin acceso a S3: la caché en disco primero y, si está vacía, el archivo local."""
+    try:
+        result = fetch_data_cached(version)
+        if result is not None:
+            return result
+    except Exception as e:
+        logger.warning(f"No se pudo cargar el dataset desde la caché en disco: {e}")
+    return fetch_data_local(version)
+
+def fetch_data_local(version=None):
+    """Carga el archivo local solo si cambió su fecha de modificación respecto a `version`."""
+    local_path = SNAPSHOT_FILE if os.path.exists(SNAPSHOT_FILE) else 'telegram_messages.json'
+    local_version = f"local:{os.path.getmtime(local_path)}" if os.path.exists(local_path) else None
+    if version and local_version == version:
+        return None, version
+    return load_data_local(), local_version
+
+def get_db_engine():
+    with app.app_context():
+        return db.engine
+
+# Etiquetas: registro de solo anexado en S3, aplicado a la tabla `label` y superpuesto a cada snapshot
+label_log = LabelLog(LabelStore(get_db_engine), get_client=get_s3_client,
+                     compact_segments=Config.LABEL_COMPACT_SEGMENTS)
+
+# Caché del dataset compartida por todas las rutas del proceso
+dataset_cache = DatasetCache(
+    fetch_data,
+    preprocess=normalize_messages,
+    build_index=FilterIndex,
+    overlay=label_log,
+    revalidate_interval=Config.DATASET_REVALIDATE_INTERVAL,
+    warmup_timeout=Config.DATASET_WARMUP_TIMEOUT
+)
+if Config.DATASET_BACKGROUND_REFRESH and SERVER_PROCESS:
+    dataset_cache.start()
+
+# Caché de resultados de consultas (posiciones ordenadas) por versión del dataset
+query_cache = QueryCache(max_bytes=Config.QUERY_CACHE_MAX_BYTES)
+
+def publish_labels():
+    """Publica el snapshot con las etiquetas recién escritas; las consultas no afectadas se conservan."""
+    previous, published, changes = dataset_cache.apply_overlay()
+    if previous is not None and changes is not None and previous.version != published.version:
+        query_cache.rebase(previous.version, published.version,
+                           {position: FilterIndex.parse_label(label) for position, label in changes})
+
+# Las etiquetas de todas las peticiones se persisten en flushes agrupados
+label_writer = GroupCommitWriter(
+    label_log,
+    window=Config.LABEL_COMMIT_WINDOW_MS / 1000,
+    max_events=Config.LABEL_COMMIT_MAX_EVENTS,
+    on_flush=publish_labels
+)
+
+def load_snapshot():
+    """Devuelve el snapshot actual (datos e índice); la revalidación contra S3 ocurre fuera de la petición."""
+    try:
+        snapshot = dataset_cache.get_snapshot()
+        if snapshot is not None:
+            return snapshot
+    except Exception as e:
+        logger.error(f"Error al obtener datos de la caché: {e}")
+    df = normalize_messages(load_data_local())
+    return DatasetSnapshot(df, None, FilterIndex(df))
+
+def channel_titles(snapshot):
+    """
+    Canales del dataset completo. Con particiones se leen del manifiesto, que describe
+    también las que no están cargadas; si no, de la columna Title del snapshot.
+    """
+    if snapshot.partitions is not None:
+        # Mismo criterio que normalize_messages para los títulos vacíos
+        titles = {entry.get('title') or 'Desconocido' for entry in snapshot.partitions.manifest['partitions']}
+        return sorted(titles)
+    df = snapshot.df
+    if df.empty or 'Title' not in df.columns:
+        return []
+    return sorted(df['Title'].unique().tolist())
+
+def load_data():
+    """Devuelve el DataFrame del snapshot actual."""
+    return load_snapshot().df
 
 def load_data_local():
-    """Carga los datos del archivo JSON local como fallback."""
+    """Carga los datos del snapshot columnar local, o del archivo JSON heredado, como fallback."""
     try:
         json_path = 'telegram_messages.json'
-        if not os.path.exists(json_path):
+        if os.path.exists(SNAPSHOT_FILE):
+            df = read_snapshot(SNAPSHOT_FILE)
+        elif not os.path.exists(json_path):
             logger.warning(f"El archivo {json_path} no existe.")
             return pd.DataFrame()
-        
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Convertir los mensajes a DataFrame
-        df = pd.DataFrame(data['messages'])
-        
-        # Verificar y limpiar la columna Title (usada como Channel)
-        if 'Title' in df.columns:
-            df['Title'] = df['Title'].fillna('Desconocido')
-            df['Title'] = df['Title'].replace('', 'Desconocido')
-        
-        # Convertir columnas de fecha si existen
-        date_columns = ['Date', 'Date Sent', 'Creation Date', 'Edit Date']
-        for col in date_columns:
-            if col in df.columns:
-                try:
-                    df[col] = pd.to_datetime(df[col]).dt.tz_localize(None)
-                except Exception as e:
-                    logger.warning(f"Error al convertir la columna '{col}': {e}")
-                    if col in df.columns:
-                        del df[col]
+        else:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            # Convertir los mensajes a DataFrame
+            df = pd.DataFrame(data['messages'])
         
         logger.info(f"Datos cargados desde archivo local: {len(df)} mensajes")
         return df
@@ -170,44 +474,34 @@ users_db = {}
 
 @app.route('/health')
 def health_check():
-    """Endpoint para verificar el estado del servicio."""
-    return jsonify({"status": "healthy"}), 200
+    """Endpoint para verificar el estado del servicio y del snapshot del dataset."""
+    return jsonify({
+        "status": "healthy",
+        "dataset": dataset_cache.status(),
+        "query_cache": query_cache.stats(),
+        "labels": label_log.stats(),
+        "label_writer": label_writer.stats(),
+        "jobs": job_runner.stats(),
+        "disk_cache": get_disk_cache().stats()
+    }), 200
 
 
-def save_data(df):
-    """Guarda los datos en S3."""
-    try:
-        # Convertir DataFrame a JSON
-        json_data = json.dumps({'messages': df.to_dict(orient='records')})
-        
-        # Subir a S3
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key=S3_KEY,
-            Body=json_data.encode('utf-8'),
-            ContentType='application/json'
-        )
-        return True
-    except Exception as e:
-        print(f"Error al guardar en S3: {e}")
-        return False
-
 @app.route('/')
 def index():
     """Renderiza la página principal con los mensajes ordenados por puntuación."""
-    df = load_data()
-    if df.empty:
+    snapshot = load_snapshot()
+    if snapshot.df.empty:
         return render_template('index.html', messages=[], channels=[], min_date='', max_date='')
 
-    # Preparar datos para la plantilla inicial
-    sorted_df = df.sort_values(by='Score', ascending=False) if 'Score' in df.columns else df
-    displayed_df = sorted_df.head(MESSAGES_LIMIT)
+    # Preparar datos para la plantilla inicial: los primeros por puntuación, sin ordenar el dataset
+    df = snapshot.df
+    top_positions = run_query(QueryPlan('score'), snapshot, query_cache).page(snapshot.index, 0, MESSAGES_LIMIT)
+    displayed_df = df.iloc[top_positions]
     messages = displayed_df[['Embed', 'Score', 'Message ID', 'URL', 'Label']].to_dict(orient='records') if not displayed_df.empty else []
 
     # Obtener datos para filtros (canales, fechas)
-    channels = []
-    if 'Title' in df.columns:
-        channels = sorted(df['Title'].unique().tolist())
+    channels = channel_titles(snapshot)
+    if channels:
         print(f"\nCanales que se pasan a la plantilla: {channels}")
     
     min_date = df['Date'].min().strftime('%Y-%m-%d') if 'Date' in df.columns and not df['Date'].empty else ''
@@ -217,116 +511,86 @@ def index():
 
 @app.route('/load_more/<int:offset>', methods=['GET'])
 def load_more(offset=0):
-    """Carga más mensajes a partir de un offset dado."""
+    """
+    Carga más mensajes a partir de un offset dado, o del parámetro `cursor` si se
+    indica. El cursor de la página siguiente se devuelve en la cabecera X-Next-Cursor.
+    """
     try:
-        # Obtener los filtros de la URL
-        filters = {
-            'dateStart': request.args.get('dateStart'),
-            'dateEnd': request.args.get('dateEnd'),
-            'channel': request.args.get('channel'),
-            'scoreMin': request.args.get('scoreMin'),
-            'scoreMax': request.args.get('scoreMax'),
-            'mediaType': request.args.get('mediaType'),
-            'sortBy': request.args.get('sortBy', 'score')
-        }
-
-        df = load_data()
-        if df.empty:
+        snapshot = load_snapshot()
+        if snapshot.df.empty:
             return ('', 204) # No Content
 
-        # Aplicar los mismos filtros que en /filter_messages
-        filtered_df = df.copy()
-
-        # Filtro de Fecha (Rango)
-        if 'Date Sent' in filtered_df.columns:
-            try:
-                filtered_df['Date Sent'] = pd.to_datetime(filtered_df['Date Sent']).dt.tz_localize(None)
-                
-                if filters['dateStart']:
-                    date_start = pd.to_datetime(filters['dateStart']).normalize()
-                    filtered_df = filtered_df[filtered_df['Date Sent'].dt.normalize() >= date_start]
-                
-                if filters['dateEnd']:
-                    date_end = pd.to_datetime(filters['dateEnd']).normalize() + pd.Timedelta(days=1)
-                    filtered_df = filtered_df[filtered_df['Date Sent'].dt.normalize() < date_end]
-            except Exception as e:
-                print(f"Error en filtro de fechas: {str(e)}")
-                return ('', 204)
-
-        # Filtro de Canal (uno o varios)
-        if filters['channel'] and 'Title' in filtered_df.columns:
-            channel_filter = filters['channel']
-            if isinstance(channel_filter, str) and ',' in channel_filter:
-                channel_filter = [c for c in channel_filter.split(',') if c]
-            if isinstance(channel_filter, list):
-                filtered_df = filtered_df[filtered_df['Title'].isin(channel_filter)]
-            else:
-                filtered_df = filtered_df[filtered_df['Title'] == channel_filter]
+        # Los mismos filtros que /filter_messages, leídos de la URL
+        try:
+            plan = parse_query(request.args)
+        except QueryError as e:
+            logger.warning(f"Filtros no válidos en load_more: {e}")
+            return ('', 204)
+        # Las fechas anteriores a la ventana caliente cargan sus particiones bajo demanda
+        snapshot = ensure_partitions(snapshot, plan)
 
-        # Filtro de Puntuación (Score) Mínima
-        if filters['scoreMin'] and 'Score' in filtered_df.columns:
-            try:
-                score_min = float(filters['scoreMin'])
-                filtered_df['Score'] = pd.to_numeric(filtered_df['Score'], errors='coerce')
-                filtered_df = filtered_df[filtered_df['Score'] >= score_min]
-            except:
-                pass
-
-        # Filtro de Puntuación (Score) Máxima
-        if filters['scoreMax'] and 'Score' in filtered_df.columns:
-            try:
-                score_max = float(filters['scoreMax'])
-                filtered_df['Score'] = pd.to_numeric(filtered_df['Score'], errors='coerce')
-                filtered_df = filtered_df[filtered_df['Score'] <= score_max]
-            except:
-                pass
-
-        # Filtro de Tipo de Media
-        if filters['mediaType'] and 'Media Type' in filtered_df.columns:
-            try:
-                filtered_df['Media Type'] = filtered_df['Media Type'].astype(str).str.lower()
-                filtered_df = filtered_df[filtered_df['Media Type'] == str(filters['mediaType']).lower()]
-            except:
-                pass
-
-        # Ordenar
-        if filters['sortBy'] == 'views' and 'Views' in filtered_df.columns:
-            filtered_df['Views'] = pd.to_numeric(filtered_df['Views'], errors='coerce')
-            sorted_df = filtered_df.sort_values(by='Views', ascending=False)
-        elif 'Score' in filtered_df.columns:
-            filtered_df['Score'] = pd.to_numeric(filtered_df['Score'], errors='coerce')
-            sorted_df = filtered_df.sort_values(by='Score', ascending=False)
-        else:
-            sorted_df = filtered_df
+        # Las páginas siguientes de la misma consulta salen de la caché como un slice
+        result = run_query(plan, snapshot, query_cache)
 
+        cursor_token = request.args.get('cursor')
         # Asegúrate de que el índice no esté fuera de los límites
-        if offset >= len(sorted_df):
+        if not cursor_token and offset >= result.total:
             return ('', 204) # No hay más mensajes que cargar
 
-        displayed_df = sorted_df.iloc[offset:offset+24]
+        try:
+            page_positions, next_cursor = fetch_page(snapshot, result, offset, 24, cursor_token)
+        except CursorError as e:
+            logger.warning(f"Error de paginación en load_more: {e}")
+            return ('', 204)
+
+        displayed_df = snapshot.df.iloc[page_positions]
 
         # Si displayed_df está vacío después de iloc
         if displayed_df.empty:
             return ('', 204)
 
         # Preparar mensajes
-        messages = []
-        for _, row in displayed_df.iterrows():
-            msg = {}
-            msg['Embed'] = row.get('Embed', '')
-            score = row.get('Score')
-            msg['Score'] = round(score, 2) if pd.notna(score) and isinstance(score, (int, float)) else 'N/A'
-            msg['Message ID'] = row.get('Message ID', '')
-            msg['URL'] = row.get('URL', '')
-            msg['Label'] = row.get('Label', None)
-            messages.append(msg)
+        messages = to_records(
+            displayed_df,
+            CARD_COLUMNS,
+            decimals={'Score': 2},
+            missing={'Embed': '', 'Score': 'N/A', 'Message ID': '', 'URL': ''}
+        )
 
-        return render_template('message_cards_partial.html', messages=messages)
+        response = make_response(render_template('message_cards_partial.html', messages=messages))
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
 
     except Exception as e:
-        print(f"Error en load_more: {str(e)}")
+        logger.error(f"Error en load_more: {e}")
         return ('', 204)
 
+def label_user():
+    """Usuario que etiqueta, si la petición trae un token válido."""
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+        return str(identity) if identity is not None else None
+    except Exception:
+        return None
+
+def label_events(df, labels, user=None):
+    """
+    Eventos de etiquetado para `labels` ({message_id: label}): uno por canal que tenga
+    ese Message ID. Devuelve (eventos, ids no encontrados).
+    """
+    rows = np.flatnonzero(df['Message ID'].isin(list(labels)).to_numpy())
+    found = df.iloc[rows]
+    pairs = pd.DataFrame({
+        'channel': channel_keys(found).to_numpy(),
+        'message_id': found['Message ID'].to_numpy()
+    }).drop_duplicates()
+    events = [make_label_event(channel, message_id, labels[int(message_id)], user)
+              for channel, message_id in pairs.itertuples(index=False)]
+    missing = sorted(set(labels) - {int(message_id) for message_id in pairs['message_id']})
+    return events, missing
+
 @app.route('/label', methods=['POST'])
 def label_message():
     """Etiqueta un mensaje con un valor específico."""
@@ -338,7 +602,8 @@ def label_message():
         message_id = int(data['message_id'])
         label = int(data['label'])
 
-        df = load_data()
+        snapshot = load_snapshot()
+        df = snapshot.df
         if df.empty:
             return jsonify(success=False, error="No hay datos disponibles o error al cargar"), 404
 
@@ -347,89 +612,261 @@ def label_message():
             return jsonify(success=False, error="La columna 'Message ID' no existe en el archivo JSON"), 500
 
         # Verifica si el message_id existe en el DataFrame
-        if message_id not in df['Message ID'].values:
-            print(f"Advertencia: message_id {message_id} no encontrado en el DataFrame para etiquetar.")
+        events, missing = label_events(df, {message_id: label}, label_user())
+        if missing:
+            logger.warning(f"message_id {message_id} no encontrado en el DataFrame para etiquetar")
             return jsonify(success=True, message="Message ID no encontrado, pero operación ignorada.")
 
-        # Actualiza el DataFrame
-        if 'Label' not in df.columns:
-            df['Label'] = pd.NA
-
-        df.loc[df['Message ID'] == message_id, 'Label'] = label
-
-        # Guarda en S3
-        if not save_data(df):
+        # Se confirma cuando el flush agrupado que incluye el evento es duradero
+        try:
+            label_writer.write(events)
+        except Exception as e:
+            logger.exception(f"Error al registrar la etiqueta: {e}")
             return jsonify(success=False, error="Error al guardar cambios en S3"), 500
 
         return jsonify(success=True)
     except ValueError as e:
         return jsonify(success=False, error=f"Error en los datos de entrada: {str(e)}"), 400
     except Exception as e:
-        print(f"Error inesperado en /label: {e}")
+        logger.exception(f"Error inesperado en /label: {e}")
         return jsonify(success=False, error=f"Error inesperado en el servidor: {str(e)}"), 500
 
-@app.route('/export_relevants', methods=['GET'])
-def export_relevants():
-    """Exporta los mensajes etiquetados como relevantes a un nuevo archivo CSV."""
+@app.route('/label/batch', methods=['POST'])
+def label_batch():
+    """
+    Etiqueta varios mensajes en una petición: {"labels": [{"message_id": ..., "label": ...}, ...]}.
+    Los ids que no existen se ignoran y se devuelven en `ignored`.
+    """
     try:
-        df = load_data()
+        data = request.json
+        items = data.get('labels') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify(success=False, error="Datos incompletos"), 400
+        if len(items) > Config.LABEL_BATCH_MAX_ITEMS:
+            return jsonify(success=False, error=f"Máximo {Config.LABEL_BATCH_MAX_ITEMS} etiquetas por petición"), 400
+
+        # Si un mensaje aparece varias veces, vale la última etiqueta
+        labels = {}
+        for item in items:
+            if not isinstance(item, dict) or 'message_id' not in item or 'label' not in item:
+                return jsonify(success=False, error="Datos incompletos"), 400
+            labels[int(item['message_id'])] = int(item['label'])
+
+        snapshot = load_snapshot()
+        df = snapshot.df
         if df.empty:
             return jsonify(success=False, error="No hay datos disponibles o error al cargar"), 404
+        if 'Message ID' not in df.columns:
+            return jsonify(success=False, error="La columna 'Message ID' no existe en el archivo JSON"), 500
 
-        # Verifica si la columna 'Label' existe
-        if 'Label' not in df.columns:
-            return jsonify(success=False, error="No hay columna 'Label' para filtrar mensajes relevantes"), 404
-
-        # Filtra los mensajes etiquetados como relevantes (Label == 1)
-        # Maneja posibles NaNs o tipos incorrectos en 'Label'
+        events, missing = label_events(df, labels, label_user())
+        if missing:
+            logger.warning(f"{len(missing)} message_id no encontrados en el DataFrame para etiquetar")
         try:
-            # Intentar convertir a numérico (float), luego comparar con 1.0
-            relevant_df = df[pd.to_numeric(df['Label'], errors='coerce') == 1.0]
+            if events:
+                label_writer.write(events)
         except Exception as e:
-             print(f"Error al filtrar relevantes por Label: {e}")
-             return jsonify(success=False, error="Error al procesar la columna 'Label'"), 500
+            logger.exception(f"Error al registrar las etiquetas: {e}")
+            return jsonify(success=False, error="Error al guardar cambios en S3"), 500
 
-        if relevant_df.empty:
-            return jsonify(success=True, message="No hay mensajes etiquetados como relevantes para exportar."), 200 # O 404 si prefieres error
+        return jsonify(success=True, labeled=len(labels) - len(missing), ignored=missing)
+    except ValueError as e:
+        return jsonify(success=False, error=f"Error en los datos de entrada: {str(e)}"), 400
+    except Exception as e:
+        logger.exception(f"Error inesperado en /label/batch: {e}")
+        return jsonify(success=False, error=f"Error inesperado en el servidor: {str(e)}"), 500
 
-        # Guarda en un nuevo CSV tanto localmente como en S3
-        export_path = 'telegram_messages_relevant.csv'
+def export_plan(params):
+    """Plan de una exportación: los filtros de /filter_messages, con los relevantes (Label == 1) por defecto."""
+    plan = parse_query(params)
+    if plan.filters['label'] is None:
+        plan.filters['label'] = FilterIndex.parse_label(1)
+    return plan
+
+def export_positions(snapshot, plan):
+    """Posiciones exportadas, en el orden del dataset, resueltas con el índice del snapshot."""
+    return np.sort(run_query(plan, snapshot).positions)
+
+@app.route('/export_relevants', methods=['GET'])
+def export_relevants():
+    """Exporta los mensajes etiquetados como relevantes a un nuevo archivo CSV."""
+    try:
+        # El CSV se genera en el pool de trabajos; si tarda más que la espera se responde con el trabajo
         try:
-            # Guardar localmente
-            relevant_df.to_csv(export_path, index=False, encoding='utf-8')
-            logger.info(f"Mensajes relevantes exportados localmente a {export_path}")
-            
-            # Intentar guardar en S3
-            try:
-                s3_client = get_s3_client()
-                if s3_client.check_connection():
-                    s3_client.upload_dataframe(relevant_df, 'telegram_messages_relevant.csv', format='csv')
-                    logger.info("Mensajes relevantes exportados a S3")
-                    return jsonify(success=True, message=f"Exportado localmente y a S3")
-                else:
-                    logger.warning("No se pudo conectar con S3, solo se exportó localmente")
-                    return jsonify(success=True, message=f"Exportado localmente a {export_path}")
-            except Exception as s3_error:
-                logger.warning(f"Error al exportar a S3: {s3_error}, solo se exportó localmente")
-                return jsonify(success=True, message=f"Exportado localmente a {export_path}")
-                
-        except Exception as e:
-            logger.error(f"Error al guardar el archivo CSV de relevantes: {e}")
-            return jsonify(success=False, error=f"Error al guardar el archivo exportado: {str(e)}"), 500
+            job = job_runner.submit('export_relevants', {})
+        except NothingToExport as e:
+            return jsonify(success=True, message=str(e)), 200
+        except JobError as e:
+            return jsonify(success=False, error=str(e)), 404
+        if not job_runner.wait(job, Config.JOBS_SYNC_WAIT):
+            return jsonify(success=True, message="Exportación en curso", job=job.to_dict()), 202
+        if job.status == JOB_FAILED:
+            logger.error(f"Error al guardar el archivo CSV de relevantes: {job.error}")
+            return jsonify(success=False, error=f"Error al guardar el archivo exportado: {job.error}"), 500
+        if job.result['key']:
+            return jsonify(success=True, message=f"Exportado localmente y a S3")
+        return jsonify(success=True, message=f"Exportado localmente a {job.result['path']}")
+
+    except Exception as e:
+        logger.exception(f"Error inesperado en /export_relevants: {e}")
+        return jsonify(success=False, error=f"Error inesperado en el servidor: {str(e)}"), 500
+
+@app.route('/api/export', methods=['GET', 'POST'])
+def export_messages():
+    """
+    Exporta en streaming los mensajes que cumplen los filtros de /filter_messages
+    (por defecto, los relevantes) en `format` csv, csv.gz o parquet. Con
+    `destination=s3` el archivo se sube con una subida multiparte en lugar de
+    enviarse en la respuesta. La memoria no depende del tamaño de la exportación.
+    """
+    try:
+        params = request.json if request.method == 'POST' and request.is_json else request.args
+        params = params or {}
+        export_format = params.get('format', 'csv.gz')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify(success=False, error=f"Formato no soportado: {export_format}"), 400
+        try:
+            plan = export_plan(params)
+        except QueryError as e:
+            return jsonify(success=False, error=str(e)), 400
+
+        snapshot = ensure_partitions(load_snapshot(), plan)
+        df = snapshot.df
+        if df.empty:
+            return jsonify(success=False, error="No hay datos disponibles o error al cargar"), 404
+        positions = export_positions(snapshot, plan)
+        chunks = iter_export(df, positions, export_format, Config.EXPORT_CHUNK_SIZE)
+        extension, mimetype = EXPORT_FORMATS[export_format]
+        filename = f"telegram_messages_export.{extension}"
+
+        if params.get('destination') == 's3':
+            key = f"exports/{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{filename}"
+            upload = multipart_upload(get_s3_client(), key, chunks, content_type=mimetype)
+            return jsonify(success=True, key=key, rows=int(len(positions)), bytes=upload['size'],
+                           sha256=upload['sha256'], parts=upload['parts'])
+
+        response = app.response_class(chunks, mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['X-Total-Count'] = str(len(positions))
+        return response
+    except Exception as e:
+        logger.exception(f"Error inesperado en /api/export: {e}")
+        return jsonify(success=False, error=f"Error inesperado en el servidor: {str(e)}"), 500
 
+# Archivos Arrow con los datos exportables, por versión de los datos y con referencias de los trabajos
+EXPORT_SOURCES_KEPT = 2
+export_sources = ExportSources(Config.JOBS_ARTIFACT_DIR, kept=EXPORT_SOURCES_KEPT)
+
+@contextmanager
+def export_job_args(snapshot, positions):
+    """
+    Argumentos de un trabajo de exportación: archivo de datos, posiciones, sus etiquetas
+    y columnas. El archivo se escribe (una vez por versión de los datos; las etiquetas
+    viajan aparte) en el hilo del trabajo y queda reservado hasta que este termina.
+    """
+    df = snapshot.df
+    labels = df['Label'].to_numpy()[positions] if 'Label' in df.columns else None
+    with export_sources.use(df, snapshot.data_version) as source:
+        yield source, positions, labels, export_columns(df)
+
+def prepare_export_job(params):
+    """Trabajo 'export': los parámetros de /api/export, con destino local (descarga posterior) o s3."""
+    export_format = params.get('format', 'csv.gz')
+    if export_format not in EXPORT_FORMATS:
+        raise JobError(f"Formato no soportado: {export_format}")
+    destination = params.get('destination', 'local')
+    if destination not in JOB_DESTINATIONS:
+        raise JobError(f"Destino no soportado: {destination}")
+    try:
+        plan = export_plan(params)
+    except QueryError as e:
+        raise JobError(str(e))
+    snapshot = ensure_partitions(load_snapshot(), plan)
+    if snapshot.df.empty:
+        raise JobError("No hay datos disponibles o error al cargar")
+    identity = (make_query_key(None, None, plan.filters), export_format, destination)
+
+    @contextmanager
+    def build(job):
+        with export_job_args(snapshot, export_positions(snapshot, plan)) as args:
+            yield run_export, args + (export_format, destination, f"export-{job.id}", Config.JOBS_ARTIFACT_DIR)
+    return snapshot.version, identity, build
+
+class NothingToExport(JobError):
+    """No hay filas que exportar."""
+
+def prepare_export_relevants_job(params):
+    """Trabajo 'export_relevants': el CSV de relevantes de /export_relevants."""
+    plan = export_plan({})
+    snapshot = load_snapshot()
+    if snapshot.df.empty:
+        raise JobError("No hay datos disponibles o error al cargar")
+    if 'Label' not in snapshot.df.columns:
+        raise JobError("No hay columna 'Label' para filtrar mensajes relevantes")
+    # Los relevantes (Label == 1) salen del bitmap de etiquetas del índice, sin recorrer el dataset
+    positions = export_positions(snapshot, plan)
+    if len(positions) == 0:
+        raise NothingToExport("No hay mensajes etiquetados como relevantes para exportar.")
+
+    @contextmanager
+    def build(job):
+        with export_job_args(snapshot, positions) as args:
+            yield run_export_relevants, args + ('telegram_messages_relevant.csv', 'telegram_messages_relevant.csv')
+    return snapshot.version, None, build
+
+# Trabajos pesados en un pool acotado de procesos, deduplicados y cacheados por versión del dataset
+job_runner = JobRunner(
+    max_workers=Config.JOBS_MAX_WORKERS,
+    max_jobs=Config.JOBS_MAX_RESULTS,
+    artifact_dir=Config.JOBS_ARTIFACT_DIR
+)
+job_runner.register('export', prepare_export_job)
+job_runner.register('export_relevants', prepare_export_relevants_job)
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Envía un trabajo en segundo plano: `{"kind": "export", "params": {...}}`. Devuelve
+    el trabajo (202) para consultarlo en /api/jobs/<id>; si ya hay uno idéntico en
+    curso o terminado para la misma versión del dataset, se devuelve ese.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        job = job_runner.submit(data.get('kind', 'export'), data.get('params') or {})
+        status = 200 if job.status == JOB_DONE else 202
+        return jsonify(success=True, job=job.to_dict()), status
+    except JobError as e:
+        return jsonify(success=False, error=str(e)), 400
     except Exception as e:
-        print(f"Error inesperado en /export_relevants: {e}")
+        logger.exception(f"Error inesperado en /api/jobs: {e}")
         return jsonify(success=False, error=f"Error inesperado en el servidor: {str(e)}"), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Estado de un trabajo y, cuando termina, su resultado."""
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify(success=False, error="Trabajo no encontrado"), 404
+    return jsonify(success=True, job=job.to_dict())
+
+@app.route('/api/jobs/<job_id>/artifact', methods=['GET'])
+def get_job_artifact(job_id):
+    """Descarga el artefacto local de un trabajo terminado."""
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify(success=False, error="Trabajo no encontrado"), 404
+    if job.status != JOB_DONE or not (job.result or {}).get('filename'):
+        return jsonify(success=False, error="El trabajo no tiene un artefacto local disponible"), 409
+    if not os.path.exists(job.result['path']):
+        return jsonify(success=False, error="El artefacto ya no está disponible"), 410
+    return send_file(job.result['path'], mimetype=job.result['mimetype'], as_attachment=True,
+                     download_name=job.result['filename'])
+
 @app.route('/channels', methods=['GET'])
 def get_channels():
     """Devuelve la lista de canales disponibles."""
     try:
-        df = load_data()
-        if df.empty or 'Title' not in df.columns:
-            return jsonify(success=True, channels=[])
-        channels = sorted(df['Title'].fillna('Desconocido').replace('', 'Desconocido').unique().tolist())
-        return jsonify(success=True, channels=channels)
+        return jsonify(success=True, channels=channel_titles(load_snapshot()))
     except Exception as e:
         print(f"Error en /channels: {e}")
         return jsonify(success=False, error=str(e)), 500
@@ -442,99 +879,26 @@ def filter_messages():
         if not filters:
             return jsonify(success=False, error="No se proporcionaron filtros"), 400
 
-        df = load_data()
-        if df.empty:
+        snapshot = load_snapshot()
+        if snapshot.df.empty:
             return jsonify(success=True, messages=[], total_messages=0)
 
         # --- Aplicar filtros ---
-        filtered_df = df.copy()
-
-        # Filtro de Fecha (Rango)
-        date_start_str = filters.get('dateStart')
-        date_end_str = filters.get('dateEnd')
-        if 'Date Sent' in filtered_df.columns:
-            try:
-                # Asegurarnos de que la columna Date Sent esté en el formato correcto
-                filtered_df['Date Sent'] = pd.to_datetime(filtered_df['Date Sent']).dt.tz_localize(None)
-                
-                if date_start_str:
-                    # Convertir la fecha de inicio a datetime sin zona horaria
-                    date_start = pd.to_datetime(date_start_str).normalize()
-                    filtered_df = filtered_df[filtered_df['Date Sent'].dt.normalize() >= date_start]
-                
-                if date_end_str:
-                    # Convertir la fecha de fin a datetime sin zona horaria y añadir un día
-                    date_end = pd.to_datetime(date_end_str).normalize() + pd.Timedelta(days=1)
-                    filtered_df = filtered_df[filtered_df['Date Sent'].dt.normalize() < date_end]
-                
-            except Exception as e:
-                print(f"Error en filtro de fechas: {str(e)}")
-                return jsonify(success=False, error=f"Error en filtro de fechas: {str(e)}"), 400
+        # Se validan al compilar la consulta y los resuelve el índice del snapshot
+        try:
+            plan = parse_query(filters)
+        except QueryError as e:
+            logger.warning(f"Filtros no válidos en /filter_messages: {e}")
+            return jsonify(success=False, error=str(e)), 400
+        # Las fechas anteriores a la ventana caliente cargan sus particiones bajo demanda
+        snapshot = ensure_partitions(snapshot, plan)
 
-        # Filtro de Canal (usando Title)
-        channel = filters.get('channel')
-        if channel and 'Title' in filtered_df.columns:
-            try:
-                if isinstance(channel, list):
-                    filtered_df = filtered_df[filtered_df['Title'].isin(channel)]
-                    print(f"Filtrado por canales: {channel}")
-                else:
-                    filtered_df = filtered_df[filtered_df['Title'] == channel]
-                    print(f"Filtrado por canal: {channel}")
-            except Exception as e:
-                print(f"Error en filtro de canal: {str(e)}")
-                return jsonify(success=False, error=f"Error en filtro de canal: {str(e)}"), 400
-
-        # Filtro de Puntuación (Score) Mínima
-        score_min_str = filters.get('scoreMin')
-        if score_min_str and 'Score' in filtered_df.columns:
-            try:
-                score_min = float(score_min_str)
-                filtered_df['Score'] = pd.to_numeric(filtered_df['Score'], errors='coerce')
-                filtered_df = filtered_df[filtered_df['Score'] >= score_min]
-                print(f"Filtrado por score mínimo: {score_min}")
-            except Exception as e:
-                print(f"Error en filtro de score mínimo: {str(e)}")
-                return jsonify(success=False, error=f"Error en filtro de score mínimo: {str(e)}"), 400
-
-        # Filtro de Puntuación (Score) Máxima
-        score_max_str = filters.get('scoreMax')
-        if score_max_str and 'Score' in filtered_df.columns:
-            try:
-                score_max = float(score_max_str)
-                filtered_df['Score'] = pd.to_numeric(filtered_df['Score'], errors='coerce')
-                filtered_df = filtered_df[filtered_df['Score'] <= score_max]
-                print(f"Filtrado por score máximo: {score_max}")
-            except Exception as e:
-                print(f"Error en filtro de score máximo: {str(e)}")
-                return jsonify(success=False, error=f"Error en filtro de score máximo: {str(e)}"), 400
-
-        # Filtro de Tipo de Media
-        media_type = filters.get('mediaType')
-        if media_type and 'Media Type' in filtered_df.columns:
-            try:
-                filtered_df['Media Type'] = filtered_df['Media Type'].astype(str).str.lower()
-                filtered_df = filtered_df[filtered_df['Media Type'] == str(media_type).lower()]
-                print(f"Filtrado por tipo de media: {media_type}")
-            except Exception as e:
-                print(f"Error en filtro de tipo de media: {str(e)}")
-                return jsonify(success=False, error=f"Error en filtro de tipo de media: {str(e)}"), 400
-
-        # Ordenar y preparar resultados
-        sort_by = filters.get('sortBy', 'score')
         try:
-            if sort_by == 'views' and 'Views' in filtered_df.columns:
-                filtered_df['Views'] = pd.to_numeric(filtered_df['Views'], errors='coerce')
-                sorted_df = filtered_df.sort_values(by='Views', ascending=False)
-            elif 'Score' in filtered_df.columns:
-                filtered_df['Score'] = pd.to_numeric(filtered_df['Score'], errors='coerce')
-                sorted_df = filtered_df.sort_values(by='Score', ascending=False)
-            else:
-                sorted_df = filtered_df
-            print(f"Ordenado por: {sort_by}")
+            # Las páginas siguientes de la misma consulta salen de la caché como un slice
+            result = run_query(plan, snapshot, query_cache)
         except Exception as e:
-            print(f"Error al ordenar los datos: {e}")
-            sorted_df = filtered_df
+            logger.warning(f"Error al aplicar los filtros: {e}")
+            return jsonify(success=False, error=f"Error al aplicar los filtros: {str(e)}"), 400
 
         # Paginación
         try:
@@ -558,36 +922,33 @@ def filter_messages():
             per_page = max(1, min(per_page, 100))  # Limitar a 100 mensajes por página
             
             start_idx = (page - 1) * per_page
-            end_idx = start_idx + per_page
-
-            # Seleccionar solo los mensajes de la página actual
-            paginated_df = sorted_df.iloc[start_idx:end_idx]
-            print(f"Paginación: página {page}, {per_page} mensajes por página")
+            logger.debug(f"Paginación: página {page}, {per_page} mensajes por página")
         except Exception as e:
-            print(f"Error en paginación: {str(e)}")
+            logger.warning(f"Error en paginación: {e}")
             return jsonify(success=False, error=f"Error en paginación: {str(e)}"), 400
 
+        # Con cursor se continúa tras la última fila servida; si no, desde el offset
+        try:
+            page_positions, next_cursor = fetch_page(snapshot, result, start_idx, per_page, filters.get('cursor'))
+        except CursorError as e:
+            logger.warning(f"Error de paginación: {e}")
+            return jsonify(success=False, error=str(e)), 400
+
+        # Seleccionar solo los mensajes de la página actual
+        paginated_df = snapshot.df.iloc[page_positions]
+
         # Seleccionar columnas y convertir a dict
         try:
-            required_columns = ['Embed', 'Score', 'Message ID', 'URL', 'Label']
-            messages = []
-            for _, row in paginated_df.iterrows():
-                msg = {}
-                for col in required_columns:
-                    if col in row:
-                        msg[col] = row[col] if pd.notna(row[col]) else None
-                    else:
-                        msg[col] = None
-                messages.append(msg)
-            print(f"Total de mensajes filtrados: {len(messages)}")
+            messages = to_records(paginated_df, CARD_COLUMNS)
+            logger.debug(f"Mensajes en la página: {len(messages)} de {result.total}")
         except Exception as e:
-            print(f"Error al preparar mensajes: {str(e)}")
+            logger.warning(f"Error al preparar mensajes: {e}")
             return jsonify(success=False, error=f"Error al preparar mensajes: {str(e)}"), 400
 
-        return jsonify(success=True, messages=messages, total_messages=len(sorted_df))
+        return jsonify(success=True, messages=messages, total_messages=result.total, next_cursor=next_cursor)
 
     except Exception as e:
-        print(f"Error crítico en /filter_messages: {e}")
+        logger.error(f"Error crítico en /filter_messages: {e}")
         return jsonify(success=False, error=f"Error al procesar los filtros: {str(e)}"), 500
 
 # Nueva ruta para renderizar el parcial HTML
@@ -654,26 +1015,48 @@ def login():
 
 @app.route('/api/messages', methods=['GET'])
 def get_messages():
-    """Endpoint para obtener los mensajes para el frontend."""
+    """
+    Endpoint para obtener los mensajes para el frontend.
+
+    Con `Accept: application/x-ndjson` o `?stream=1` la respuesta se emite como NDJSON
+    por bloques, para que los consumidores masivos lean el dataset de forma incremental.
+    Admite los filtros `channel` (separados por comas), `dateStart`, `dateEnd`,
+    `mediaType`, `label`, `scoreMin` y `scoreMax`, y `fields` para elegir las columnas.
+    """
     try:
-        df = load_data()
+        snapshot = load_snapshot()
+        df = snapshot.df
+        stream = request.args.get('stream') in ('1', 'true') or \
+            request.accept_mimetypes.best == 'application/x-ndjson'
+
+        # Proyección: columnas pedidas, sin exponer las derivadas
+        columns = API_COLUMNS
+        if request.args.get('fields'):
+            columns = [col.strip() for col in request.args['fields'].split(',') if col.strip()]
+            unknown = [col for col in columns if col not in df.columns or col in DERIVED_COLUMNS]
+            if unknown and not df.empty:
+                return jsonify(success=False, error=f"Columnas desconocidas: {', '.join(unknown)}"), 400
+
+        # Filtros opcionales, resueltos con el índice del snapshot (en el orden del dataset)
+        try:
+            plan = parse_query(request.args)
+        except QueryError as e:
+            return jsonify(success=False, error=str(e)), 400
+        snapshot = ensure_partitions(snapshot, plan)
+        df = snapshot.df
+
+        positions = run_query(plan, snapshot).positions if plan.is_filtered and not df.empty else None
+
+        if stream:
+            chunks = iter_ndjson(df, columns, positions, chunk_size=Config.API_STREAM_CHUNK_SIZE) if not df.empty else iter(())
+            return app.response_class(chunks, mimetype='application/x-ndjson')
+
         if df.empty:
             return jsonify(success=True, messages=[])
 
-        # Seleccionar las columnas necesarias
-        required_columns = ['Message ID', 'Message Text', 'Title', 'Views', 'Average Views', 'Label']
-        messages = []
-        
-        for _, row in df.iterrows():
-            msg = {}
-            for col in required_columns:
-                if col in row:
-                    msg[col] = row[col] if pd.notna(row[col]) else None
-                else:
-                    msg[col] = None
-            messages.append(msg)
-
-        return jsonify(success=True, messages=messages)
+        # Seleccionar las columnas necesarias y codificarlas a JSON sin pasar por dicts
+        messages = to_json_records(df if positions is None else df.iloc[positions], columns)
+        return app.response_class('{"success":true,"messages":' + messages + '}', mimetype='application/json')
 
     except Exception as e:
         print(f"Error en /api/messages: {e}")
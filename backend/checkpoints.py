@@ -0,0 +1,97 @@
+import os
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = 'scraper_checkpoints.json'
+
+def _as_utc(date):
+    if date is None:
+        return None
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date)
+    return date if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+
+class CheckpointStore:
+    """
+    Marcas de agua del scraper por canal, persistidas en un JSON local:
+
+    - `last_id` / `last_date`: el mensaje más reciente descargado. La siguiente
+      ejecución solo pide los mensajes con id mayor (`min_id`).
+    - `recent`: mensajes de la ventana de refresco (id -> [fecha, vistas]) cuyas
+      vistas todavía crecen. Se vuelven a pedir por id para actualizar `Views`; un
+      mensaje sale de la ventana por antigüedad, por tamaño o cuando sus vistas no
+      cambian entre dos lecturas.
+
+    `save()` escribe de forma atómica y solo debe llamarse después de guardar los
+    datos, para que un fallo al guardar no deje huecos.
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE, refresh_days=3, refresh_max=200):
+        self.path = path
+        self.refresh_days = refresh_days
+        self.refresh_max = refresh_max
+        self.channels = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('channels', {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudieron leer los checkpoints de {self.path}: {e}. Se descarga todo de nuevo.")
+            return {}
+
+    def min_id(self, channel):
+        """Id a partir del cual pedir mensajes nuevos, o None si el canal no tiene checkpoint."""
+        checkpoint = self.channels.get(channel)
+        return checkpoint['last_id'] if checkpoint else None
+
+    def refresh_ids(self, channel, now=None):
+        """Ids de los mensajes recientes del canal cuyas vistas hay que volver a leer."""
+        checkpoint = self.channels.get(channel)
+        if not checkpoint or not self.refresh_days:
+            return []
+        since = (now or datetime.now(timezone.utc)) - timedelta(days=self.refresh_days)
+        return sorted(int(message_id) for message_id, (date, _) in checkpoint.get('recent', {}).items()
+                      if _as_utc(date) >= since)
+
+    def update(self, channel, messages, refreshed=(), now=None):
+        """Avanza el checkpoint del canal con los mensajes descargados y las vistas releídas."""
+        checkpoint = self.channels.setdefault(channel, {'last_id': None, 'last_date': None, 'recent': {}})
+        recent = checkpoint['recent']
+        for message in messages:
+            if not message or not message.date:
+                continue
+            if checkpoint['last_id'] is None or message.id > checkpoint['last_id']:
+                checkpoint['last_id'] = message.id
+                checkpoint['last_date'] = _as_utc(message.date).isoformat()
+            recent[str(message.id)] = [_as_utc(message.date).isoformat(), message.views or 0]
+        for message in refreshed:
+            key = str(message.id)
+            if key not in recent:
+                continue
+            if (message.views or 0) == recent[key][1]:
+                # Las vistas ya no crecen: no se vuelve a pedir
+                del recent[key]
+            else:
+                recent[key][1] = message.views or 0
+
+        since = (now or datetime.now(timezone.utc)) - timedelta(days=self.refresh_days)
+        kept = sorted(((int(key), value) for key, value in recent.items() if _as_utc(value[0]) >= since), reverse=True)
+        checkpoint['recent'] = {str(message_id): value for message_id, value in kept[:self.refresh_max]}
+        checkpoint['updated_at'] = (now or datetime.now(timezone.utc)).isoformat()
+
+    def save(self):
+        """Escribe los checkpoints en disco de forma atómica."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'channels': self.channels}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        logger.info(f"Checkpoints guardados en {self.path}: {len(self.channels)} canales")
+        return self.path
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 
 class Config:
@@ -33,6 +34,61 @@ class Config:
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
     
+    # Conexiones a S3 y a las URLs públicas (pool compartido por el proceso)
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 20))
+    S3_CONNECT_TIMEOUT = int(os.environ.get('S3_CONNECT_TIMEOUT', 5))
+    S3_READ_TIMEOUT = int(os.environ.get('S3_READ_TIMEOUT', 60))
+    S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', 5))
+    S3_HEALTH_CHECK_TTL = int(os.environ.get('S3_HEALTH_CHECK_TTL', 60))
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))
+    S3_DOWNLOAD_PART_SIZE = int(os.environ.get('S3_DOWNLOAD_PART_SIZE', 8 * 1024 * 1024))
+    S3_DOWNLOAD_CONCURRENCY = int(os.environ.get('S3_DOWNLOAD_CONCURRENCY', 8))
+    # Reinicios de una descarga por rangos si el objeto cambia a mitad (412 de IfMatch)
+    S3_DOWNLOAD_RESTARTS = int(os.environ.get('S3_DOWNLOAD_RESTARTS', 3))
+    S3_UPLOAD_PART_SIZE = int(os.environ.get('S3_UPLOAD_PART_SIZE', 8 * 1024 * 1024))
+    S3_UPLOAD_CONCURRENCY = int(os.environ.get('S3_UPLOAD_CONCURRENCY', 4))
+    
+    # Caché en disco de los objetos descargados de S3 (compartida por los procesos del host)
+    DISK_CACHE_DIR = os.environ.get('DISK_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'monitoria-s3-cache'))
+    DISK_CACHE_MAX_BYTES = int(os.environ.get('DISK_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+    # Recalcular el SHA-256 completo en cada acierto (el contenido ya se verifica al guardarlo)
+    DISK_CACHE_VERIFY = os.environ.get('DISK_CACHE_VERIFY', 'false').lower() == 'true'
+    
+    # Configuración de la caché del dataset (segundos entre revalidaciones contra S3)
+    DATASET_REVALIDATE_INTERVAL = int(os.environ.get('DATASET_REVALIDATE_INTERVAL', 60))
+    DATASET_BACKGROUND_REFRESH = os.environ.get('DATASET_BACKGROUND_REFRESH', 'true').lower() == 'true'
+    DATASET_WARMUP_TIMEOUT = int(os.environ.get('DATASET_WARMUP_TIMEOUT', 30))
+    # Días recientes que se cargan al arrancar con un dataset particionado (0 = todo el histórico)
+    DATASET_HOT_DAYS = int(os.environ.get('DATASET_HOT_DAYS', 0))
+    # El scraper publica en S3 el dataset y su manifiesto al terminar
+    SCRAPER_PUBLISH = os.environ.get('SCRAPER_PUBLISH', 'false').lower() == 'true'
+    # Scraping concurrente: canales en paralelo, peticiones por segundo (y ráfaga) compartidas,
+    # reintentos ante FloodWait y espera máxima aceptada antes de abandonar un canal
+    SCRAPER_CONCURRENCY = int(os.environ.get('SCRAPER_CONCURRENCY', 4))
+    SCRAPER_REQUESTS_PER_SECOND = float(os.environ.get('SCRAPER_REQUESTS_PER_SECOND', 5))
+    SCRAPER_BURST = int(os.environ.get('SCRAPER_BURST', 10))
+    SCRAPER_FLOOD_RETRIES = int(os.environ.get('SCRAPER_FLOOD_RETRIES', 3))
+    SCRAPER_MAX_FLOOD_WAIT = int(os.environ.get('SCRAPER_MAX_FLOOD_WAIT', 300))
+    # Scraping incremental por checkpoints de canal y ventana de refresco de vistas (días y mensajes por canal)
+    SCRAPER_INCREMENTAL = os.environ.get('SCRAPER_INCREMENTAL', 'true').lower() == 'true'
+    SCRAPER_REFRESH_DAYS = int(os.environ.get('SCRAPER_REFRESH_DAYS', 3))
+    SCRAPER_REFRESH_MAX = int(os.environ.get('SCRAPER_REFRESH_MAX', 200))
+    # Escrituras de etiquetas agrupadas: ventana del primer evento pendiente y tamaño máximo del lote
+    LABEL_COMMIT_WINDOW_MS = int(os.environ.get('LABEL_COMMIT_WINDOW_MS', 200))
+    LABEL_COMMIT_MAX_EVENTS = int(os.environ.get('LABEL_COMMIT_MAX_EVENTS', 500))
+    LABEL_BATCH_MAX_ITEMS = int(os.environ.get('LABEL_BATCH_MAX_ITEMS', 1000))
+    # Segmentos del registro de etiquetas entre snapshots compactados (0 desactiva la compactación)
+    LABEL_COMPACT_SEGMENTS = int(os.environ.get('LABEL_COMPACT_SEGMENTS', 500))
+    QUERY_CACHE_MAX_BYTES = int(os.environ.get('QUERY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    API_STREAM_CHUNK_SIZE = int(os.environ.get('API_STREAM_CHUNK_SIZE', 1000))
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 5000))
+    # Trabajos en segundo plano (exportaciones): procesos del pool, trabajos terminados que se conservan,
+    # directorio de artefactos locales y espera máxima de las rutas síncronas antes de responder con el trabajo
+    JOBS_MAX_WORKERS = int(os.environ.get('JOBS_MAX_WORKERS', 2))
+    JOBS_MAX_RESULTS = int(os.environ.get('JOBS_MAX_RESULTS', 200))
+    JOBS_ARTIFACT_DIR = os.environ.get('JOBS_ARTIFACT_DIR', os.path.join(tempfile.gettempdir(), 'monitoria-jobs'))
+    JOBS_SYNC_WAIT = int(os.environ.get('JOBS_SYNC_WAIT', 20))
+    
     # Configuración de CORS
     CORS_HEADERS = 'Content-Type'
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://app.monitoria.org,http://localhost:3000').split(',') 
\ No newline at end of file
@@ -0,0 +1,298 @@
+import threading
+import time
+import logging
+from datetime import datetime
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class DatasetSnapshot:
+    """
+    Versión concreta y completamente construida del dataset. No se modifica tras publicarse.
+    `partitions` describe las particiones cargadas cuando el dataset está particionado.
+    `data_version` es la versión de los datos descargados y `overlay_version` la de las
+    etiquetas superpuestas; `version` combina ambas.
+    """
+    __slots__ = ('df', 'version', 'index', 'partitions', 'data_version', 'overlay_version', 'loaded_at')
+
+    def __init__(self, df, version, index=None, partitions=None, data_version=None, overlay_version=None):
+        self.df = df
+        self.version = version
+        self.index = index
+        self.partitions = partitions
+        self.data_version = data_version if data_version is not None else version
+        self.overlay_version = overlay_version
+        self.loaded_at = datetime.utcnow()
+
+def compose_version(data_version, overlay_version):
+    """Versión de un snapshot con superposición: cambia si cambian los datos o las etiquetas."""
+    if data_version is None or overlay_version is None:
+        return data_version
+    return f"{data_version}+{overlay_version}"
+
+def append_rows(df, frame):
+    """
+    Concatena las filas de `frame` tras las de `df`. Las columnas categóricas se unen
+    como categóricas: `pd.concat` las convierte en object si las categorías difieren.
+    """
+    if df.empty and len(df.columns) == 0:
+        return frame.reset_index(drop=True)
+    combined = pd.concat([df, frame], ignore_index=True)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and col in frame.columns \
+                and isinstance(frame[col].dtype, pd.CategoricalDtype) \
+                and not isinstance(combined[col].dtype, pd.CategoricalDtype):
+            combined[col] = union_categoricals([df[col], frame[col]])
+    return combined
+
+class DatasetCache:
+    """
+    Caché en proceso del DataFrame de mensajes, indexado por la versión (ETag) del objeto.
+
+    Con el refresco en segundo plano activo (`start()`), un hilo revalida el dataset
+    periódicamente y publica cada versión nueva sustituyendo la referencia al snapshot
+    de forma atómica; las peticiones solo leen esa referencia y nunca esperan a la red.
+    Sin hilo, la revalidación se hace en la petición como mucho una vez por intervalo.
+    """
+
+    def __init__(self, fetcher, preprocess=None, build_index=None, overlay=None,
+                 revalidate_interval=60, warmup_timeout=30):
+        """
+        `fetcher(version)` recibe la versión cacheada (o None) y devuelve una tupla
+        `(df, version)`, o `(df, version, partitions)` si solo se cargaron algunas
+        particiones. Si el dataset no ha cambiado devuelve `(None, version)`.
+        `preprocess(df)` se aplica a cada versión nueva antes de publicarla y
+        `build_index(df)` construye el índice que se publica junto al snapshot.
+        `overlay` (el registro de etiquetas) se sincroniza en cada revalidación y su
+        `apply(df)` se aplica a cada snapshot antes de indexarlo.
+        """
+        self.fetcher = fetcher
+        self.preprocess = preprocess
+        self.build_index = build_index
+        self.overlay = overlay
+        self.revalidate_interval = revalidate_interval
+        self.warmup_timeout = warmup_timeout
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._first_attempt = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._checked_at = 0.0
+        self._last_error = None
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    def _is_stale(self):
+        return time.monotonic() - self._checked_at >= self.revalidate_interval
+
+    def _make_snapshot(self, df, version, partitions=None):
+        overlay_version = None
+        if self.overlay is not None:
+            # Filas y versión de la superposición leídas juntas: la versión describe exactamente lo aplicado
+            df, overlay_version = self.overlay.apply(df)
+        index = self.build_index(df) if self.build_index is not None else None
+        return DatasetSnapshot(df, compose_version(version, overlay_version), index, partitions, version, overlay_version)
+
+    def _overlay_snapshot(self, current):
+        """
+        Snapshot de `current` con las etiquetas escritas desde que se construyó. Solo
+        se tocan las filas cambiadas: la columna Label se copia y el índice se
+        actualiza con `with_labels()`, sin volver a construirlo. Si los cambios no se
+        pueden calcular de forma incremental se reconstruye entero. Devuelve el
+        snapshot y la lista de (posición, etiqueta nueva), o None si se reconstruyó.
+        """
+        index = current.index
+        if hasattr(self.overlay, 'apply_changes'):
+            result = self.overlay.apply_changes(current.df, current.overlay_version,
+                                                getattr(index, 'message_ids', None))
+            if result is not None and (index is None or hasattr(index, 'with_labels')):
+                df, overlay_version, positions, old_labels, new_labels = result
+                if index is not None:
+                    index = index.with_labels(positions, old_labels, new_labels)
+                snapshot = DatasetSnapshot(df, compose_version(current.data_version, overlay_version), index,
+                                           current.partitions, current.data_version, overlay_version)
+                return snapshot, list(zip(positions.tolist(), new_labels))
+        snapshot = self._make_snapshot(current.df, current.data_version, current.partitions)
+        return snapshot, None
+
+    def _sync_overlay(self, current):
+        """
+        Incorpora las etiquetas remotas y dice si el snapshot `current` está desfasado
+        respecto a la superposición. Se compara la versión con la que se construyó el
+        snapshot con la vigente del almacén, compartido por todos los procesos del
+        host: una etiqueta escrita por otro worker no aparece como novedad en `sync()`,
+        pero sí cambia la versión.
+        """
+        if self.overlay is None:
+            return False
+        try:
+            self.overlay.sync()
+        except Exception as e:
+            logger.warning(f"Error al sincronizar las etiquetas, se mantienen las cargadas: {e}")
+        if current is None:
+            return False
+        try:
+            return self.overlay.version != current.overlay_version
+        except Exception as e:
+            logger.warning(f"Error al leer la versión de las etiquetas: {e}")
+            return False
+
+    def get_snapshot(self):
+        """Devuelve el snapshot actual, o None si todavía no hay ninguno cargado."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            if self._thread is not None:
+                # Arranque en frío: esperar acotadamente al primer intento de carga del refresco
+                self._first_attempt.wait(self.warmup_timeout)
+            else:
+                self.refresh()
+            return self._snapshot
+
+        if self._thread is None and self._is_stale():
+            self.refresh()
+            snapshot = self._snapshot
+        return snapshot
+
+    def get(self):
+        """Devuelve el DataFrame del snapshot actual."""
+        snapshot = self.get_snapshot()
+        return snapshot.df if snapshot is not None else pd.DataFrame()
+
+    def refresh(self):
+        """Revalida el dataset y publica un snapshot nuevo si la versión ha cambiado."""
+        with self._refresh_lock:
+            # Otro hilo pudo revalidar mientras esperábamos el lock
+            if self._snapshot is not None and not self._is_stale():
+                return self._snapshot
+
+            current = self._snapshot
+            try:
+                df, version, *partitions = self.fetcher(current.data_version if current is not None else None)
+            except Exception as e:
+                self._last_error = str(e)
+                if current is None:
+                    raise
+                logger.warning(f"Error al revalidar el dataset, se sirve la versión cacheada: {e}")
+                self._checked_at = time.monotonic()
+                return current
+
+            overlay_changed = self._sync_overlay(current)
+            if df is None and current is not None:
+                if overlay_changed:
+                    self._snapshot, _ = self._overlay_snapshot(current)
+                    logger.info(f"Etiquetas actualizadas en caché (versión {self._snapshot.version})")
+                else:
+                    logger.info(f"Dataset sin cambios (versión {current.version})")
+            elif df is not None:
+                if self.preprocess is not None:
+                    df = self.preprocess(df)
+                logger.info(f"Dataset actualizado en caché: {len(df)} filas (versión {version})")
+                # Asignar la referencia es atómico: los lectores ven el snapshot anterior o el nuevo
+                self._snapshot = self._make_snapshot(df, version, partitions[0] if partitions else None)
+            self._last_error = None
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def store(self, df, version=None, partitions=None):
+        """Publica el DataFrame resultante de una escritura propia."""
+        with self._refresh_lock:
+            self._snapshot = self._make_snapshot(df, version, partitions)
+            # Sin versión conocida forzamos la revalidación en el siguiente ciclo
+            self._checked_at = time.monotonic() if version else 0.0
+
+    def extend(self, snapshot, frame, version, partitions):
+        """
+        Publica un snapshot con las filas de `frame` (particiones cargadas bajo demanda)
+        añadidas a las de `snapshot`. Solo las filas nuevas pasan por `preprocess` y la
+        superposición, y el índice se amplía con `with_rows()` si lo permite. Si
+        mientras tanto se publicó otro snapshot devuelve None: quien llama debe volver
+        a calcular sobre el vigente qué le falta.
+        """
+        with self._refresh_lock:
+            if self._snapshot is not snapshot:
+                return None
+            if self.preprocess is not None:
+                frame = self.preprocess(frame)
+            if self.overlay is not None:
+                # Las filas nuevas pueden llevar etiquetas más recientes que la versión del
+                # snapshot; reaplicarlas en la próxima revalidación no cambia nada
+                frame, _ = self.overlay.apply(frame)
+            df = append_rows(snapshot.df, frame)
+            index = snapshot.index
+            if index is not None and hasattr(index, 'with_rows'):
+                index = index.with_rows(df)
+            elif self.build_index is not None:
+                index = self.build_index(df)
+            self._snapshot = DatasetSnapshot(df, compose_version(version, snapshot.overlay_version), index,
+                                             partitions, version, snapshot.overlay_version)
+            logger.info(f"Dataset ampliado con {len(frame)} filas (versión {version})")
+            return self._snapshot
+
+    def apply_overlay(self):
+        """
+        Vuelve a publicar el snapshot actual con el estado vigente de la superposición,
+        tras una escritura de etiquetas de este proceso. Devuelve (anterior, publicado,
+        cambios), con los cambios de `_overlay_snapshot()`.
+        """
+        with self._refresh_lock:
+            previous = self._snapshot
+            if previous is None:
+                return None, None, None
+            if self.overlay is None:
+                return previous, previous, []
+            self._snapshot, changes = self._overlay_snapshot(previous)
+            return previous, self._snapshot, changes
+
+    def invalidate(self):
+        """Fuerza la revalidación en la siguiente lectura o ciclo del refresco."""
+        self._checked_at = 0.0
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error en el refresco en segundo plano del dataset: {e}")
+            finally:
+                self._first_attempt.set()
+            self._stop.wait(self.revalidate_interval)
+
+    def start(self):
+        """Arranca el hilo que revalida el dataset fuera de las peticiones."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='dataset-refresher', daemon=True)
+        self._thread.start()
+        logger.info(f"Refresco del dataset en segundo plano cada {self.revalidate_interval}s")
+
+    def stop(self):
+        """Detiene el hilo de refresco."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def status(self):
+        """Estado del snapshot para el endpoint de salud."""
+        snapshot = self._snapshot
+        return {
+            'warm': snapshot is not None,
+            'version': snapshot.version if snapshot is not None else None,
+            'data_version': snapshot.data_version if snapshot is not None else None,
+            'rows': len(snapshot.df) if snapshot is not None else 0,
+            'partitions': len(snapshot.partitions.loaded) if snapshot is not None and snapshot.partitions is not None else None,
+            'loaded_at': snapshot.loaded_at.isoformat() if snapshot is not None else None,
+            'background_refresh': self._thread is not None,
+            'last_error': self._last_error
+        }
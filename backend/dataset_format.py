@@ -0,0 +1,63 @@
+import os
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = 'telegram_messages.arrow'
+
+# Columnas con objetos de Telethon que no se pueden serializar
+NON_SERIALIZABLE_COLUMNS = ['Photo', 'Media', 'Entities']
+DATE_COLUMNS = ['Date', 'Date Sent', 'Creation Date', 'Edit Date']
+NUMERIC_COLUMNS = ['Score', 'Average Views', 'Average Difference', 'Label']
+
+def prepare_snapshot_frame(df):
+    """Devuelve una copia del DataFrame con tipos de columna compatibles con Arrow."""
+    df = df.drop(columns=[col for col in NON_SERIALIZABLE_COLUMNS if col in df.columns])
+
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            # Fechas en UTC sin zona horaria, igual que las espera app.py
+            df[col] = pd.to_datetime(df[col], errors='coerce', utc=True).dt.tz_localize(None)
+
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+
+    # Las columnas de texto con tipos mezclados se guardan como string conservando los nulos
+    for col in df.columns:
+        if df[col].dtype == object:
+            try:
+                pa.array(df[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                df[col] = df[col].astype(str).where(df[col].notna(), None)
+
+    return df
+
+def write_snapshot(df, path=SNAPSHOT_FILE):
+    """
+    Escribe el DataFrame como snapshot Arrow IPC (Feather v2) sin comprimir,
+    de forma que los lectores puedan mapearlo en memoria sin copiarlo.
+    """
+    table = pa.Table.from_pandas(prepare_snapshot_frame(df), preserve_index=False)
+
+    # Escritura atómica: los lectores nunca ven un archivo a medias
+    tmp_path = f"{path}.tmp"
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+    logger.info(f"Snapshot columnar guardado en {path}: {table.num_rows} filas")
+    return path
+
+def read_snapshot(path=SNAPSHOT_FILE, columns=None):
+    """
+    Lee un snapshot Arrow mapeándolo en memoria. Si se indican `columns`, solo
+    se tocan las páginas de esas columnas.
+    """
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    df = table.to_pandas(split_blocks=True)
+    logger.info(f"Snapshot columnar cargado desde {path}: {len(df)} filas")
+    return df
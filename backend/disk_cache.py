@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# Checksums que se pueden verificar al guardar: SHA-256 (manifiesto o S3), CRC32 de S3 y MD5 del ETag
+CHECKSUM_ALGORITHMS = ('sha256', 'crc32', 'md5')
+
+def file_digests(path, algorithms=('sha256',)):
+    """Checksums en hexadecimal de un archivo, calculados en una sola lectura por bloques."""
+    digests = {name: hashlib.new(name) for name in algorithms if name != 'crc32'}
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            for digest in digests.values():
+                digest.update(chunk)
+            if 'crc32' in algorithms:
+                crc = zlib.crc32(chunk, crc)
+    result = {name: digest.hexdigest() for name, digest in digests.items()}
+    if 'crc32' in algorithms:
+        result['crc32'] = f"{crc:08x}"
+    return result
+
+def file_sha256(path):
+    """Checksum SHA-256 de un archivo, leído por bloques."""
+    return file_digests(path)['sha256']
+
+class DiskCache:
+    """
+    Caché en disco de objetos de S3, compartida por todos los procesos del host.
+
+    Cada entrada se identifica por (bucket, key, tag), donde `tag` es el ETag o el
+    checksum del manifiesto, y guarda junto al archivo un JSON con su tamaño, su
+    fecha de modificación, su SHA-256 y la versión del dataset. Las escrituras son
+    atómicas (archivo temporal y `os.replace`) y el contenido se verifica una vez, al
+    guardarlo; en cada acierto basta con comparar tamaño y fecha de modificación, y
+    `verify` activa además el recálculo completo del SHA-256. El espacio se acota a
+    `max_bytes` desalojando las entradas usadas hace más tiempo.
+    """
+
+    def __init__(self, directory, max_bytes, verify=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _name(self, bucket, key, tag):
+        digest = hashlib.sha256(f"{bucket}/{key}/{tag}".encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.directory, digest + os.path.splitext(key)[1])
+
+    @staticmethod
+    def _meta_path(path):
+        return f"{path}.meta"
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Bloqueo entre hilos y, donde existe flock, entre procesos. Lo toman también
+        quienes publican archivos en el directorio de la caché fuera de `store()`.
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self, path):
+        try:
+            with open(self._meta_path(path), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _valid(self, path, meta, sha256=None):
+        # Las entradas sin contenido verificado (anteriores a la verificación obligatoria) no se usan
+        if meta is None or not meta.get('verified'):
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != meta['size']:
+            return False
+        if sha256 is not None and meta['sha256'] != sha256:
+            return False
+        # Un archivo modificado después de verificarlo (o una entrada sin fecha) se vuelve a comprobar entero
+        if self.verify or meta.get('mtime_ns') != stat.st_mtime_ns:
+            return file_sha256(path) == meta['sha256']
+        return True
+
+    def _remove(self, path):
+        for target in (self._meta_path(path), path):
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+
+    def lookup(self, bucket, key, tag, sha256=None):
+        """Ruta del objeto en caché si existe y está íntegro; None si no."""
+        path = self._name(bucket, key, tag)
+        meta = self._read_meta(path)
+        if not self._valid(path, meta, sha256):
+            if meta is not None:
+                logger.warning(f"Entrada de caché en disco corrupta, se descarta: {key} ({tag})")
+                with self.exclusive():
+                    self._remove(path)
+                    self._evict()
+            self.misses += 1
+            return None
+        # La fecha de modificación del .meta marca el último uso para el desalojo LRU
+        os.utime(self._meta_path(path))
+        self.hits += 1
+        return path
+
+    def store(self, bucket, key, tag, fill, sha256=None, version=None, checksums=None):
+        """
+        Guarda un objeto: `fill(tmp_path)` escribe su contenido en un archivo temporal
+        que se valida contra `sha256` y los `checksums` conocidos ({algoritmo: valor
+        en hexadecimal} de CHECKSUM_ALGORITHMS) antes de publicarlo en la caché. Sin
+        ningún checksum esperado no se guarda nada: la caché solo contiene contenido
+        verificado. Devuelve la ruta de la entrada.
+        """
+        expected = dict(checksums or {})
+        if sha256 is not None:
+            expected['sha256'] = sha256
+        if not expected:
+            raise ValueError(f"Sin checksum esperado no se guarda {key} en la caché en disco")
+        path = self._name(bucket, key, tag)
+        tmp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        try:
+            fill(tmp_path)
+            actual = file_digests(tmp_path, {'sha256', *expected})
+            for name, value in expected.items():
+                if actual[name] != value.lower():
+                    raise ValueError(f"Checksum {name} de {key} no coincide con el esperado")
+            meta = {
+                'bucket': bucket,
+                'key': key,
+                'tag': tag,
+                'version': version or tag,
+                'size': os.path.getsize(tmp_path),
+                # os.replace conserva la fecha de modificación del temporal
+                'mtime_ns': os.stat(tmp_path).st_mtime_ns,
+                'sha256': actual['sha256'],
+                'verified': sorted(expected),
+                'stored_at': time.time()
+            }
+            with self.exclusive():
+                os.replace(tmp_path, path)
+                meta_tmp = f"{tmp_path}.meta"
+                with open(meta_tmp, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f)
+                os.replace(meta_tmp, self._meta_path(path))
+                self._evict(keep=path)
+            logger.info(f"Objeto guardado en la caché en disco: {key} ({meta['size']} bytes)")
+            return path
+        finally:
+            for leftover in (tmp_path, f"{tmp_path}.meta"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def latest(self, bucket, key):
+        """La entrada más reciente de un objeto, sea cual sea su versión: (ruta, meta) o None."""
+        best = None
+        for path, meta in self._entries():
+            if meta['bucket'] == bucket and meta['key'] == key:
+                if best is None or meta['stored_at'] > best[1]['stored_at']:
+                    best = (path, meta)
+        if best is not None and self._valid(*best):
+            return best
+        return None
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.meta') and not name.startswith('.'):
+                path = os.path.join(self.directory, name[:-len('.meta')])
+                meta = self._read_meta(path)
+                if meta is not None:
+                    yield path, meta
+
+    def _usage_path(self):
+        return os.path.join(self.directory, '.usage')
+
+    def _evict(self, keep=None):
+        """Desaloja hasta caber en `max_bytes` y guarda el uso resultante para `stats()`. Con el bloqueo tomado."""
+        entries = []
+        total = 0
+        for path, meta in self._entries():
+            try:
+                last_used = os.path.getmtime(self._meta_path(path))
+            except OSError:
+                continue
+            entries.append((last_used, path, meta['size']))
+            total += meta['size']
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self._remove(path)
+            total -= size
+            entries = [entry for entry in entries if entry[1] != path]
+            logger.info(f"Entrada desalojada de la caché en disco: {os.path.basename(path)}")
+        usage = {'entries': len(entries), 'bytes': total}
+        tmp_path = f"{self._usage_path()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(usage, f)
+        os.replace(tmp_path, self._usage_path())
+        return usage
+
+    def _usage(self):
+        """Uso de la caché según el último guardado de cualquier proceso, sin recorrer el directorio."""
+        try:
+            with open(self._usage_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # Primera consulta sobre un directorio sin contadores: se calculan una vez
+            with self.exclusive():
+                return self._evict()
+
+    def stats(self):
+        usage = self._usage()
+        return {
+            'directory': self.directory,
+            'entries': usage['entries'],
+            'bytes': usage['bytes'],
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+def get_disk_cache():
+    """Retorna la caché en disco compartida por el proceso."""
+    global _disk_cache
+    if _disk_cache is None:
+        with _disk_cache_lock:
+            if _disk_cache is None:
+                _disk_cache = DiskCache(Config.DISK_CACHE_DIR, Config.DISK_CACHE_MAX_BYTES, Config.DISK_CACHE_VERIFY)
+    return _disk_cache
@@ -0,0 +1,113 @@
+import os
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from config import Config
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+class ObjectChangedError(IOError):
+    """El objeto cambió durante una descarga por rangos (412 de un If-Match)."""
+
+def _ranges(size, part_size):
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+class FileSink:
+    """Destino en disco: cada parte escribe en su offset de un archivo preasignado."""
+
+    def __init__(self, path, size):
+        self.path = path
+        with open(path, 'wb') as f:
+            f.truncate(size)
+
+    def writer(self, offset):
+        f = open(self.path, 'r+b')
+        f.seek(offset)
+        return f
+
+def parallel_download(fetch_range, size, sink, part_size=None, max_workers=None, label=''):
+    """
+    Descarga un objeto de `size` bytes en partes de `part_size` con peticiones de rango
+    en paralelo. `fetch_range(start, end)` devuelve un iterable de bloques de bytes del
+    rango inclusivo [start, end]; cada parte se escribe directamente en su offset del
+    destino. Devuelve las estadísticas de la descarga.
+    """
+    part_size = part_size or Config.S3_DOWNLOAD_PART_SIZE
+    max_workers = max_workers or Config.S3_DOWNLOAD_CONCURRENCY
+    parts = _ranges(size, part_size)
+
+    def download_part(part):
+        start, end = part
+        writer = sink.writer(start)
+        received = 0
+        try:
+            for chunk in fetch_range(start, end):
+                writer.write(chunk)
+                received += len(chunk)
+        finally:
+            writer.close()
+        if received != end - start + 1:
+            raise IOError(f"Rango {start}-{end} incompleto: {received} bytes")
+        return received
+
+    started = time.monotonic()
+    if len(parts) <= 1:
+        total = sum(map(download_part, parts))
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(parts)), thread_name_prefix='download') as pool:
+            total = sum(pool.map(download_part, parts))
+    elapsed = max(time.monotonic() - started, 1e-6)
+
+    stats = {
+        'bytes': total,
+        'parts': len(parts),
+        'seconds': round(elapsed, 3),
+        'throughput_mbps': round(total / elapsed / (1024 * 1024), 2)
+    }
+    logger.info(f"Descarga {label}: {total / (1024 * 1024):.1f} MB en {stats['seconds']}s "
+                f"({stats['throughput_mbps']} MB/s, {len(parts)} partes)")
+    return stats
+
+def download_to_file(fetch_range, size, path, verify=None, lock=None, **kwargs):
+    """
+    Descarga en paralelo a `path` de forma atómica. `verify(tmp_path)` puede rechazar
+    el archivo antes de reemplazar el anterior. El temporal es único por descarga, de
+    modo que varios procesos pueden descargar el mismo objeto a la vez, y `lock()`
+    (p. ej. `DiskCache.exclusive`) se toma alrededor del reemplazo final. Devuelve
+    las estadísticas.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.download"
+    try:
+        stats = parallel_download(fetch_range, size, FileSink(tmp_path, size), **kwargs)
+        if verify is not None:
+            verify(tmp_path)
+        with lock() if lock is not None else nullcontext():
+            os.replace(tmp_path, path)
+        return stats
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def http_range_fetcher(session, url, timeout=30, etag=None):
+    """
+    `fetch_range` para una URL HTTP que admite cabeceras Range. Con `etag`, cada
+    rango lleva If-Match y un 412 lanza ObjectChangedError.
+    """
+    def fetch_range(start, end):
+        headers = {'Range': f'bytes={start}-{end}'}
+        if etag:
+            headers['If-Match'] = etag
+        response = session.get(url, headers=headers, timeout=timeout, stream=True)
+        if response.status_code == 412:
+            raise ObjectChangedError(f"{url} cambió durante la descarga")
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError(f"El servidor no admite peticiones de rango: {url}")
+        return response.iter_content(chunk_size=CHUNK_SIZE)
+    return fetch_range
@@ -0,0 +1,192 @@
+import os
+import uuid
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from dataset_format import NON_SERIALIZABLE_COLUMNS
+from preprocessing import DERIVED_COLUMNS
+from uploads import ChunkSink
+
+# Formatos de exportación: extensión y tipo MIME
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'csv.gz': ('csv.gz', 'application/gzip'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet')
+}
+
+def export_columns(df):
+    """Columnas que se exportan: las del dataset, sin las derivadas ni las de objetos de Telethon."""
+    return [col for col in df.columns if col not in DERIVED_COLUMNS and col not in NON_SERIALIZABLE_COLUMNS]
+
+def write_export_source(df, path):
+    """
+    Guarda las columnas exportables de `df` como Arrow IPC sin comprimir, para que
+    los procesos del pool de trabajos las mapeen en memoria en lugar de recibir el
+    DataFrame serializado. `Label` no se guarda: cambia con cada escritura de
+    etiquetas y el trabajo recibe solo las de las filas exportadas.
+    """
+    columns = [col for col in export_columns(df) if col != 'Label']
+    arrays = []
+    for col in columns:
+        try:
+            arrays.append(pa.array(df[col], from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Tipos mezclados: como texto, conservando los nulos
+            arrays.append(pa.array(_as_text(df[col]), from_pandas=True))
+    table = pa.Table.from_arrays(arrays, names=columns)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+    return path
+
+def read_export_rows(path, positions, labels, columns):
+    """
+    Filas `positions` de un archivo de `write_export_source()`, con las etiquetas
+    `labels` (o sin Label si es None) y en el orden de `columns`. Solo se
+    materializan las filas exportadas.
+    """
+    table = feather.read_table(path, memory_map=True).take(pa.array(positions))
+    frame = table.to_pandas()
+    if labels is not None:
+        frame['Label'] = labels
+    return frame.reindex(columns=columns)
+
+class ExportSources:
+    """
+    Archivos de `write_export_source()` por versión de los datos, con recuento de
+    referencias. Cada trabajo usa la fuente con `use()` mientras se ejecuta: se escribe
+    la primera vez que se pide una versión y solo se borran las que no usa ningún
+    trabajo, conservando las `kept` más recientes para los siguientes. Los datos sin
+    versión no se comparten: su fuente se borra al terminar el trabajo.
+    """
+
+    def __init__(self, directory, kept=2):
+        self.directory = directory
+        self.kept = kept
+        # Versión -> {'path', 'refs', 'lock'}; el lock serializa la escritura de esa fuente
+        self._sources = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def use(self, df, version):
+        """Ruta de la fuente de `df` para `version`, reservada hasta salir del bloque."""
+        key = version if version is not None else f"unversioned-{uuid.uuid4().hex}"
+        with self._lock:
+            source = self._sources.get(key)
+            if source is None:
+                digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+                source = {'path': os.path.join(self.directory, f"source-{digest}.arrow"),
+                          'refs': 0, 'lock': threading.Lock()}
+                self._sources[key] = source
+            source['refs'] += 1
+            self._sources.move_to_end(key)
+        try:
+            with source['lock']:
+                if not os.path.exists(source['path']):
+                    os.makedirs(self.directory, exist_ok=True)
+                    write_export_source(df, source['path'])
+            yield source['path']
+        finally:
+            with self._lock:
+                source['refs'] -= 1
+                if version is None:
+                    self._remove(key)
+                self._evict()
+
+    def _remove(self, key):
+        source = self._sources.pop(key)
+        try:
+            os.remove(source['path'])
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Fuera de las `kept` más recientes, se borran las que ningún trabajo está usando
+        older = list(self._sources)[:max(len(self._sources) - self.kept, 0)]
+        for key in older:
+            if self._sources[key]['refs'] == 0:
+                self._remove(key)
+
+def _chunks(df, positions, columns, chunk_size):
+    for start in range(0, len(positions), chunk_size):
+        yield df.iloc[positions[start:start + chunk_size]].reindex(columns=columns)
+
+def iter_csv(df, positions, columns, chunk_size=1000, compress=False):
+    """
+    CSV de las filas `positions` en bloques de `chunk_size` filas, opcionalmente
+    comprimido con gzip sobre la marcha. Solo hay un bloque en memoria a la vez.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    header = True
+    for chunk in _chunks(df, positions, columns, chunk_size):
+        data = chunk.to_csv(index=False, header=header).encode('utf-8')
+        header = False
+        data = compressor.compress(data) if compressor is not None else data
+        if data:
+            yield data
+    if header:
+        # Sin filas: solo la cabecera
+        data = pd.DataFrame(columns=columns).to_csv(index=False).encode('utf-8')
+        yield compressor.compress(data) + compressor.flush() if compressor is not None else data
+    elif compressor is not None:
+        yield compressor.flush()
+
+def iter_json(df, positions, columns, chunk_size=1000):
+    """Array JSON de objetos de las filas `positions`, codificado en bloques de `chunk_size` filas."""
+    yield b'['
+    separator = b''
+    for chunk in _chunks(df, positions, columns, chunk_size):
+        records = chunk.to_json(orient='records')[1:-1]
+        if records:
+            yield separator + records.encode('utf-8')
+            separator = b','
+    yield b']'
+
+def _parquet_schema(df, columns):
+    """Esquema estable para todos los bloques: las columnas de objetos se exportan como texto."""
+    fields = []
+    for col in columns:
+        if col in df.columns and df[col].dtype != object and not isinstance(df[col].dtype, pd.StringDtype):
+            fields.append(pa.Schema.from_pandas(df[[col]].iloc[:0], preserve_index=False).field(col))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+def _as_text(series):
+    return series.astype(str).where(series.notna(), None)
+
+def iter_parquet(df, positions, columns, chunk_size=10000):
+    """
+    Parquet de las filas `positions` con un row group por bloque de `chunk_size` filas;
+    cada row group se entrega en cuanto se escribe.
+    """
+    schema = _parquet_schema(df, columns)
+    text_columns = [field.name for field in schema if field.type == pa.string()]
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        for chunk in _chunks(df, positions, columns, chunk_size):
+            chunk = chunk.assign(**{col: _as_text(chunk[col]) for col in text_columns})
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def iter_export(df, positions, format='csv', chunk_size=1000):
+    """Bloques de bytes de la exportación en `format` ('csv', 'csv.gz' o 'parquet')."""
+    columns = export_columns(df)
+    if format == 'parquet':
+        # Row groups más grandes que los bloques de CSV: Parquet comprime por columna
+        return iter_parquet(df, positions, columns, chunk_size=max(chunk_size, 10000))
+    if format in ('csv', 'csv.gz'):
+        return iter_csv(df, positions, columns, chunk_size, compress=format == 'csv.gz')
+    raise ValueError(f"Formato de exportación no soportado: {format}")
@@ -0,0 +1,427 @@
+import copy
+import logging
+from functools import reduce
+import numpy as np
+import pandas as pd
+from preprocessing import DAY_COLUMN, MEDIA_TYPE_COLUMN
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Posiciones de fila en int32: la mitad de memoria que int64 hasta 2^31 filas
+POSITION_DTYPE = np.int32
+
+# Clave de los mensajes sin etiquetar en los bitmaps de Label
+UNLABELED = 'none'
+
+# Valores aceptados en `sortBy` y la columna por la que ordenan (siempre descendente)
+SORT_KEYS = {
+    'score': 'Score',
+    'views': 'Views',
+    'date': 'Date Sent',
+    'difference': 'Average Difference',
+    'members': 'Members Count'
+}
+DEFAULT_SORT = 'score'
+
+# Por debajo de esta fracción de filas filtradas es más barato ordenar los candidatos
+# por su rango que recorrer la permutación completa
+SORT_CANDIDATES_RATIO = 1 / 16
+
+def _packed_bitmap(bool_array):
+    """Empaqueta un array booleano en un bitmap de un bit por fila."""
+    return np.packbits(bool_array)
+
+def _contains(positions, candidates):
+    """Pertenencia de `candidates` a `positions` (ordenadas) por búsqueda binaria, sin máscaras de n filas."""
+    if len(positions) == 0:
+        return np.zeros(len(candidates), dtype=bool)
+    found = np.searchsorted(positions, candidates)
+    found[found == len(positions)] = 0
+    return positions[found] == candidates
+
+def _test_bits(bitmap, positions):
+    """Comprueba en O(k) qué posiciones tienen su bit activo en un bitmap empaquetado."""
+    shifts = (7 - (positions & 7)).astype(np.uint8)
+    return ((bitmap[positions >> 3] >> shifts) & 1).astype(bool)
+
+def _label_value(value):
+    """Etiqueta como número, o None si no lo es: el mismo criterio que los bitmaps de Label."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(number) else number
+
+class FilterIndex:
+    """
+    Índice de filtros construido una vez por versión del dataset.
+
+    - Canal (`Title`): lista ordenada de posiciones por canal (contenedor disperso).
+    - `Media Type` y `Label`: bitmaps empaquetados por valor (pocas claves, densas).
+    - Fechas: permutación de filas ordenada por día, de modo que un rango es una
+      búsqueda binaria y un slice.
+    - Ordenación: permutación descendente (y su rango inverso) por cada clave de
+      `SORT_KEYS`, para paginar sin ordenar en cada petición. Los empates se
+      deshacen por `Message ID`, de modo que (valor, Message ID) sirve de cursor.
+
+    `resolve()` combina los filtros y devuelve las posiciones de fila, en orden
+    ascendente, que los cumplen; `sort_positions()` las ordena para una página y
+    `sort_positions_after()` continúa desde un rango dado (paginación por cursor).
+    """
+
+    def __init__(self, df):
+        self.size = len(df)
+        self.channel_postings = self._build_postings(df['Title']) if 'Title' in df.columns else None
+        self.media_type_bitmaps = self._build_bitmaps(df[MEDIA_TYPE_COLUMN]) if MEDIA_TYPE_COLUMN in df.columns else None
+        self.label_bitmaps = self._build_label_bitmaps(df['Label']) if 'Label' in df.columns else None
+        self.scores = df['Score'].to_numpy(dtype='float64') if 'Score' in df.columns else None
+
+        self.date_order = None
+        self.sorted_days = None
+        if DAY_COLUMN in df.columns:
+            days = df[DAY_COLUMN].to_numpy(dtype='datetime64[ns]')
+            valid = np.flatnonzero(~np.isnat(days)).astype(POSITION_DTYPE)
+            order = np.argsort(days[valid], kind='stable')
+            self.date_order = valid[order]
+            self.sorted_days = days[self.date_order]
+
+        if 'Message ID' in df.columns:
+            self.message_ids = pd.to_numeric(df['Message ID'], errors='coerce').fillna(-1).to_numpy(dtype='int64')
+        else:
+            self.message_ids = np.arange(self.size, dtype='int64')
+
+        self.rank_orders = {}
+        self.ranks = {}
+        self.rank_keys = {}
+        for sort_by, column in SORT_KEYS.items():
+            if column in df.columns:
+                self.rank_orders[sort_by], self.ranks[sort_by], self.rank_keys[sort_by] = \
+                    self._build_rank(df[column], self.message_ids)
+
+        logger.info(f"Índice de filtros construido: {self.size} filas")
+
+    @staticmethod
+    def _build_postings(series):
+        codes, uniques = pd.factorize(series)
+        order = np.argsort(codes, kind='stable').astype(POSITION_DTYPE)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        return {value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(uniques)}
+
+    @staticmethod
+    def _build_rank(series, message_ids):
+        """
+        Permutación descendente (nulos al final, empates por Message ID ascendente),
+        rango de cada fila en ella y la clave de orden de cada fila (valor negado).
+        """
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values = series.to_numpy(dtype='datetime64[ns]').astype('int64').astype('float64')
+            values[series.isna().to_numpy()] = np.nan
+        else:
+            values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64')
+        keys = -values
+        keys[np.isnan(keys)] = np.inf
+        order = np.lexsort((message_ids, keys)).astype(POSITION_DTYPE)
+        rank = np.empty(len(order), dtype=POSITION_DTYPE)
+        rank[order] = np.arange(len(order), dtype=POSITION_DTYPE)
+        return order, rank, keys
+
+    @staticmethod
+    def _build_bitmaps(series):
+        codes, uniques = pd.factorize(series)
+        return {value: _packed_bitmap(codes == i) for i, value in enumerate(uniques)}
+
+    @staticmethod
+    def _build_label_bitmaps(series):
+        labels = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64')
+        bitmaps = {UNLABELED: _packed_bitmap(np.isnan(labels))}
+        for value in np.unique(labels[~np.isnan(labels)]):
+            bitmaps[float(value)] = _packed_bitmap(labels == value)
+        return bitmaps
+
+    def with_labels(self, positions, old_labels, new_labels):
+        """
+        Índice para el mismo dataset con la etiqueta de `positions` cambiada de
+        `old_labels` a `new_labels`. Comparte todas las estructuras con este índice
+        (que no se modifica) salvo los bitmaps de etiqueta afectados, que se copian.
+        """
+        index = copy.copy(self)
+        if len(positions) == 0:
+            return index
+        # Sin columna Label al construir el índice, todas las filas estaban sin etiquetar
+        bitmaps = dict(self.label_bitmaps) if self.label_bitmaps is not None else \
+            {UNLABELED: _packed_bitmap(np.ones(self.size, dtype=bool))}
+        touched = {}
+        for position, old, new in zip(positions, old_labels, new_labels):
+            old_key, new_key = self.parse_label(_label_value(old)), self.parse_label(_label_value(new))
+            if old_key == new_key:
+                continue
+            for key in (old_key, new_key):
+                if key not in touched:
+                    touched[key] = bitmaps[key].copy() if key in bitmaps else self._empty_bitmap()
+            byte, bit = position >> 3, np.uint8(1 << (7 - (position & 7)))
+            touched[old_key][byte] &= ~bit
+            touched[new_key][byte] |= bit
+        bitmaps.update(touched)
+        index.label_bitmaps = bitmaps
+        return index
+
+    def with_rows(self, df):
+        """
+        Índice de `df`, cuyas primeras filas son las de este índice y el resto nuevas
+        (particiones cargadas bajo demanda). Las estructuras se amplían con las filas
+        nuevas en lugar de reconstruirse: las posiciones existentes no cambian y las
+        permutaciones ordenadas se mezclan por búsqueda binaria, con el mismo orden que
+        daría construir el índice desde cero. Si el índice estaba vacío o las columnas
+        indexadas no coinciden, se construye uno nuevo.
+        """
+        start = self.size
+        if start == 0 or self._indexed_columns(df) != self._built_columns():
+            return FilterIndex(df)
+        new = df.iloc[start:]
+        index = copy.copy(self)
+        index.size = len(df)
+
+        if self.channel_postings is not None:
+            postings = dict(self.channel_postings)
+            for value, positions in self._build_postings(new['Title']).items():
+                positions = positions + start
+                postings[value] = np.concatenate((postings[value], positions)) if value in postings else positions
+            index.channel_postings = postings
+        if self.media_type_bitmaps is not None:
+            index.media_type_bitmaps = self._append_bitmaps(
+                self.media_type_bitmaps, self._build_bitmaps(new[MEDIA_TYPE_COLUMN]), start, len(new))
+        if self.label_bitmaps is not None:
+            index.label_bitmaps = self._append_bitmaps(
+                self.label_bitmaps, self._build_label_bitmaps(new['Label']), start, len(new))
+        if self.scores is not None:
+            index.scores = np.concatenate((self.scores, new['Score'].to_numpy(dtype='float64')))
+
+        if self.date_order is not None:
+            days = new[DAY_COLUMN].to_numpy(dtype='datetime64[ns]')
+            valid = np.flatnonzero(~np.isnat(days))
+            order = valid[np.argsort(days[valid], kind='stable')]
+            # Con el mismo día, las filas nuevas van detrás (posición mayor), como en un orden estable
+            at = np.searchsorted(self.sorted_days, days[order], side='right')
+            index.date_order = np.insert(self.date_order, at, (order + start).astype(POSITION_DTYPE))
+            index.sorted_days = np.insert(self.sorted_days, at, days[order])
+
+        if 'Message ID' in df.columns:
+            message_ids = pd.to_numeric(new['Message ID'], errors='coerce').fillna(-1).to_numpy(dtype='int64')
+        else:
+            message_ids = np.arange(start, len(df), dtype='int64')
+        index.message_ids = np.concatenate((self.message_ids, message_ids))
+
+        index.rank_orders = {}
+        index.ranks = {}
+        index.rank_keys = {}
+        for sort_by, old_order in self.rank_orders.items():
+            order, _, keys = self._build_rank(new[SORT_KEYS[sort_by]], message_ids)
+            at = self._merge_points(self.rank_keys[sort_by][old_order], self.message_ids[old_order],
+                                    keys[order], message_ids[order])
+            merged = np.insert(old_order, at, (order + start).astype(POSITION_DTYPE))
+            rank = np.empty(len(merged), dtype=POSITION_DTYPE)
+            rank[merged] = np.arange(len(merged), dtype=POSITION_DTYPE)
+            index.rank_orders[sort_by] = merged
+            index.ranks[sort_by] = rank
+            index.rank_keys[sort_by] = np.concatenate((self.rank_keys[sort_by], keys))
+
+        logger.info(f"Índice de filtros ampliado: {len(new)} filas nuevas ({index.size} en total)")
+        return index
+
+    @staticmethod
+    def _indexed_columns(df):
+        columns = {'Title', MEDIA_TYPE_COLUMN, 'Label', 'Score', DAY_COLUMN} | set(SORT_KEYS.values())
+        return frozenset(col for col in columns if col in df.columns)
+
+    def _built_columns(self):
+        """Columnas con las que se construyó el índice, para comparar con `_indexed_columns()`."""
+        built = {
+            'Title': self.channel_postings,
+            MEDIA_TYPE_COLUMN: self.media_type_bitmaps,
+            'Label': self.label_bitmaps,
+            'Score': self.scores,
+            DAY_COLUMN: self.date_order
+        }
+        columns = {col for col, structure in built.items() if structure is not None}
+        return frozenset(columns | {SORT_KEYS[sort_by] for sort_by in self.rank_orders})
+
+    @staticmethod
+    def _append_bitmaps(bitmaps, new_bitmaps, size, new_size):
+        """Bitmaps de las filas de `bitmaps` seguidas de las de `new_bitmaps`, por valor."""
+        combined = {}
+        for key in list(bitmaps) + [key for key in new_bitmaps if key not in bitmaps]:
+            old = np.unpackbits(bitmaps[key], count=size) if key in bitmaps else np.zeros(size, dtype=np.uint8)
+            added = np.unpackbits(new_bitmaps[key], count=new_size) if key in new_bitmaps else \
+                np.zeros(new_size, dtype=np.uint8)
+            combined[key] = np.packbits(np.concatenate((old, added)))
+        return combined
+
+    @staticmethod
+    def _merge_points(keys, message_ids, new_keys, new_message_ids):
+        """
+        Posición de inserción de cada fila nueva, ordenadas por (clave, Message ID), en
+        la permutación existente (`keys` y `message_ids` en el orden de la permutación).
+        Ante un empate completo la fila nueva va detrás, como en el orden estable.
+        """
+        at = np.searchsorted(keys, new_keys, side='left')
+        hi = np.searchsorted(keys, new_keys, side='right')
+        tied = np.flatnonzero(hi > at)
+        if len(tied) == 0:
+            return at
+        # Las filas nuevas están ordenadas, así que las de una misma clave son consecutivas;
+        # dentro del tramo de esa clave se desempata por Message ID
+        for rows in np.split(tied, np.flatnonzero(np.diff(at[tied])) + 1):
+            lo, end = at[rows[0]], hi[rows[0]]
+            at[rows] = lo + np.searchsorted(message_ids[lo:end], new_message_ids[rows], side='right')
+        return at
+
+    def _empty_bitmap(self):
+        return np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def date_positions(self, date_start=None, date_end=None):
+        """Posiciones con día en [date_start, date_end), mediante búsqueda binaria."""
+        lo = 0
+        hi = len(self.sorted_days)
+        if date_start is not None:
+            lo = np.searchsorted(self.sorted_days, pd.Timestamp(date_start).to_datetime64(), side='left')
+        if date_end is not None:
+            hi = np.searchsorted(self.sorted_days, pd.Timestamp(date_end).to_datetime64(), side='left')
+        return np.sort(self.date_order[lo:max(lo, hi)])
+
+    def channel_positions(self, channels):
+        """Unión de las posiciones de los canales indicados."""
+        empty = np.empty(0, dtype=POSITION_DTYPE)
+        postings = [self.channel_postings.get(channel, empty) for channel in channels]
+        if len(postings) == 1:
+            return postings[0]
+        return np.sort(np.concatenate(postings)) if postings else empty
+
+    @staticmethod
+    def parse_label(value):
+        """Convierte el valor de filtro de etiqueta ('1', 0, 'none'...) en su clave del índice."""
+        if value is None or str(value).strip().lower() in ('', UNLABELED, 'null'):
+            return UNLABELED
+        return float(value)
+
+    def resolve(self, date_start=None, date_end=None, channels=None, media_type=None,
+                label=None, score_min=None, score_max=None):
+        """
+        Devuelve las posiciones de fila que cumplen todos los filtros indicados.
+        Los filtros sobre columnas que no existen en el dataset se ignoran.
+        """
+        postings = []
+        if self.date_order is not None and (date_start is not None or date_end is not None):
+            postings.append(self.date_positions(date_start, date_end))
+        if self.channel_postings is not None and channels is not None:
+            postings.append(self.channel_positions(channels))
+
+        bitmaps = []
+        if self.media_type_bitmaps is not None and media_type is not None:
+            bitmaps.append(self.media_type_bitmaps.get(str(media_type).lower(), self._empty_bitmap()))
+        if self.label_bitmaps is not None and label is not None:
+            bitmaps.append(self.label_bitmaps.get(self.parse_label(label), self._empty_bitmap()))
+
+        if postings:
+            # Partir de la lista más corta e intersecar el resto
+            postings.sort(key=len)
+            positions = postings[0]
+            for other in postings[1:]:
+                positions = np.intersect1d(positions, other, assume_unique=True)
+            for bitmap in bitmaps:
+                positions = positions[_test_bits(bitmap, positions)]
+        elif bitmaps:
+            combined = reduce(np.bitwise_and, bitmaps)
+            positions = np.flatnonzero(np.unpackbits(combined, count=self.size)).astype(POSITION_DTYPE)
+        else:
+            positions = np.arange(self.size, dtype=POSITION_DTYPE)
+
+        # La puntuación es continua: se compara solo sobre los candidatos
+        if self.scores is not None and score_min is not None:
+            positions = positions[self.scores[positions] >= score_min]
+        if self.scores is not None and score_max is not None:
+            positions = positions[self.scores[positions] <= score_max]
+
+        return positions
+
+    def sort_key(self, sort_by):
+        """Clave de orden efectiva para `sort_by`, o None si el dataset no permite ordenar."""
+        if sort_by not in self.rank_orders:
+            sort_by = DEFAULT_SORT
+        return sort_by if sort_by in self.rank_orders else None
+
+    def _walk(self, order, start, positions, limit):
+        """Recorre `order` desde `start` por bloques crecientes hasta reunir `limit` filas de `positions`."""
+        if len(positions) == self.size:
+            return order[start:start + limit]
+        hits = []
+        found = 0
+        chunk = max(limit * 4, 1024)
+        while found < limit and start < self.size:
+            block = order[start:start + chunk]
+            block_hits = block[_contains(positions, block)]
+            hits.append(block_hits)
+            found += len(block_hits)
+            start += chunk
+            chunk *= 2
+        return np.concatenate(hits)[:limit] if hits else positions[:0]
+
+    def sort_positions(self, positions, sort_by=DEFAULT_SORT, limit=None):
+        """
+        Ordena las posiciones filtradas según `sort_by` y devuelve como mucho `limit`.
+        Recorre la permutación precalculada tomando solo las primeras coincidencias,
+        de modo que una página cuesta O(offset + per_page) en lugar de O(n log n).
+        """
+        return self.sort_positions_after(positions, sort_by, 0, limit)
+
+    def sort_positions_after(self, positions, sort_by=DEFAULT_SORT, start_rank=0, limit=None):
+        """Como `sort_positions()`, pero solo con las filas cuyo rango es >= `start_rank`."""
+        sort_by = self.sort_key(sort_by)
+        if sort_by is None:
+            # Sin columna por la que ordenar se mantiene el orden del dataset
+            remaining = positions[np.searchsorted(positions, start_rank):]
+            return remaining[:limit] if limit is not None else remaining
+
+        order = self.rank_orders[sort_by]
+        if limit is None:
+            limit = len(positions)
+        limit = min(limit, len(positions))
+
+        if len(positions) < self.size * SORT_CANDIDATES_RATIO or (start_rank == 0 and limit == len(positions)):
+            ranks = self.ranks[sort_by][positions]
+            ranked_order = np.argsort(ranks, kind='stable')
+            first = np.searchsorted(ranks[ranked_order], start_rank)
+            return positions[ranked_order[first:first + limit]]
+
+        return self._walk(order, start_rank, positions, limit)
+
+    def cursor_key(self, sort_by, position):
+        """Devuelve (rango, clave de orden, Message ID) de una fila, para construir un cursor."""
+        sort_by = self.sort_key(sort_by)
+        if sort_by is None:
+            return int(position), None, int(self.message_ids[position])
+        key = float(self.rank_keys[sort_by][position])
+        return int(self.ranks[sort_by][position]), (key if np.isfinite(key) else None), int(self.message_ids[position])
+
+    def seek(self, sort_by, key, message_id):
+        """
+        Primer rango estrictamente posterior a (clave, Message ID) en la permutación.
+        Sirve para continuar un cursor emitido con otra versión del dataset.
+        """
+        sort_by = self.sort_key(sort_by)
+        if sort_by is None:
+            return 0
+        order = self.rank_orders[sort_by]
+        keys = self.rank_keys[sort_by]
+        target = (np.inf if key is None else key, message_id)
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = order[mid]
+            if (keys[row], self.message_ids[row]) <= target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
@@ -0,0 +1,33 @@
+import threading
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import Config
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_http_session():
+    """
+    Sesión HTTP compartida por el proceso: reutiliza las conexiones keep-alive a las
+    URLs públicas de S3 y reintenta los errores transitorios con backoff.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retries = Retry(total=3, connect=1, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                                allowed_methods=frozenset(['GET', 'HEAD']))
+                adapter = HTTPAdapter(pool_connections=Config.HTTP_POOL_MAXSIZE,
+                                      pool_maxsize=Config.HTTP_POOL_MAXSIZE, max_retries=retries)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+                logger.info("Sesión HTTP compartida inicializada")
+    return _session
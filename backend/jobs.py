@@ -0,0 +1,263 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import numpy as np
+from config import Config
+from export import EXPORT_FORMATS, iter_export, read_export_rows
+from s3_client import get_s3_client
+from uploads import multipart_upload
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+JOB_DESTINATIONS = ('local', 's3')
+
+class JobError(ValueError):
+    """Trabajo desconocido o con parámetros no válidos."""
+
+def write_chunks(path, chunks):
+    """Escribe un flujo de bloques de bytes en `path` (vía archivo temporal). Devuelve tamaño y SHA-256."""
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return size, digest.hexdigest()
+
+def run_export(source, positions, labels, columns, export_format, destination, name, directory):
+    """
+    Trabajo de exportación (en un proceso del pool). Recibe el archivo Arrow del
+    snapshot (`write_export_source()`), las posiciones exportadas y sus etiquetas, y
+    genera la exportación en streaming desde el archivo mapeado en memoria.
+    """
+    frame = read_export_rows(source, positions, labels, columns)
+    extension, mimetype = EXPORT_FORMATS[export_format]
+    chunks = iter_export(frame, np.arange(len(frame)), export_format, Config.EXPORT_CHUNK_SIZE)
+    filename = f"{name}.{extension}"
+    if destination == 's3':
+        key = f"exports/{filename}"
+        upload = multipart_upload(get_s3_client(), key, chunks, content_type=mimetype)
+        return {'destination': 's3', 'key': key, 'rows': len(frame), 'size': upload['size'], 'sha256': upload['sha256']}
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename)
+    size, sha256 = write_chunks(path, chunks)
+    return {'destination': 'local', 'path': path, 'filename': filename, 'mimetype': mimetype,
+            'rows': len(frame), 'size': size, 'sha256': sha256}
+
+def run_export_relevants(source, positions, labels, columns, export_path, s3_key):
+    """Trabajo de /export_relevants: CSV local y, si hay conexión, copia en S3."""
+    frame = read_export_rows(source, positions, labels, columns)
+    size, sha256 = write_chunks(export_path, iter_export(frame, np.arange(len(frame)), 'csv', Config.EXPORT_CHUNK_SIZE))
+    logger.info(f"Mensajes relevantes exportados localmente a {export_path}")
+    result = {'destination': 'local', 'path': export_path, 'rows': len(frame), 'size': size, 'sha256': sha256, 'key': None}
+    try:
+        s3_client = get_s3_client()
+        if s3_client.check_connection():
+            s3_client.upload_file(export_path, s3_key)
+            logger.info("Mensajes relevantes exportados a S3")
+            result['key'] = s3_key
+        else:
+            logger.warning("No se pudo conectar con S3, solo se exportó localmente")
+    except Exception as e:
+        logger.warning(f"Error al exportar a S3: {e}, solo se exportó localmente")
+    return result
+
+class Job:
+    """Estado de un trabajo enviado a `JobRunner`."""
+    __slots__ = ('id', 'kind', 'key', 'version', 'status', 'created_at', 'finished_at', 'result', 'error', 'future')
+
+    def __init__(self, kind, key, version):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.version = version
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.future = None
+
+    @property
+    def finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def to_dict(self):
+        status = self.status
+        if status == JOB_QUEUED and self.future is not None and self.future.running():
+            status = JOB_RUNNING
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': status,
+            'version': self.version,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            # La ruta del artefacto en el servidor no se publica: se descarga por /api/jobs/<id>/artifact
+            'result': {key: value for key, value in self.result.items() if key != 'path'} if self.result else self.result,
+            'error': self.error
+        }
+
+class JobRunner:
+    """
+    Trabajos pesados (exportaciones) fuera de los hilos de las peticiones, en un pool
+    acotado de procesos: la codificación y la compresión no compiten por el GIL con
+    el tráfico interactivo. Cada tipo de trabajo se registra con una función
+    `prepare(params)` que, en el hilo de la petición, devuelve la versión del
+    dataset, una identidad canónica del resultado y `build(job)`: un gestor de
+    contexto que produce la función y los argumentos que se ejecutan en el pool.
+    `build` se ejecuta en un hilo del runner (no en la petición) y su contexto se
+    mantiene abierto hasta que el proceso termina, así que lo que prepara para el
+    trabajo (p. ej. el archivo de datos) se libera al acabar.
+
+    Dos envíos con la misma identidad y versión comparten trabajo: si el primero está
+    en curso se devuelve ese, y si ya terminó se reutiliza su resultado mientras el
+    artefacto exista. Se conservan como mucho `max_jobs` trabajos terminados; al
+    descartar uno se borra su artefacto local.
+    """
+
+    def __init__(self, max_workers=2, max_jobs=200, artifact_dir=None):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.artifact_dir = artifact_dir
+        self._handlers = {}
+        self._jobs = OrderedDict()
+        self._by_key = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='jobs')
+        self.submitted = 0
+        self.deduplicated = 0
+        self.reused = 0
+
+    def register(self, kind, prepare):
+        self._handlers[kind] = prepare
+
+    def _executor(self):
+        # Procesos 'spawn': no se hereda por fork el estado de los hilos del servidor
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    @staticmethod
+    def _job_key(kind, version, identity):
+        return hashlib.sha256(repr((kind, version, identity)).encode('utf-8')).hexdigest()
+
+    def _artifact_exists(self, job):
+        path = (job.result or {}).get('path')
+        return path is None or os.path.exists(path)
+
+    def submit(self, kind, params):
+        """Envía un trabajo, o devuelve el equivalente en curso o ya terminado para la misma versión."""
+        prepare = self._handlers.get(kind)
+        if prepare is None:
+            raise JobError(f"Tipo de trabajo desconocido: {kind}")
+        version, identity, build = prepare(params or {})
+        key = self._job_key(kind, version, identity)
+
+        with self._lock:
+            existing = self._jobs.get(self._by_key.get(key))
+            if existing is not None:
+                if not existing.finished:
+                    self.deduplicated += 1
+                    return existing
+                if existing.status == JOB_DONE and self._artifact_exists(existing):
+                    self.reused += 1
+                    self._jobs.move_to_end(existing.id)
+                    return existing
+            job = Job(kind, key, version)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+            self.submitted += 1
+            self._evict()
+
+        job.future = self._threads.submit(self._run, job, build)
+        job.future.add_done_callback(lambda future: self._finish(job, future=future))
+        logger.info(f"Trabajo {job.kind} {job.id} encolado (versión {version})")
+        return job
+
+    def _run(self, job, build):
+        with build(job) as (func, args):
+            return self._executor().submit(func, *args).result()
+
+    def _finish(self, job, future):
+        error = future.exception()
+        with self._lock:
+            if job.finished:
+                return
+            job.finished_at = time.time()
+            if error is not None:
+                job.status = JOB_FAILED
+                job.error = str(error)
+                if self._by_key.get(job.key) == job.id:
+                    # Un trabajo fallido no se reutiliza: el siguiente envío lo reintenta
+                    del self._by_key[job.key]
+            else:
+                job.result = future.result()
+                job.status = JOB_DONE
+        if error is not None:
+            logger.error(f"Trabajo {job.kind} {job.id} fallido: {error}")
+        else:
+            logger.info(f"Trabajo {job.kind} {job.id} terminado en {job.finished_at - job.created_at:.1f}s")
+
+    def _evict(self):
+        """Descarta los trabajos terminados más antiguos por encima de `max_jobs`."""
+        excess = len(self._jobs) - self.max_jobs
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:max(excess, 0)]:
+            job = self._jobs.pop(job_id)
+            if self._by_key.get(job.key) == job_id:
+                del self._by_key[job.key]
+            path = (job.result or {}).get('path')
+            if path and self.artifact_dir and os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.artifact_dir):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job, timeout=None):
+        """Espera como mucho `timeout` segundos a que termine el trabajo. Devuelve True si terminó."""
+        if job.future is not None and not job.finished:
+            try:
+                job.future.result(timeout)
+            except FutureTimeoutError:
+                return False
+            except Exception:
+                pass
+            # El callback de finalización puede no haberse ejecutado todavía
+            self._finish(job, future=job.future)
+        return job.finished
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+        for job in jobs:
+            counts[job.to_dict()['status']] += 1
+        return dict(counts, workers=self.max_workers, submitted=self.submitted,
+                    deduplicated=self.deduplicated, reused=self.reused)
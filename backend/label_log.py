@@ -0,0 +1,363 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timezone, timedelta
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from partitions import channel_keys
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Segmentos del registro en S3: labels/segments/<marca de tiempo>-<id>.jsonl
+LABEL_LOG_PREFIX = 'labels/segments/'
+# Snapshots compactados: labels/snapshots/<nombre del último segmento que incluyen>
+LABEL_SNAPSHOT_PREFIX = 'labels/snapshots/'
+
+def make_label_event(channel, message_id, label, user=None):
+    """Evento de etiquetado: la última etiqueta de cada (canal, Message ID) es la vigente."""
+    return {
+        'id': uuid.uuid4().hex,
+        'channel': channel,
+        'message_id': int(message_id),
+        'label': label,
+        'user': user,
+        'ts': time.time()
+    }
+
+def _segment_key(ts):
+    stamp = datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    return f"{LABEL_LOG_PREFIX}{stamp}-{uuid.uuid4().hex[:8]}.jsonl"
+
+def _encode(events):
+    return ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events)
+
+def _decode(body, segment):
+    return [dict(json.loads(line), segment=segment) for line in body.decode('utf-8').splitlines() if line]
+
+class LabelLog:
+    """
+    Registro de etiquetas de solo anexado, separado del archivo de mensajes.
+
+    Cada escritura sube un segmento pequeño a S3 (la copia compartida por todos los
+    procesos y hosts) y se aplica a `store` (la tabla `label` de SQLite), que guarda la
+    etiqueta vigente de cada (canal, Message ID) y recuerda qué segmentos aplicó: al
+    arrancar solo se descargan los que faltan. `apply(df)` superpone las etiquetas al
+    snapshot de mensajes al publicarlo.
+
+    Cada `compact_segments` segmentos, `sync()` sube un snapshot compactado con
+    todas las etiquetas vigentes hasta un segmento dado. Un proceso sin estado (o
+    que se quedó atrás) carga el snapshot y solo lista los segmentos posteriores;
+    los anteriores pueden expirar con una regla de ciclo de vida del bucket.
+    """
+
+    # Margen al listar segmentos nuevos: cubre relojes desfasados entre escritores
+    SYNC_OVERLAP = 300
+
+    def __init__(self, store, get_client=None, prefix=LABEL_LOG_PREFIX,
+                 snapshot_prefix=LABEL_SNAPSHOT_PREFIX, compact_segments=500):
+        self.store = store
+        self.get_client = get_client
+        self.prefix = prefix
+        self.snapshot_prefix = snapshot_prefix
+        self.compact_segments = compact_segments
+
+    @property
+    def version(self):
+        """Versión de las etiquetas: cambia con cada escritura aplicada, en cualquier proceso."""
+        return self.store.version
+
+    def append(self, events):
+        """
+        Persiste eventos de etiquetado: un segmento en S3 y un upsert por evento en la
+        tabla de etiquetas. El coste depende del número de eventos, no del tamaño del dataset.
+        """
+        if not events:
+            return self.version
+        client = self.get_client() if self.get_client is not None else None
+        key = _segment_key(events[0]['ts'])
+        events = [dict(event, segment=key) for event in events]
+        if client is not None:
+            if not client.check_connection():
+                raise IOError("No hay conexión con S3 para registrar las etiquetas")
+            client.s3_client.put_object(
+                Bucket=client.bucket_name,
+                Key=key,
+                Body=_encode(events).encode('utf-8'),
+                ContentType='application/x-ndjson'
+            )
+        self.store.write(events, [key])
+        logger.info(f"Etiquetas registradas: {len(events)} eventos en {key}")
+        return self.version
+
+    def _stamp_key(self, key, delta=0):
+        """Clave del prefijo de segmentos para la marca de tiempo de `key` desplazada `delta` segundos."""
+        stamp = key[len(self.prefix):].split('-', 1)[0]
+        since = datetime.strptime(stamp, '%Y%m%dT%H%M%S%f') + timedelta(seconds=delta)
+        return f"{self.prefix}{since.strftime('%Y%m%dT%H%M%S%f')}"
+
+    def _list(self, client, prefix, start_after=None):
+        paginator = client.s3_client.get_paginator('list_objects_v2')
+        params = {'Bucket': client.bucket_name, 'Prefix': prefix}
+        if start_after:
+            params['StartAfter'] = start_after
+        keys = []
+        for page in paginator.paginate(**params):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []))
+        return keys
+
+    def _list_segments(self, client):
+        newest = self.store.newest_segment()
+        start_after = self._stamp_key(newest, -self.SYNC_OVERLAP) if newest else None
+        return self._list(client, self.prefix, start_after)
+
+    def _read(self, client, key, segment):
+        body = client.s3_client.get_object(Bucket=client.bucket_name, Key=key)['Body'].read()
+        return _decode(body, segment)
+
+    def _covered_segment(self, snapshot_key):
+        """Último segmento incluido en un snapshot compactado."""
+        return self.prefix + snapshot_key[len(self.snapshot_prefix):]
+
+    def _restore(self, client, snapshot_key):
+        """
+        Carga el snapshot compactado si este proceso no tiene aplicados los segmentos
+        que incluye. Se registra como aplicado su último segmento, así que la
+        siguiente lista empieza ahí. Devuelve True si el estado cambió.
+        """
+        if snapshot_key is None:
+            return False
+        covered = self._covered_segment(snapshot_key)
+        newest = self.store.newest_segment()
+        if newest is not None and newest >= covered:
+            return False
+        events = self._read(client, snapshot_key, covered)
+        applied = self.store.write(events, [covered])
+        logger.info(f"Snapshot de etiquetas {snapshot_key} cargado: {len(events)} etiquetas, {applied} aplicadas")
+        return applied > 0
+
+    def compact(self, client, snapshot_key=None):
+        """
+        Sube un snapshot con las etiquetas vigentes hasta el segmento aplicado más
+        reciente fuera del margen de sincronización (uno anterior podría no haber
+        llegado todavía) y borra los snapshots previos salvo `snapshot_key`.
+        Devuelve la clave del snapshot nuevo, o None si no hay segmentos nuevos.
+        """
+        since = datetime.fromtimestamp(time.time() - self.SYNC_OVERLAP, tz=timezone.utc)
+        until = f"{self.prefix}{since.strftime('%Y%m%dT%H%M%S%f')}"
+        covered = self.store.newest_segment(until=until)
+        previous = self._covered_segment(snapshot_key) if snapshot_key else None
+        if covered is None or (previous is not None and covered <= previous):
+            return None
+        events = self.store.events()
+        key = self.snapshot_prefix + covered[len(self.prefix):]
+        client.s3_client.put_object(
+            Bucket=client.bucket_name,
+            Key=key,
+            Body=_encode(events).encode('utf-8'),
+            ContentType='application/x-ndjson'
+        )
+        for old_key in self._list(client, self.snapshot_prefix):
+            if old_key not in (key, snapshot_key):
+                client.s3_client.delete_object(Bucket=client.bucket_name, Key=old_key)
+        logger.info(f"Registro de etiquetas compactado en {key}: {len(events)} etiquetas")
+        return key
+
+    def sync(self, max_workers=8):
+        """
+        Incorpora los segmentos que otros procesos subieron a S3 desde la última
+        sincronización, empezando por el snapshot compactado si hace falta, y compacta
+        el registro cada `compact_segments` segmentos. Devuelve True si el estado cambió.
+        """
+        client = self.get_client() if self.get_client is not None else None
+        if client is None or not client.check_connection():
+            return False
+        snapshots = self._list(client, self.snapshot_prefix)
+        snapshot_key = max(snapshots) if snapshots else None
+        changed = self._restore(client, snapshot_key)
+
+        listed = self._list_segments(client)
+        applied = self.store.applied_segments(listed) if listed else set()
+        new_keys = [key for key in listed if key not in applied]
+        if new_keys:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(new_keys)), thread_name_prefix='labels') as pool:
+                segments = list(pool.map(lambda key: self._read(client, key, key), new_keys))
+            applied = self.store.write([event for segment in segments for event in segment], new_keys)
+            logger.info(f"Registro de etiquetas sincronizado: {len(new_keys)} segmentos, {applied} eventos nuevos")
+            changed = changed or applied > 0
+
+        if self.compact_segments and self.store.count_segments(
+                after=self._covered_segment(snapshot_key) if snapshot_key else None) >= self.compact_segments:
+            try:
+                self.compact(client, snapshot_key)
+            except Exception as e:
+                logger.warning(f"No se pudo compactar el registro de etiquetas: {e}")
+        return changed
+
+    def apply(self, df):
+        """
+        Superpone las etiquetas a `df` con un join vectorizado por (canal, Message ID)
+        contra el índice de la tabla, cacheado por versión. Devuelve un DataFrame
+        nuevo (`df` no se modifica) y la versión de las etiquetas aplicadas.
+        """
+        version, lookup = self.store.frame()
+        if df.empty or 'Message ID' not in df.columns or lookup.empty:
+            return df, version
+        message_ids = pd.to_numeric(df['Message ID'], errors='coerce').fillna(-1).astype('int64')
+        keys = pd.MultiIndex.from_arrays([channel_keys(df).to_numpy(), message_ids.to_numpy()])
+        values = lookup.reindex(keys).to_numpy()
+        found = pd.notna(values)
+        if not found.any():
+            return df, version
+        current = df['Label'].to_numpy(dtype=object, copy=True) if 'Label' in df.columns else \
+            pd.Series(pd.NA, index=df.index, dtype=object).to_numpy(copy=True)
+        current[found] = values[found]
+        df = df.copy(deep=False)
+        df['Label'] = current
+        return df, version
+
+    def apply_changes(self, df, since_version, message_ids=None):
+        """
+        Superpone a `df` solo las etiquetas escritas después de `since_version` (la
+        versión con la que se construyó). Las filas se localizan comparando Message
+        ID y, solo en las candidatas, el canal: el coste depende de las etiquetas
+        nuevas y no de reaplicar toda la tabla. Devuelve el DataFrame nuevo, la
+        versión aplicada y las posiciones modificadas con su etiqueta anterior y nueva,
+        o None si los cambios no se pueden calcular y hay que volver a `apply()`.
+        `message_ids` (los Message ID de `df` como int64, p. ej. los del índice) evita
+        volver a convertir la columna.
+        """
+        version, rows = self.store.changes(since_version)
+        if rows is None:
+            return None
+        empty = np.empty(0, dtype='int64')
+        if not rows or df.empty or 'Message ID' not in df.columns:
+            return df, version, empty, [], []
+        lookup = {(channel, int(message_id)): label for channel, message_id, label in rows}
+        if message_ids is None:
+            message_ids = pd.to_numeric(df['Message ID'], errors='coerce').fillna(-1).astype('int64').to_numpy()
+        candidates = np.flatnonzero(np.isin(message_ids, np.fromiter((key[1] for key in lookup), dtype='int64')))
+        channels = channel_keys(df.iloc[candidates]).to_numpy()
+        values = [lookup.get((channel, int(message_id))) for channel, message_id in zip(channels, message_ids[candidates])]
+        found = np.array([value is not None for value in values], dtype=bool)
+        if not found.any():
+            return df, version, empty, [], []
+        positions = candidates[found]
+        new_labels = [value for value in values if value is not None]
+        current = df['Label'].to_numpy(dtype=object, copy=True) if 'Label' in df.columns else \
+            pd.Series(pd.NA, index=df.index, dtype=object).to_numpy(copy=True)
+        old_labels = list(current[positions])
+        current[positions] = np.array(new_labels, dtype=object)
+        df = df.copy(deep=False)
+        df['Label'] = current
+        return df, version, positions, old_labels, new_labels
+
+    def stats(self):
+        return self.store.stats()
+
+class GroupCommitWriter:
+    """
+    Agrupa las escrituras de etiquetas de todas las peticiones en un solo flush
+    duradero. El primer evento pendiente abre una ventana de `window` segundos (o
+    hasta `max_events` eventos); al cerrarse, todos los eventos acumulados se
+    persisten con un único `log.append()` y cada petición recibe la confirmación
+    cuando su escritura ya es duradera. `on_flush()` se llama una vez por flush,
+    después de persistir y antes de confirmar.
+    """
+
+    def __init__(self, log, window=0.2, max_events=500, on_flush=None):
+        self.log = log
+        self.window = window
+        self.max_events = max_events
+        self.on_flush = on_flush
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pending_events = 0
+        self._thread = None
+        self.flushes = 0
+        self.flushed_events = 0
+        self.max_batch = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=256)
+
+    def _ensure_thread(self):
+        # El hilo se crea en el primer envío: tras el fork de cada worker, no al importar
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='label-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, events):
+        """Encola eventos; devuelve un Future que se resuelve con la versión del registro tras el flush."""
+        future = Future()
+        with self._cond:
+            self._ensure_thread()
+            self._pending.append((events, future))
+            self._pending_events += len(events)
+            self._cond.notify()
+        return future
+
+    def write(self, events, timeout=None):
+        """Encola eventos y espera a que sean duraderos."""
+        return self.submit(events).result(timeout)
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window
+            while self._pending_events < self.max_events:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending, self._pending_events = self._pending, [], 0
+            return batch
+
+    def _run(self):
+        while True:
+            self._flush(self._next_batch())
+
+    def _flush(self, batch):
+        events = [event for request_events, _ in batch for event in request_events]
+        started = time.monotonic()
+        try:
+            version = self.log.append(events)
+            if self.on_flush is not None:
+                try:
+                    self.on_flush()
+                except Exception as e:
+                    logger.error(f"Error al publicar las etiquetas tras el flush: {e}")
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error al persistir {len(events)} eventos de etiquetado: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        elapsed = time.monotonic() - started
+        self.flushes += 1
+        self.flushed_events += len(events)
+        self.max_batch = max(self.max_batch, len(events))
+        self._latencies.append(elapsed)
+        logger.info(f"Flush de etiquetas: {len(events)} eventos de {len(batch)} peticiones en {elapsed * 1000:.1f} ms")
+        for _, future in batch:
+            future.set_result(version)
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            'flushes': self.flushes,
+            'events': self.flushed_events,
+            'errors': self.errors,
+            'avg_batch': round(self.flushed_events / self.flushes, 2) if self.flushes else 0,
+            'max_batch': self.max_batch,
+            'last_flush_ms': round(self._latencies[-1] * 1000, 1) if latencies else None,
+            'avg_flush_ms': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+            'p95_flush_ms': round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1) if latencies else None,
+            'window_ms': int(self.window * 1000),
+            'max_events': self.max_events
+        }
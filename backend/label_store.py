@@ -0,0 +1,196 @@
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select, true
+from sqlalchemy.dialects.sqlite import insert
+from models import Label, LabelGeneration, LabelSegment
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Claves por sentencia en las consultas IN: SQLite limita los parámetros (999 en versiones antiguas)
+SQL_PARAMS_CHUNK = 500
+
+class LabelStore:
+    """
+    Etiquetas vigentes en la tabla `label` de SQLite (modo WAL), indexada por
+    (canal, Message ID). Cada escritura es una transacción con un upsert por evento
+    que solo gana si el evento es más reciente que la etiqueta guardada, así que
+    aplicar dos veces el mismo segmento no cambia nada. La fila de `LabelGeneration`
+    cuenta las escrituras y hace de versión de las etiquetas para todos los procesos
+    que comparten el archivo.
+    """
+
+    def __init__(self, get_engine):
+        self.get_engine = get_engine
+        self._engine = None
+        self._lock = threading.Lock()
+        self._frame = (None, None)
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = self.get_engine()
+        return self._engine
+
+    def write(self, events, segments=()):
+        """
+        Aplica eventos en una transacción y registra los segmentos de los que vienen.
+        Los segmentos que otro proceso ya aplicó se descartan. Devuelve cuántos eventos
+        se aplicaron.
+        """
+        labels = Label.__table__
+        with self.engine.begin() as conn:
+            if segments:
+                applied = self._applied(conn, segments)
+                events = [event for event in events if event.get('segment') not in applied]
+                new_segments = [{'key': key} for key in segments if key not in applied]
+                if new_segments:
+                    conn.execute(insert(LabelSegment.__table__).on_conflict_do_nothing(), new_segments)
+            if not events:
+                return 0
+
+            generation = self._next_generation(conn)
+            statement = insert(labels)
+            statement = statement.on_conflict_do_update(
+                index_elements=['channel', 'message_id'],
+                set_={
+                    'label': statement.excluded.label,
+                    'user': statement.excluded.user,
+                    'event_id': statement.excluded.event_id,
+                    'ts': statement.excluded.ts,
+                    'generation': statement.excluded.generation
+                },
+                # Gana el evento más reciente, con el id como desempate
+                where=(statement.excluded.ts > labels.c.ts) |
+                      ((statement.excluded.ts == labels.c.ts) & (statement.excluded.event_id > labels.c.event_id))
+            )
+            conn.execute(statement, [{
+                'channel': event['channel'],
+                'message_id': int(event['message_id']),
+                'label': int(event['label']),
+                'user': event.get('user'),
+                'event_id': event['id'],
+                'ts': event['ts'],
+                'generation': generation
+            } for event in events])
+        return len(events)
+
+    @staticmethod
+    def _next_generation(conn):
+        generations = LabelGeneration.__table__
+        conn.execute(insert(generations).values(id=1, value=1).on_conflict_do_update(
+            index_elements=['id'], set_={'value': generations.c.value + 1}
+        ))
+        return conn.execute(select(generations.c.value).where(generations.c.id == 1)).scalar()
+
+    @staticmethod
+    def _applied(conn, keys):
+        keys = list(keys)
+        applied = set()
+        for start in range(0, len(keys), SQL_PARAMS_CHUNK):
+            chunk = keys[start:start + SQL_PARAMS_CHUNK]
+            applied.update(conn.execute(select(LabelSegment.key).where(LabelSegment.key.in_(chunk))).scalars())
+        return applied
+
+    def applied_segments(self, keys):
+        """Cuáles de `keys` ya están aplicados."""
+        with self.engine.connect() as conn:
+            return self._applied(conn, keys)
+
+    def newest_segment(self, until=None):
+        """Segmento aplicado más reciente, o el más reciente con clave <= `until`."""
+        statement = select(func.max(LabelSegment.key))
+        if until is not None:
+            statement = statement.where(LabelSegment.key <= until)
+        with self.engine.connect() as conn:
+            return conn.execute(statement).scalar()
+
+    def count_segments(self, after=None):
+        """Segmentos aplicados con clave posterior a `after` (todos si es None)."""
+        statement = select(func.count()).select_from(LabelSegment)
+        if after is not None:
+            statement = statement.where(LabelSegment.key > after)
+        with self.engine.connect() as conn:
+            return conn.execute(statement).scalar()
+
+    def events(self):
+        """Etiquetas vigentes como eventos de etiquetado, para compactar el registro."""
+        labels = Label.__table__
+        statement = select(labels.c.event_id, labels.c.channel, labels.c.message_id, labels.c.label,
+                           labels.c.user, labels.c.ts).order_by(labels.c.ts)
+        with self.engine.connect() as conn:
+            return [{'id': event_id, 'channel': channel, 'message_id': message_id, 'label': label,
+                     'user': user, 'ts': ts}
+                    for event_id, channel, message_id, label, user, ts in conn.execute(statement)]
+
+    @property
+    def version(self):
+        """Número de escrituras aplicadas, o None si todavía no hay etiquetas."""
+        with self.engine.connect() as conn:
+            value = conn.execute(select(LabelGeneration.value).where(LabelGeneration.id == 1)).scalar()
+        return f"labels:{value}" if value else None
+
+    def _read(self, since=None):
+        """
+        Versión y filas de `label` escritas después de la generación `since` (todas
+        si es None), leídas en una sola sentencia: la versión corresponde exactamente
+        a las filas, aunque otro proceso escriba a la vez.
+        """
+        generations = LabelGeneration.__table__
+        labels = Label.__table__
+        condition = labels.c.generation > since if since else true()
+        statement = select(generations.c.value, labels.c.channel, labels.c.message_id, labels.c.label) \
+            .select_from(generations.outerjoin(labels, condition)) \
+            .where(generations.c.id == 1)
+        with self.engine.connect() as conn:
+            rows = conn.execute(statement).all()
+        if not rows:
+            return None, []
+        value = rows[0][0]
+        return (f"labels:{value}" if value else None), [row[1:] for row in rows if row[1] is not None]
+
+    def changes(self, since_version):
+        """
+        Etiquetas escritas después de `since_version` (una versión de `version`, o None
+        para todas) como lista de (canal, Message ID, etiqueta), con la versión vigente.
+        Si la versión vigente es anterior a `since_version` las filas son None.
+        """
+        since = int(since_version.split(':', 1)[1]) if since_version else None
+        version, rows = self._read(since)
+        if since and (version is None or int(version.split(':', 1)[1]) < since):
+            # La tabla se reinició: los cambios no se pueden calcular desde esa versión
+            return version, None
+        return version, rows
+
+    def frame(self):
+        """
+        Etiquetas vigentes como Series indexada por (canal, Message ID), con la versión
+        que les corresponde. Se cachea por versión: entre escrituras no se vuelve a
+        leer la tabla.
+        """
+        version = self.version
+        with self._lock:
+            cached_version, lookup = self._frame
+            if cached_version == version and lookup is not None:
+                return version, lookup
+        version, rows = self._read()
+        lookup = pd.Series(
+            [row[2] for row in rows],
+            index=pd.MultiIndex.from_arrays([
+                np.array([row[0] for row in rows], dtype=object),
+                np.array([row[1] for row in rows], dtype='int64')
+            ]),
+            dtype=object
+        )
+        with self._lock:
+            self._frame = (version, lookup)
+        return version, lookup
+
+    def stats(self):
+        with self.engine.connect() as conn:
+            labels = conn.execute(select(func.count()).select_from(Label)).scalar()
+            segments = conn.execute(select(func.count()).select_from(LabelSegment)).scalar()
+        return {'labels': labels, 'segments': segments, 'version': self.version}
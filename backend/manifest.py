@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from botocore.exceptions import ClientError
+from datetime import datetime
+import pandas as pd
+from dataset_format import read_snapshot, write_snapshot
+from disk_cache import file_sha256
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Objeto pequeño que describe la versión actual del dataset en el bucket
+MANIFEST_FILE = 'telegram_messages.manifest.json'
+MANIFEST_SCHEMA = 1
+
+# Formatos en orden de preferencia para el cargador
+FORMAT_PREFERENCE = ('arrow', 'json', 'csv')
+CONTENT_TYPES = {
+    'arrow': 'application/vnd.apache.arrow.file',
+    'json': 'application/json',
+    'csv': 'text/csv'
+}
+
+class ManifestConflict(Exception):
+    """Otro escritor publicó el manifiesto entre nuestra lectura y nuestra escritura."""
+
+def format_of(key):
+    """Formato de un objeto según su extensión."""
+    return os.path.splitext(key)[1].lstrip('.').lower()
+
+def describe_bytes(data, key, format=None):
+    """Entrada del manifiesto para un objeto en memoria."""
+    return {
+        'key': key,
+        'format': format or format_of(key),
+        'size': len(data),
+        'sha256': hashlib.sha256(data).hexdigest()
+    }
+
+def describe_file(path, key=None, format=None):
+    """Entrada del manifiesto para un archivo local, calculando el checksum por bloques."""
+    key = key or os.path.basename(path)
+    return {
+        'key': key,
+        'format': format or format_of(key),
+        'size': os.path.getsize(path),
+        'sha256': file_sha256(path)
+    }
+
+def build_manifest(objects, rows, partitions=None):
+    """
+    Construye el manifiesto de una versión del dataset. La versión se deriva de los
+    checksums de los objetos, así que dos escrituras idénticas comparten versión.
+    `partitions` son las entradas de la distribución particionada (ver partitions.py).
+    """
+    digest = hashlib.sha256()
+    for entry in sorted(list(objects) + list(partitions or []), key=lambda entry: entry['key']):
+        digest.update(f"{entry['key']}:{entry['sha256']};".encode('utf-8'))
+    manifest = {
+        'schema': MANIFEST_SCHEMA,
+        'version': f"sha256:{digest.hexdigest()[:32]}",
+        'rows': int(rows),
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'objects': list(objects)
+    }
+    if partitions:
+        manifest['partitions'] = list(partitions)
+    return manifest
+
+def parse_manifest(raw):
+    """Decodifica y valida un manifiesto. Lanza ValueError si está mal formado."""
+    manifest = json.loads(raw)
+    if not isinstance(manifest, dict) or manifest.get('schema') != MANIFEST_SCHEMA:
+        raise ValueError("Manifiesto con esquema desconocido")
+    if not manifest.get('version') or not (manifest.get('objects') or manifest.get('partitions')):
+        raise ValueError("Manifiesto incompleto")
+    for entry in manifest.get('objects') or []:
+        if not {'key', 'format', 'size', 'sha256'} <= entry.keys():
+            raise ValueError(f"Entrada de manifiesto incompleta: {entry}")
+    for entry in manifest.get('partitions') or []:
+        if not {'key', 'size', 'sha256', 'date', 'channel', 'rows'} <= entry.keys():
+            raise ValueError(f"Partición de manifiesto incompleta: {entry}")
+    return manifest
+
+def select_object(manifest, formats=FORMAT_PREFERENCE):
+    """Objeto del manifiesto en el formato preferido disponible."""
+    by_format = {entry['format']: entry for entry in manifest['objects']}
+    for format in formats:
+        if format in by_format:
+            return by_format[format]
+    raise ValueError(f"El manifiesto no incluye ningún formato soportado: {list(by_format)}")
+
+def write_manifest(manifest, path=MANIFEST_FILE):
+    """Escribe el manifiesto en disco de forma atómica."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"Manifiesto guardado en {path}: versión {manifest['version']}")
+    return path
+
+def read_manifest(path=MANIFEST_FILE):
+    """Manifiesto guardado en disco por `write_manifest()`, o None si no existe o no es válido."""
+    try:
+        with open(path, 'rb') as f:
+            return parse_manifest(f.read())
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.warning(f"Manifiesto local {path} no válido: {e}")
+        return None
+
+def publish_manifest(s3_client, manifest, key=MANIFEST_FILE, if_match=None, create_only=False):
+    """
+    Publica el manifiesto en S3. Se sube después de los objetos que describe: un PUT
+    reemplaza el objeto completo, así que los lectores ven la versión anterior o la nueva.
+    Con `if_match` (ETag leído) o `create_only` la escritura es condicional y lanza
+    `ManifestConflict` si otro escritor se adelantó.
+    """
+    conditions = {}
+    if if_match is not None:
+        conditions['IfMatch'] = if_match
+    elif create_only:
+        conditions['IfNoneMatch'] = '*'
+    try:
+        response = s3_client.s3_client.put_object(
+            Bucket=s3_client.bucket_name,
+            Key=key,
+            Body=json.dumps(manifest).encode('utf-8'),
+            ContentType='application/json',
+            CacheControl='no-cache',
+            **conditions
+        )
+    except ClientError as e:
+        # 412: el ETag ya no coincide; 409: otra escritura condicional en curso
+        if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            raise ManifestConflict(f"El manifiesto {key} cambió durante la publicación") from e
+        raise
+    logger.info(f"Manifiesto publicado en S3: versión {manifest['version']}")
+    return response.get('ETag')
+
+def read_manifest_from_s3(s3_client, key=MANIFEST_FILE):
+    """Lee el manifiesto del bucket, o None si el bucket todavía no tiene uno."""
+    return read_manifest_for_update(s3_client, key)[0]
+
+def read_manifest_for_update(s3_client, key=MANIFEST_FILE):
+    """Manifiesto del bucket y su ETag, para publicar después de forma condicional. (None, None) si no existe."""
+    try:
+        response = s3_client.s3_client.get_object(Bucket=s3_client.bucket_name, Key=key)
+    except s3_client.s3_client.exceptions.NoSuchKey:
+        return None, None
+    return parse_manifest(response['Body'].read()), response.get('ETag')
+
+def union_partition(s3_client, remote, local, directory='.'):
+    """
+    Une dos versiones de la misma partición (día, canal): la `remote` que publicó otro
+    escritor, que se descarga, y la `local`. Si un Message ID está en ambas se queda
+    la fila local, la más reciente. Si la remota no aporta mensajes nuevos se devuelve
+    `local` tal cual; si no, la unión se escribe junto a la local con el nombre de su
+    checksum, se sube al bucket y se devuelve su entrada.
+    """
+    remote_path = os.path.join(directory, remote['key'])
+    os.makedirs(os.path.dirname(remote_path) or '.', exist_ok=True)
+    s3_client.s3_client.download_file(s3_client.bucket_name, remote['key'], remote_path)
+    if file_sha256(remote_path) != remote['sha256']:
+        raise ValueError(f"Checksum de {remote['key']} no coincide con el manifiesto")
+    theirs = read_snapshot(remote_path)
+    ours = read_snapshot(os.path.join(directory, local['key']))
+    if 'Message ID' not in theirs.columns or 'Message ID' not in ours.columns:
+        raise ManifestConflict(f"No se pueden unir las versiones de {local['key']} sin Message ID")
+    if theirs['Message ID'].isin(ours['Message ID']).all():
+        return local
+
+    df = pd.concat([theirs, ours], ignore_index=True)
+    df = df.drop_duplicates(subset='Message ID', keep='last').sort_values('Message ID', kind='stable')
+    df = df.reset_index(drop=True)
+    tmp_path = os.path.join(directory, f"{local['date']}.{local['channel']}.union.arrow")
+    write_snapshot(df, tmp_path)
+    entry = describe_file(tmp_path)
+    key = f"{os.path.dirname(local['key'])}/part-{entry['sha256'][:16]}.arrow"
+    os.replace(tmp_path, os.path.join(directory, key))
+    s3_client.s3_client.upload_file(
+        os.path.join(directory, key), s3_client.bucket_name, key,
+        ExtraArgs={'ContentType': CONTENT_TYPES['arrow']}
+    )
+    logger.info(f"Partición {local['date']}/{local['channel']} unida con la de otro escritor: {len(df)} filas")
+    return dict(local, key=key, size=entry['size'], sha256=entry['sha256'], rows=len(df))
+
+def merge_manifests(remote, local, merge_partition=None):
+    """
+    Combina el manifiesto local con el publicado por otro escritor. Se conservan las
+    particiones remotas de (día, canal) que el local no escribió. Si los dos tienen
+    la misma partición con distinto contenido, `merge_partition(remota, local)`
+    devuelve la entrada de su unión; sin `merge_partition` el solapamiento lanza
+    ManifestConflict, porque sustituir la remota perdería filas del otro escritor.
+    Si el resultado incluye filas que el local no tiene, los objetos completos
+    locales ya no describen todo el dataset y dejan de listarse.
+    """
+    if remote is None or not remote.get('partitions') or not local.get('partitions'):
+        return local
+    remote_slots = {(entry['date'], entry['channel']): entry for entry in remote['partitions']}
+    partitions = []
+    for entry in local['partitions']:
+        theirs = remote_slots.pop((entry['date'], entry['channel']), None)
+        if theirs is not None and theirs['sha256'] != entry['sha256']:
+            if merge_partition is None:
+                raise ManifestConflict(f"Otro escritor publicó otra versión de {entry['key']}")
+            entry = merge_partition(theirs, entry)
+        partitions.append(entry)
+    merged = any(entry is not original for entry, original in zip(partitions, local['partitions']))
+    if not remote_slots and not merged:
+        return local
+    partitions = list(remote_slots.values()) + partitions
+    return build_manifest([], sum(entry['rows'] for entry in partitions), partitions)
+
+def publish_dataset(s3_client, manifest, directory='.', key=MANIFEST_FILE, max_attempts=5):
+    """
+    Sube los objetos y particiones del manifiesto que el bucket todavía no tiene y
+    publica el manifiesto con escritura condicional. Si otro escritor publicó antes,
+    se vuelve a leer el manifiesto, se combina con `merge_manifests()` (las
+    particiones que ambos escribieron se unen con `union_partition()`) y se
+    reintenta: no hace falta un bloqueo global y ninguna de las dos escrituras se
+    pierde. Devuelve el manifiesto publicado.
+    """
+    remote, etag = read_manifest_for_update(s3_client, key)
+    published = {entry['key']: entry['sha256'] for entry in (remote or {}).get('objects', []) + (remote or {}).get('partitions', [])}
+    for entry in manifest.get('objects', []) + manifest.get('partitions', []):
+        if published.get(entry['key']) == entry['sha256']:
+            continue
+        s3_client.s3_client.upload_file(
+            os.path.join(directory, entry['key']), s3_client.bucket_name, entry['key'],
+            ExtraArgs={'ContentType': CONTENT_TYPES.get(entry.get('format', format_of(entry['key'])), 'application/octet-stream')}
+        )
+
+    def merge_partition(theirs, ours):
+        return union_partition(s3_client, theirs, ours, directory)
+
+    for attempt in range(1, max_attempts + 1):
+        candidate = merge_manifests(remote, manifest, merge_partition)
+        try:
+            publish_manifest(s3_client, candidate, key, if_match=etag, create_only=remote is None)
+            return candidate
+        except ManifestConflict as e:
+            if attempt == max_attempts:
+                raise
+            logger.warning(f"{e}; se combina con la versión publicada y se reintenta ({attempt}/{max_attempts})")
+            time.sleep(0.2 * attempt)
+            remote, etag = read_manifest_for_update(s3_client, key)
+
+def load_object(entry, path):
+    """DataFrame de un objeto descargado a `path` (el snapshot Arrow se mapea en memoria)."""
+    if entry['format'] == 'arrow':
+        return read_snapshot(path)
+    if entry['format'] == 'json':
+        with open(path, 'rb') as f:
+            return pd.DataFrame(json.loads(f.read())['messages'])
+    if entry['format'] == 'csv':
+        return pd.read_csv(path)
+    raise ValueError(f"Formato de archivo no soportado: {entry['format']}")
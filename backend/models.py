@@ -1,9 +1,22 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from datetime import datetime
+import sqlite3
 import bcrypt
 
 db = SQLAlchemy()
 
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    """SQLite en modo WAL: los lectores no bloquean al escritor, útil con varios workers."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -43,4 +56,26 @@ class User(db.Model):
             'email_verified': self.email_verified,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'last_login': self.last_login.isoformat() if self.last_login else None
-        } 
\ No newline at end of file
+        } 
+
+class Label(db.Model):
+    """Etiqueta vigente de cada mensaje, por (canal, Message ID)."""
+    __table_args__ = (db.UniqueConstraint('channel', 'message_id', name='uq_label_channel_message'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(255), nullable=False)
+    message_id = db.Column(db.BigInteger, nullable=False)
+    label = db.Column(db.Integer, nullable=False, index=True)
+    user = db.Column(db.String(255))
+    event_id = db.Column(db.String(32), nullable=False)
+    ts = db.Column(db.Float, nullable=False)
+    generation = db.Column(db.Integer, nullable=False, index=True)
+
+class LabelSegment(db.Model):
+    """Segmentos del registro de etiquetas de S3 ya aplicados a la tabla `label`."""
+    key = db.Column(db.String(255), primary_key=True)
+
+class LabelGeneration(db.Model):
+    """Contador de escrituras de la tabla `label` (una fila): es la versión de las etiquetas."""
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,68 @@
+import base64
+import binascii
+import json
+
+class CursorError(ValueError):
+    """Cursor de paginación mal formado o que no corresponde a la consulta."""
+
+def encode_cursor(version, sort_by, rank, key, message_id):
+    """
+    Cursor opaco con la última fila servida: su rango en la versión del dataset
+    que la sirvió y su clave (valor de orden, Message ID) para otras versiones.
+    """
+    payload = {'v': version, 's': sort_by, 'r': rank, 'k': key, 'm': message_id}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """Decodifica un cursor emitido por `encode_cursor()`."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(payload, dict) or not {'v', 's', 'r', 'k', 'm'} <= payload.keys():
+            raise CursorError("Cursor incompleto")
+        payload['r'] = int(payload['r'])
+        payload['m'] = int(payload['m'])
+        if payload['k'] is not None:
+            payload['k'] = float(payload['k'])
+        return payload
+    except CursorError:
+        raise
+    except (ValueError, TypeError, UnicodeError, binascii.Error) as e:
+        raise CursorError(f"Cursor inválido: {e}")
+
+def make_cursor(snapshot, sort_by, position):
+    """Cursor que apunta justo después de la fila `position` del snapshot."""
+    rank, key, message_id = snapshot.index.cursor_key(sort_by, position)
+    return encode_cursor(snapshot.version, sort_by, rank, key, message_id)
+
+def page_after_cursor(snapshot, result, cursor, limit):
+    """
+    Devuelve hasta `limit` posiciones del resultado posteriores al cursor. Con la
+    misma versión del dataset se continúa desde el rango guardado; con otra, se busca
+    la clave (valor, Message ID), de modo que los cambios de datos entre páginas no
+    repiten ni saltan mensajes ya vistos.
+    """
+    if cursor['s'] != result.sort_by:
+        raise CursorError("El cursor no corresponde a la ordenación solicitada")
+    if cursor['v'] is not None and cursor['v'] == snapshot.version:
+        start_rank = cursor['r'] + 1
+    else:
+        start_rank = snapshot.index.seek(result.sort_by, cursor['k'], cursor['m'])
+    return snapshot.index.sort_positions_after(result.positions, result.sort_by, start_rank, limit)
+
+def fetch_page(snapshot, result, start, limit, cursor_token=None):
+    """
+    Devuelve `(posiciones, next_cursor)` de una página del resultado: tras el cursor si
+    se indica, o desde el offset `start` si no. `next_cursor` es None en la última página.
+    """
+    if cursor_token:
+        # Se pide una fila de más para saber si hay página siguiente
+        positions = page_after_cursor(snapshot, result, decode_cursor(cursor_token), limit + 1)
+        has_more = len(positions) > limit
+        positions = positions[:limit]
+    else:
+        positions = result.page(snapshot.index, start, start + limit)
+        has_more = start + limit < result.total
+    next_cursor = make_cursor(snapshot, result.sort_by, positions[-1]) if has_more and len(positions) else None
+    return positions, next_cursor
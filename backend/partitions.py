@@ -0,0 +1,207 @@
+import os
+import re
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from dataset_format import write_snapshot, read_snapshot
+from manifest import describe_file
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Distribución particionada: messages/date=YYYY-MM-DD/channel=<id>/part-<checksum>.arrow
+PARTITION_PREFIX = 'messages'
+PARTITION_DATE_COLUMN = 'Date Sent'
+UNKNOWN_DATE = 'unknown'
+
+def channel_partition_id(value):
+    """Identificador de canal apto para una clave de S3."""
+    if isinstance(value, float) and value.is_integer():
+        # IDs leídos de JSON/CSV con nulos llegan como float
+        value = int(value)
+    text = str(value) if value is not None and not pd.isna(value) else 'unknown'
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', text) or 'unknown'
+
+def _channel_column(df):
+    for col in ('Channel ID', 'Username', 'Title'):
+        if col in df.columns:
+            return col
+    return None
+
+def channel_keys(df):
+    """Identificador del canal de cada fila, como Series alineada con `df`."""
+    channel_col = _channel_column(df)
+    if channel_col is None:
+        return pd.Series('unknown', index=df.index)
+    # Pocos canales: se normalizan los valores distintos y se expanden por código
+    codes, uniques = pd.factorize(df[channel_col], use_na_sentinel=False)
+    ids = np.array([channel_partition_id(value) for value in uniques], dtype=object)
+    return pd.Series(ids[codes], index=df.index, dtype=object)
+
+def partition_labels(df):
+    """Día y canal de la partición de cada fila, como dos Series alineadas con `df`."""
+    if PARTITION_DATE_COLUMN in df.columns:
+        dates = pd.to_datetime(df[PARTITION_DATE_COLUMN], errors='coerce', utc=True)
+        days = dates.dt.strftime('%Y-%m-%d').fillna(UNKNOWN_DATE)
+    else:
+        days = pd.Series(UNKNOWN_DATE, index=df.index)
+    return days, channel_keys(df)
+
+def partition_prefix(day, channel):
+    return f"{PARTITION_PREFIX}/date={day}/channel={channel}/"
+
+def write_partitions(df, directory, only=None):
+    """
+    Escribe el DataFrame particionado por día y canal como snapshots Arrow bajo
+    `directory`. Con `only` (conjunto de pares (día, canal)) solo se escriben esas
+    particiones. Devuelve las entradas de manifiesto de las particiones escritas; el
+    nombre de cada archivo incluye su checksum, así que una partición reescrita nunca
+    pisa a la que los lectores están descargando.
+    """
+    days, channels = partition_labels(df)
+    entries = []
+    for (day, channel), positions in df.groupby([days, channels], sort=True).indices.items():
+        if only is not None and (day, channel) not in only:
+            continue
+        part = df.iloc[positions]
+        tmp_path = os.path.join(directory, f"{day}.{channel}.arrow")
+        write_snapshot(part, tmp_path)
+        entry = describe_file(tmp_path)
+        key = f"{partition_prefix(day, channel)}part-{entry['sha256'][:16]}.arrow"
+        local_path = os.path.join(directory, key)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        os.replace(tmp_path, local_path)
+        title = part['Title'].iloc[0] if 'Title' in part.columns else None
+        entries.append(dict(entry, key=key, date=day, channel=channel,
+                            title=None if pd.isna(title) else str(title), rows=len(part)))
+    logger.info(f"Particiones escritas en {directory}: {len(entries)}")
+    return entries
+
+def partition_slots(df):
+    """Pares (día, canal) de las particiones que ocupan las filas de `df`."""
+    days, channels = partition_labels(df)
+    pairs = pd.DataFrame({'day': days.to_numpy(), 'channel': channels.to_numpy()}).drop_duplicates()
+    return set(pairs.itertuples(index=False, name=None))
+
+def update_partitions(df, directory, previous=None, changed=None):
+    """
+    Como `write_partitions()`, pero reutiliza las particiones de `previous` (entradas
+    del manifiesto anterior) que siguen en disco y cuyo (día, canal) no está en
+    `changed`: solo se reescriben las modificadas y las nuevas. Sin `previous` o sin
+    `changed` se escriben todas. Devuelve las entradas de todas las particiones.
+    """
+    slots = partition_slots(df)
+    reused = {}
+    if previous and changed is not None:
+        for entry in previous:
+            slot = (entry['date'], entry['channel'])
+            if slot in slots and slot not in changed and os.path.exists(os.path.join(directory, entry['key'])):
+                reused[slot] = entry
+    written = write_partitions(df, directory, only=slots - reused.keys())
+    logger.info(f"Particiones reutilizadas: {len(reused)}, reescritas: {len(written)}")
+    return sorted(list(reused.values()) + written, key=lambda entry: (entry['date'], entry['channel']))
+
+def prune_partitions(directory, keep):
+    """
+    Borra los archivos de partición bajo `directory` cuya clave no está en `keep` (las
+    del manifiesto vigente): cada reescritura crea un part-<checksum> nuevo y las
+    versiones sustituidas no se vuelven a leer. Devuelve cuántos se borraron.
+    """
+    root = os.path.join(directory, PARTITION_PREFIX)
+    removed = 0
+    for dirpath, _, filenames in os.walk(root, topdown=False):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            key = os.path.relpath(path, directory).replace(os.sep, '/')
+            if name.startswith('part-') and key not in keep:
+                os.remove(path)
+                removed += 1
+        if dirpath != root and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    if removed:
+        logger.info(f"Particiones sustituidas borradas de {directory}: {removed}")
+    return removed
+
+def select_partitions(partitions, date_start=None, date_end=None, channels=None):
+    """
+    Poda de particiones: solo las que pueden contener filas del rango de días
+    [date_start, date_end) y de los canales (por Title) indicados.
+    """
+    start = pd.Timestamp(date_start).strftime('%Y-%m-%d') if date_start is not None else None
+    end = pd.Timestamp(date_end).strftime('%Y-%m-%d') if date_end is not None else None
+    titles = set(channels) if channels is not None else None
+    selected = []
+    for entry in partitions:
+        day = entry['date']
+        if day != UNKNOWN_DATE:
+            if start is not None and day < start:
+                continue
+            if end is not None and day >= end:
+                continue
+        elif start is not None or end is not None:
+            continue
+        if titles is not None and entry.get('title') not in titles:
+            continue
+        selected.append(entry)
+    return selected
+
+def read_partitions(partitions, fetch_path, max_workers=8):
+    """
+    Lee las particiones indicadas, un DataFrame por partición y en el mismo orden.
+    `fetch_path(entry)` devuelve la ruta local de cada una (normalmente a través de
+    la caché en disco); se descargan en paralelo porque son muchos objetos pequeños.
+    """
+    if not partitions:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(partitions)), thread_name_prefix='partition') as pool:
+        paths = list(pool.map(fetch_path, partitions))
+    return [read_snapshot(path) for path in paths]
+
+def load_partitions(partitions, fetch_path, max_workers=8):
+    """Carga y concatena las particiones indicadas (véase `read_partitions()`)."""
+    if not partitions:
+        return pd.DataFrame()
+    frames = read_partitions(partitions, fetch_path, max_workers)
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    logger.info(f"Particiones cargadas: {len(partitions)} ({len(df)} filas)")
+    return df
+
+def hot_window_start(days):
+    """Primer día (inclusive) de la ventana caliente de `days` días, o None para todo el histórico."""
+    if not days:
+        return None
+    return pd.Timestamp.now(tz='UTC').tz_localize(None).normalize() - pd.Timedelta(days=days - 1)
+
+class PartitionSet:
+    """
+    Particiones del manifiesto cargadas en un snapshot. La versión del snapshot combina
+    la del manifiesto con las particiones cargadas, de modo que ampliar el conjunto
+    bajo demanda produce una versión nueva. `source` indica de dónde se leyó el
+    manifiesto ('public' o 's3'), que es también de donde se piden las particiones.
+    """
+    __slots__ = ('manifest', 'loaded', 'source')
+
+    def __init__(self, manifest, loaded, source='s3'):
+        self.manifest = manifest
+        self.loaded = frozenset(loaded)
+        self.source = source
+
+    @property
+    def version(self):
+        digest = hashlib.sha256('\n'.join(sorted(self.loaded)).encode('utf-8')).hexdigest()[:12]
+        return f"{self.manifest['version']}#{digest}"
+
+    def missing(self, date_start=None, date_end=None, channels=None):
+        """Particiones que necesita una consulta y que todavía no están cargadas."""
+        needed = select_partitions(self.manifest['partitions'], date_start, date_end, channels)
+        return [entry for entry in needed if entry['key'] not in self.loaded]
+
+    def with_loaded(self, entries):
+        return PartitionSet(self.manifest, self.loaded | {entry['key'] for entry in entries}, self.source)
+
+def base_version(version):
+    """Versión del manifiesto de una versión de snapshot particionado."""
+    return version.split('#', 1)[0] if version else version
@@ -0,0 +1,54 @@
+import logging
+import pandas as pd
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DATE_COLUMNS = ['Date', 'Date Sent', 'Creation Date', 'Edit Date']
+
+# Columnas derivadas que solo usan los filtros; nunca se guardan ni se exportan
+DAY_COLUMN = '_day'
+MEDIA_TYPE_COLUMN = '_media_type'
+DERIVED_COLUMNS = [DAY_COLUMN, MEDIA_TYPE_COLUMN]
+
+def normalize_messages(df):
+    """
+    Normaliza una sola vez, al cargar cada versión del dataset, las columnas que usan
+    los filtros y la ordenación, para que las peticiones solo tengan que comparar.
+    """
+    if df.empty:
+        return df
+
+    # Verificar y limpiar la columna Title (usada como Channel)
+    if 'Title' in df.columns:
+        df['Title'] = df['Title'].fillna('Desconocido').replace('', 'Desconocido')
+
+    # Convertir columnas de fecha a datetime64 sin zona horaria
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            try:
+                df[col] = pd.to_datetime(df[col], errors='coerce', utc=True).dt.tz_localize(None)
+            except Exception as e:
+                logger.warning(f"Error al convertir la columna '{col}': {e}")
+                del df[col]
+
+    if 'Date Sent' in df.columns:
+        df[DAY_COLUMN] = df['Date Sent'].dt.normalize()
+
+    # Columnas numéricas con tipo fijo
+    if 'Score' in df.columns:
+        df['Score'] = pd.to_numeric(df['Score'], errors='coerce').astype('float64')
+    if 'Views' in df.columns:
+        df['Views'] = pd.to_numeric(df['Views'], errors='coerce').fillna(0).astype('int64')
+
+    # Tipo de media en minúsculas como categoría (pocas categorías, comparación barata)
+    if 'Media Type' in df.columns:
+        df[MEDIA_TYPE_COLUMN] = df['Media Type'].astype(str).str.lower().astype('category')
+
+    logger.info(f"Dataset normalizado: {len(df)} filas")
+    return df
+
+def drop_derived_columns(df):
+    """Devuelve el DataFrame sin las columnas derivadas, para guardarlo o exportarlo."""
+    return df.drop(columns=[col for col in DERIVED_COLUMNS if col in df.columns])
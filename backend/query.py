@@ -0,0 +1,99 @@
+import pandas as pd
+from filter_index import FilterIndex
+from query_cache import QueryResult, canonical_sort
+
+class QueryError(ValueError):
+    """Filtro de la petición que no se puede interpretar."""
+
+class QueryPlan:
+    """
+    Consulta ya validada: la clave de orden y los argumentos de `FilterIndex.resolve()`.
+    Es la misma para `/`, `/load_more`, `/filter_messages` y `/api/messages`.
+    """
+    __slots__ = ('sort_by', 'filters')
+
+    def __init__(self, sort_by=None, date_start=None, date_end=None, channels=None,
+                 media_type=None, label=None, score_min=None, score_max=None):
+        self.sort_by = canonical_sort(sort_by)
+        self.filters = {
+            'date_start': date_start,
+            'date_end': date_end,
+            'channels': channels,
+            'media_type': media_type,
+            'label': label,
+            'score_min': score_min,
+            'score_max': score_max
+        }
+
+    @property
+    def is_filtered(self):
+        return any(value is not None for value in self.filters.values())
+
+def _present(value):
+    return value is not None and value != '' and value != []
+
+def parse_channels(value):
+    """Canales como lista, o como cadena separada por comas."""
+    if not _present(value):
+        return None
+    if isinstance(value, str):
+        channels = [channel for channel in value.split(',') if channel]
+    elif isinstance(value, (list, tuple)):
+        channels = list(value)
+    else:
+        channels = [value]
+    return channels or None
+
+def _parse_float(value, name):
+    try:
+        return float(value)
+    except (ValueError, TypeError) as e:
+        raise QueryError(f"Error en filtro de {name}: {str(e)}")
+
+def parse_query(params):
+    """
+    Compila los parámetros de una petición (`request.json` o `request.args`) en un
+    `QueryPlan`. Los filtros vacíos se ignoran; los que no se pueden interpretar
+    lanzan `QueryError`.
+    """
+    date_start = date_end = None
+    try:
+        if _present(params.get('dateStart')):
+            date_start = pd.to_datetime(params.get('dateStart')).normalize()
+        if _present(params.get('dateEnd')):
+            # El fin del rango es inclusivo: se compara con el día siguiente
+            date_end = pd.to_datetime(params.get('dateEnd')).normalize() + pd.Timedelta(days=1)
+    except (ValueError, TypeError) as e:
+        raise QueryError(f"Error en filtro de fechas: {str(e)}")
+
+    score_min = _parse_float(params.get('scoreMin'), 'score mínimo') if _present(params.get('scoreMin')) else None
+    score_max = _parse_float(params.get('scoreMax'), 'score máximo') if _present(params.get('scoreMax')) else None
+
+    label = None
+    if _present(params.get('label')):
+        try:
+            label = FilterIndex.parse_label(params.get('label'))
+        except (ValueError, TypeError) as e:
+            raise QueryError(f"Error en filtro de etiqueta: {str(e)}")
+
+    media_type = params.get('mediaType')
+    return QueryPlan(
+        sort_by=params.get('sortBy'),
+        date_start=date_start,
+        date_end=date_end,
+        channels=parse_channels(params.get('channel')),
+        media_type=str(media_type) if _present(media_type) else None,
+        label=label,
+        score_min=score_min,
+        score_max=score_max
+    )
+
+def run_query(plan, snapshot, cache=None):
+    """
+    Ejecuta el plan contra el índice del snapshot y devuelve un `QueryResult` con las
+    posiciones de fila (sin copiar el DataFrame) y el total. Con `cache`, las páginas
+    siguientes de la misma consulta reutilizan el resultado.
+    """
+    if cache is not None:
+        return cache.get_or_resolve(snapshot, plan.sort_by, plan.filters)
+    return QueryResult(snapshot.index.resolve(**plan.filters), plan.sort_by, plan.filters['label'])
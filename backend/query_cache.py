@@ -0,0 +1,155 @@
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+from filter_index import SORT_KEYS, DEFAULT_SORT, FilterIndex
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def canonical_sort(sort_by):
+    return sort_by if sort_by in SORT_KEYS else DEFAULT_SORT
+
+def canonical_label(label):
+    return FilterIndex.parse_label(label) if label is not None else None
+
+def make_query_key(version, sort_by, filters):
+    """
+    Clave canónica de una consulta: la misma combinación de filtros produce la misma
+    clave aunque llegue con otro orden de canales, mayúsculas o formato de número.
+    `filters` son los argumentos de `FilterIndex.resolve()`.
+    """
+    channels = filters.get('channels')
+    media_type = filters.get('media_type')
+    label = filters.get('label')
+    date_start = filters.get('date_start')
+    date_end = filters.get('date_end')
+    score_min = filters.get('score_min')
+    score_max = filters.get('score_max')
+    return (
+        version,
+        canonical_sort(sort_by),
+        date_start.isoformat() if date_start is not None else None,
+        date_end.isoformat() if date_end is not None else None,
+        tuple(sorted(set(channels))) if channels is not None else None,
+        str(media_type).lower() if media_type is not None else None,
+        canonical_label(label),
+        float(score_min) if score_min is not None else None,
+        float(score_max) if score_max is not None else None
+    )
+
+class QueryResult:
+    """Resultado de una consulta: posiciones filtradas y el prefijo ya ordenado."""
+    __slots__ = ('positions', 'ordered', 'sort_by', 'label')
+
+    def __init__(self, positions, sort_by, label=None):
+        self.positions = positions
+        self.ordered = positions[:0]
+        self.sort_by = sort_by
+        self.label = label
+
+    @property
+    def total(self):
+        return len(self.positions)
+
+    @property
+    def nbytes(self):
+        # El prefijo ordenado nunca supera a las posiciones filtradas
+        return self.positions.nbytes * 2
+
+    def page(self, index, start, end):
+        """Devuelve las posiciones de [start, end), ordenando más prefijo solo si hace falta."""
+        ordered = self.ordered
+        if len(ordered) < min(end, self.total):
+            # Duplicar el prefijo para que el scroll siguiente sea un slice
+            ordered = index.sort_positions(self.positions, self.sort_by, limit=max(end, 2 * len(ordered)))
+            self.ordered = ordered
+        return ordered[start:end]
+
+class QueryCache:
+    """Caché LRU de resultados de consultas, acotada por memoria."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if entry.nbytes > self.max_bytes:
+            return entry
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        return entry
+
+    def get_or_resolve(self, snapshot, sort_by, filters):
+        """Devuelve el resultado cacheado de la consulta o lo calcula con el índice del snapshot."""
+        # Sin versión conocida no se puede garantizar que la entrada corresponda a estos datos
+        if snapshot.version is None:
+            return QueryResult(snapshot.index.resolve(**filters), canonical_sort(sort_by))
+
+        key = make_query_key(snapshot.version, sort_by, filters)
+        entry = self.get(key)
+        if entry is None:
+            entry = QueryResult(
+                snapshot.index.resolve(**filters),
+                canonical_sort(sort_by),
+                canonical_label(filters.get('label'))
+            )
+            self.put(key, entry)
+        return entry
+
+    def rebase(self, old_version, new_version, label_changes):
+        """
+        Traslada las entradas de `old_version` a `new_version` tras cambiar etiquetas.
+        `label_changes` asocia la posición de cada fila modificada a su nueva clave de
+        etiqueta. Solo se descartan las consultas filtradas por etiqueta cuyo resultado
+        contenía una fila modificada o que ahora la incluirían.
+        """
+        if old_version is None or new_version is None:
+            return
+        changed = np.fromiter(label_changes.keys(), dtype=np.int64)
+        new_labels = set(label_changes.values())
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == old_version]:
+                entry = self._entries.pop(key)
+                if entry.label is not None:
+                    # Las posiciones están ordenadas: pertenencia por búsqueda binaria
+                    found = np.searchsorted(entry.positions, changed)
+                    in_range = found < len(entry.positions)
+                    touched = (entry.positions[found[in_range]] == changed[in_range]).any()
+                    if touched or entry.label in new_labels:
+                        self._bytes -= entry.nbytes
+                        continue
+                self._entries[(new_version,) + key[1:]] = entry
+        logger.info(f"Caché de consultas trasladada a la versión {new_version}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -1,28 +1,80 @@
 import boto3
+import numpy as np
 import pandas as pd
 import json
-import io
+import base64
+import hashlib
+import threading
+import time
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError, NoCredentialsError
 import os
 from config import Config
+from downloads import ObjectChangedError, download_to_file
+from disk_cache import get_disk_cache
+from export import iter_csv, iter_json
+from uploads import COMPRESSION_TYPES, compress_chunks, multipart_upload
 import logging
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def object_checksums(response):
+    """
+    Checksums del objeto entero según la respuesta de head_object/get_object, en
+    hexadecimal: SHA-256 o CRC32 de tipo FULL_OBJECT y, en subidas de una sola
+    parte sin SSE-KMS, el MD5 que es el propio ETag. Los checksums compuestos de
+    una subida multiparte no describen el contenido completo y se ignoran.
+    """
+    etag = (response.get('ETag') or '').strip('"')
+    multipart = '-' in etag
+    checksums = {}
+    if response.get('ChecksumType', 'COMPOSITE' if multipart else 'FULL_OBJECT') == 'FULL_OBJECT':
+        for field, name in (('ChecksumSHA256', 'sha256'), ('ChecksumCRC32', 'crc32')):
+            value = response.get(field)
+            if value and '-' not in value:
+                checksums[name] = base64.b64decode(value).hex()
+    if etag and not multipart and response.get('ServerSideEncryption') != 'aws:kms':
+        checksums['md5'] = etag
+    return checksums
+
 class S3Client:
+    """
+    Cliente S3 compartido por todo el proceso (ver `get_s3_client()`). El cliente de
+    boto3 es thread-safe y mantiene su propio pool de conexiones keep-alive.
+    """
+
     def __init__(self):
         """Inicializa el cliente S3 con las credenciales de AWS."""
         try:
+            # Pool de conexiones, reintentos adaptativos y timeouts acotados
+            client_config = BotoConfig(
+                max_pool_connections=Config.S3_MAX_POOL_CONNECTIONS,
+                connect_timeout=Config.S3_CONNECT_TIMEOUT,
+                read_timeout=Config.S3_READ_TIMEOUT,
+                retries={'mode': 'adaptive', 'max_attempts': Config.S3_MAX_ATTEMPTS},
+                tcp_keepalive=True
+            )
             # Intentar usar credenciales del archivo de configuración
             self.s3_client = boto3.client(
                 's3',
                 region_name=Config.AWS_REGION,
                 aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-                aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
+                aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                config=client_config
             )
             self.bucket_name = Config.S3_BUCKET
+            # Descargas gestionadas por boto3 en partes concurrentes del mismo tamaño que las nuestras
+            self.transfer_config = TransferConfig(
+                multipart_threshold=Config.S3_DOWNLOAD_PART_SIZE,
+                multipart_chunksize=Config.S3_DOWNLOAD_PART_SIZE,
+                max_concurrency=Config.S3_DOWNLOAD_CONCURRENCY
+            )
+            self._health_lock = threading.Lock()
+            self._health = None
+            self._health_checked_at = 0.0
             logger.info(f"Cliente S3 inicializado para bucket: {self.bucket_name}")
         except NoCredentialsError:
             logger.error("No se encontraron credenciales de AWS")
@@ -32,20 +84,21 @@ class S3Client:
             raise
 
     def list_files(self, prefix=''):
-        """Lista todos los archivos en el bucket S3 con un prefijo opcional."""
+        """
+        Lista todos los archivos en el bucket S3 con un prefijo opcional, siguiendo
+        los tokens de continuación más allá de las 1000 claves por página.
+        """
         try:
-            response = self.s3_client.list_objects_v2(
-                Bucket=self.bucket_name,
-                Prefix=prefix
-            )
-            
-            if 'Contents' in response:
-                files = [obj['Key'] for obj in response['Contents']]
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            files = []
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+                files.extend(obj['Key'] for obj in page.get('Contents', []))
+
+            if files:
                 logger.info(f"Archivos encontrados en S3: {len(files)}")
-                return files
             else:
                 logger.info("No se encontraron archivos en el bucket")
-                return []
+            return files
                 
         except ClientError as e:
             logger.error(f"Error al listar archivos en S3: {e}")
@@ -57,7 +110,7 @@ class S3Client:
             if local_path is None:
                 local_path = s3_key.split('/')[-1]  # Usar solo el nombre del archivo
                 
-            self.s3_client.download_file(self.bucket_name, s3_key, local_path)
+            self.s3_client.download_file(self.bucket_name, s3_key, local_path, Config=self.transfer_config)
             logger.info(f"Archivo descargado: {s3_key} -> {local_path}")
             return local_path
             
@@ -65,23 +118,130 @@ class S3Client:
             logger.error(f"Error al descargar archivo {s3_key}: {e}")
             raise
 
+    def range_fetcher(self, s3_key, etag=None):
+        """
+        `fetch_range` de `downloads.parallel_download()` para un objeto del bucket. Con
+        `etag`, cada rango lleva IfMatch: si el objeto se reemplaza a mitad de la
+        descarga S3 responde 412 y se lanza ObjectChangedError, en lugar de mezclar
+        partes de dos versiones.
+        """
+        def fetch_range(start, end):
+            params = {'Bucket': self.bucket_name, 'Key': s3_key, 'Range': f'bytes={start}-{end}'}
+            if etag:
+                params['IfMatch'] = etag
+            try:
+                response = self.s3_client.get_object(**params)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', '412'):
+                    raise ObjectChangedError(f"{s3_key} cambió durante la descarga") from e
+                raise
+            return response['Body'].iter_chunks(chunk_size=1024 * 1024)
+        return fetch_range
+
+    def get_cached_path(self, s3_key, etag=None, size=None, sha256=None, version=None):
+        """
+        Ruta local del objeto en la caché en disco. Si no está (o no es íntegro), se
+        descarga con peticiones de rango en paralelo fijadas a su ETag y se guarda en
+        ella; si el objeto cambia durante la descarga, se vuelve a empezar con la
+        versión nueva. La entrada se identifica por el ETag, o por el checksum `sha256`
+        si se conoce (manifiesto).
+
+        Solo se guarda contenido verificado: contra `sha256` o, sin manifiesto, contra
+        el checksum que publica S3 (ver `head_file()`). Un objeto sin ninguno se
+        descarga fuera de la caché y no se reutiliza.
+        """
+        try:
+            cache = get_disk_cache()
+            for attempt in range(Config.S3_DOWNLOAD_RESTARTS + 1):
+                tag = sha256 or etag
+                if tag is not None:
+                    path = cache.lookup(self.bucket_name, s3_key, tag, sha256)
+                    if path is not None:
+                        logger.info(f"Objeto servido desde la caché en disco: {s3_key}")
+                        return path
+                checksums = {}
+                if sha256 is None or size is None:
+                    # Los checksums solo vienen en la respuesta de head_object
+                    head = self.head_file(s3_key, checksums=sha256 is None)
+                    etag, size, checksums = head['ETag'], head['ContentLength'], head.get('Checksums', {})
+                    if (sha256 or etag) != tag:
+                        tag = sha256 or etag
+                        path = cache.lookup(self.bucket_name, s3_key, tag, sha256)
+                        if path is not None:
+                            logger.info(f"Objeto servido desde la caché en disco: {s3_key}")
+                            return path
+
+                fetch_range = self.range_fetcher(s3_key, etag)
+                try:
+                    if sha256 is None and not checksums:
+                        return self._download_unverified(s3_key, fetch_range, size)
+                    return cache.store(
+                        self.bucket_name, s3_key, tag,
+                        lambda tmp_path: download_to_file(fetch_range, size, tmp_path, label=s3_key),
+                        sha256=sha256,
+                        version=version or tag,
+                        checksums=checksums
+                    )
+                except ObjectChangedError as e:
+                    if attempt == Config.S3_DOWNLOAD_RESTARTS:
+                        raise
+                    logger.warning(f"{e}: se reinicia con la versión actual ({attempt + 1}/{Config.S3_DOWNLOAD_RESTARTS})")
+                    etag = size = None
+
+        except ClientError as e:
+            logger.error(f"Error al obtener el archivo {s3_key}: {e}")
+            raise
+
+    def _download_unverified(self, s3_key, fetch_range, size):
+        """Descarga un objeto sin checksum conocido a un archivo de trabajo que la caché no reutiliza."""
+        cache = get_disk_cache()
+        directory = os.path.join(cache.directory, 'unverified')
+        os.makedirs(directory, exist_ok=True)
+        name = hashlib.sha256(f"{self.bucket_name}/{s3_key}".encode('utf-8')).hexdigest()[:32]
+        path = os.path.join(directory, name + os.path.splitext(s3_key)[1])
+        logger.warning(f"{s3_key} no publica un checksum verificable: se descarga sin guardarlo en la caché")
+        # Otros workers pueden descargar el mismo objeto: temporal único y reemplazo bajo el bloqueo de la caché
+        download_to_file(fetch_range, size, path, lock=cache.exclusive, label=s3_key)
+        return path
+
+    def get_file_bytes(self, s3_key, size=None, etag=None):
+        """Obtiene el contenido de un archivo desde S3 como bytes, a través de la caché en disco."""
+        with open(self.get_cached_path(s3_key, etag, size), 'rb') as f:
+            data = f.read()
+        logger.info(f"Contenido obtenido del archivo: {s3_key}")
+        return data
+
     def get_file_content(self, s3_key):
         """Obtiene el contenido de un archivo desde S3 como string."""
+        return self.get_file_bytes(s3_key).decode('utf-8')
+
+    def head_file(self, s3_key, checksums=False):
+        """
+        Obtiene los metadatos (ETag, tamaño, fecha) de un archivo sin descargarlo. Con
+        `checksums`, añade en 'Checksums' los que permiten verificar el objeto entero.
+        """
         try:
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
-            content = response['Body'].read().decode('utf-8')
-            logger.info(f"Contenido obtenido del archivo: {s3_key}")
-            return content
-            
+            params = {'Bucket': self.bucket_name, 'Key': s3_key}
+            if checksums:
+                params['ChecksumMode'] = 'ENABLED'
+            response = self.s3_client.head_object(**params)
+            head = {
+                'ETag': response.get('ETag'),
+                'ContentLength': response.get('ContentLength'),
+                'LastModified': response.get('LastModified')
+            }
+            if checksums:
+                head['Checksums'] = object_checksums(response)
+            return head
+
         except ClientError as e:
-            logger.error(f"Error al obtener contenido del archivo {s3_key}: {e}")
+            logger.error(f"Error al obtener metadatos del archivo {s3_key}: {e}")
             raise
 
-    def load_csv_from_s3(self, s3_key):
+    def load_csv_from_s3(self, s3_key, size=None, etag=None):
         """Carga un archivo CSV desde S3 como DataFrame de pandas."""
         try:
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
-            df = pd.read_csv(io.BytesIO(response['Body'].read()))
+            df = pd.read_csv(self.get_cached_path(s3_key, etag, size))
             logger.info(f"CSV cargado desde S3: {s3_key}, filas: {len(df)}")
             return df
             
@@ -92,11 +252,11 @@ class S3Client:
             logger.error(f"Error al procesar CSV {s3_key}: {e}")
             raise
 
-    def load_json_from_s3(self, s3_key):
+    def load_json_from_s3(self, s3_key, size=None, etag=None):
         """Carga un archivo JSON desde S3."""
         try:
-            content = self.get_file_content(s3_key)
-            data = json.loads(content)
+            # json.loads acepta bytes: no hace falta una copia decodificada como str
+            data = json.loads(self.get_file_bytes(s3_key, size, etag))
             logger.info(f"JSON cargado desde S3: {s3_key}")
             return data
             
@@ -118,34 +278,51 @@ class S3Client:
             logger.error(f"Error al subir archivo {local_path}: {e}")
             raise
 
-    def upload_dataframe(self, df, s3_key, format='csv'):
-        """Sube un DataFrame a S3 en el formato especificado."""
+    def upload_dataframe(self, df, s3_key, format='csv', compression=None):
+        """
+        Sube un DataFrame a S3 en el formato especificado ('csv' o 'json'), opcionalmente
+        comprimido ('gzip' o 'zstd'). Se codifica por bloques y se sube en partes en
+        paralelo, sin materializar el archivo completo en memoria. Devuelve las
+        estadísticas de la subida (tamaño, SHA-256, partes, throughput).
+        """
         try:
-            buffer = io.StringIO()
-            
-            if format.lower() == 'csv':
-                df.to_csv(buffer, index=False)
-            elif format.lower() == 'json':
-                df.to_json(buffer, orient='records', indent=2)
+            format = format.lower()
+            positions = np.arange(len(df))
+            columns = list(df.columns)
+            if format == 'csv':
+                chunks = iter_csv(df, positions, columns, Config.EXPORT_CHUNK_SIZE)
+                content_type = 'text/csv'
+            elif format == 'json':
+                chunks = iter_json(df, positions, columns, Config.EXPORT_CHUNK_SIZE)
+                content_type = 'application/json'
             else:
                 raise ValueError(f"Formato no soportado: {format}")
-                
-            buffer.seek(0)
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=s3_key,
-                Body=buffer.getvalue()
-            )
-            
-            logger.info(f"DataFrame subido a S3: {s3_key} ({format})")
-            return True
+            if compression is not None:
+                chunks = compress_chunks(chunks, compression)
+                content_type = COMPRESSION_TYPES[compression]
+
+            stats = multipart_upload(self, s3_key, chunks, content_type=content_type)
+            logger.info(f"DataFrame subido a S3: {s3_key} ({format}{', ' + compression if compression else ''})")
+            return stats
             
         except Exception as e:
             logger.error(f"Error al subir DataFrame a S3: {e}")
             raise
 
-    def check_connection(self):
-        """Verifica la conexión con S3."""
+    def check_connection(self, force=False):
+        """
+        Verifica la conexión con S3. El resultado se reutiliza durante
+        `S3_HEALTH_CHECK_TTL` segundos salvo con `force=True`.
+        """
+        with self._health_lock:
+            if not force and self._health is not None and \
+                    time.monotonic() - self._health_checked_at < Config.S3_HEALTH_CHECK_TTL:
+                return self._health
+            self._health = self._head_bucket()
+            self._health_checked_at = time.monotonic()
+            return self._health
+
+    def _head_bucket(self):
         try:
             self.s3_client.head_bucket(Bucket=self.bucket_name)
             logger.info("Conexión con S3 exitosa")
@@ -157,7 +334,15 @@ class S3Client:
             logger.error(f"Error inesperado al verificar conexión S3: {e}")
             return False
 
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
 # Función de utilidad para obtener el cliente S3
 def get_s3_client():
-    """Retorna una instancia del cliente S3."""
-    return S3Client()
+    """Retorna la instancia del cliente S3 compartida por el proceso."""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = S3Client()
+    return _s3_client
@@ -0,0 +1,168 @@
+import math
+import time
+import asyncio
+import logging
+from telethon.errors import FloodWaitError
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Mensajes por petición de historial: `get_messages(limit=N)` hace ceil(N / 100) peticiones
+MESSAGES_PER_REQUEST = 100
+
+class TokenBucket:
+    """
+    Limitador de peticiones compartido por todas las tareas: `rate` peticiones por
+    segundo con ráfagas de hasta `capacity`. Un FloodWait de Telegram afecta a toda
+    la cuenta, así que `pause()` detiene el bucket entero y no solo la tarea que lo
+    recibió. Se crea dentro del bucle de eventos que lo usa.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.throttled = 0.0
+        self.flood_waits = 0
+
+    async def acquire(self, tokens=1):
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return
+                    delay = (tokens - self._tokens) / self.rate
+                self.throttled += delay
+                await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self.flood_waits += 1
+
+async def call_with_backoff(limiter, func, *args, tokens=1, max_retries=3, max_flood_wait=300, **kwargs):
+    """
+    Llama a `func` tras obtener `tokens` del limitador. Ante un FloodWaitError pausa
+    el limitador los segundos que pide Telegram y reintenta; si la espera supera
+    `max_flood_wait` o se agotan los reintentos, se propaga el error.
+    """
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(tokens)
+        try:
+            return await func(*args, **kwargs)
+        except FloodWaitError as e:
+            if attempt == max_retries or e.seconds > max_flood_wait:
+                raise
+            logger.warning(f"FloodWait de {e.seconds}s: se pausan todas las peticiones (reintento {attempt + 1}/{max_retries})")
+            limiter.pause(e.seconds + 1)
+
+def _as_list(messages):
+    if not messages:
+        return []
+    if isinstance(messages, (list, tuple)) or hasattr(messages, '__iter__'):
+        return list(messages)
+    return [messages]
+
+def _rate(count, seconds):
+    return round(count / seconds, 2) if seconds > 0 else 0.0
+
+async def scrape_channels(client, channels, limit, offset_date=None, concurrency=4, rate=5.0, burst=None,
+                          max_retries=3, max_flood_wait=300, min_ids=None, refresh_ids=None):
+    """
+    Descarga la entidad y los mensajes de cada canal con un pool de `concurrency`
+    tareas que comparten un limitador de `rate` peticiones por segundo. `client`
+    solo necesita `get_entity()` y `get_messages()` asíncronos (un TelegramClient o
+    un cliente falso en pruebas).
+
+    Con un checkpoint en `min_ids` (canal -> id) solo se piden los mensajes con id
+    mayor, del más antiguo al más reciente y hasta `limit`: si quedan más, la
+    siguiente ejecución sigue donde terminó esta sin dejar huecos. Los ids de
+    `refresh_ids` (canal -> lista) se vuelven a pedir para actualizar sus vistas.
+
+    Devuelve los resultados en el orden de `channels` (dicts con channel, entity,
+    messages, refreshed, error y seconds) y las estadísticas de la ejecución, con
+    los mensajes por segundo de cada canal y del total.
+    """
+    limiter = TokenBucket(rate, burst)
+    min_ids = min_ids or {}
+    refresh_ids = refresh_ids or {}
+    pending = iter(enumerate(channels))
+    results = [None] * len(channels)
+    history_requests = max(1, math.ceil(limit / MESSAGES_PER_REQUEST)) if limit else 1
+    started = time.monotonic()
+
+    async def worker():
+        for index, channel in pending:
+            channel_started = time.monotonic()
+            result = {'channel': channel, 'entity': None, 'messages': [], 'refreshed': [], 'error': None}
+            try:
+                result['entity'] = await call_with_backoff(
+                    limiter, client.get_entity, channel,
+                    max_retries=max_retries, max_flood_wait=max_flood_wait
+                )
+                if min_ids.get(channel) is not None:
+                    history = {'min_id': min_ids[channel], 'reverse': True}
+                else:
+                    history = {'offset_date': offset_date}
+                messages = await call_with_backoff(
+                    limiter, client.get_messages, result['entity'], limit=limit, **history,
+                    tokens=history_requests, max_retries=max_retries, max_flood_wait=max_flood_wait
+                )
+                result['messages'] = _as_list(messages)
+            except Exception as e:
+                result['error'] = e
+            ids = refresh_ids.get(channel)
+            if ids and result['error'] is None:
+                try:
+                    refreshed = await call_with_backoff(
+                        limiter, client.get_messages, result['entity'], ids=ids,
+                        tokens=math.ceil(len(ids) / MESSAGES_PER_REQUEST),
+                        max_retries=max_retries, max_flood_wait=max_flood_wait
+                    )
+                    # Los mensajes borrados llegan como None
+                    result['refreshed'] = [message for message in _as_list(refreshed) if message is not None]
+                except Exception as e:
+                    # Sin refresco se conservan las vistas anteriores; los mensajes nuevos siguen siendo válidos
+                    logger.warning(f"No se pudieron refrescar las vistas de {channel}: {e}")
+            result['seconds'] = time.monotonic() - channel_started
+            results[index] = result
+            if result['error'] is None:
+                logger.info(f"Canal {channel}: {len(result['messages'])} mensajes nuevos, {len(result['refreshed'])} "
+                            f"refrescados en {result['seconds']:.1f}s ({_rate(len(result['messages']), result['seconds'])} msg/s)")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(channels))))))
+    elapsed = time.monotonic() - started
+
+    total = sum(len(result['messages']) for result in results)
+    stats = {
+        'channels': len(channels),
+        'failed': sum(1 for result in results if result['error'] is not None),
+        'messages': total,
+        'refreshed': sum(len(result['refreshed']) for result in results),
+        'incremental': sum(1 for channel in channels if min_ids.get(channel) is not None),
+        'seconds': round(elapsed, 2),
+        'messages_per_second': _rate(total, elapsed),
+        'concurrency': concurrency,
+        'flood_waits': limiter.flood_waits,
+        'throttled_seconds': round(limiter.throttled, 2),
+        'per_channel': [{
+            'channel': result['channel'],
+            'messages': len(result['messages']),
+            'refreshed': len(result['refreshed']),
+            'seconds': round(result['seconds'], 2),
+            'messages_per_second': _rate(len(result['messages']), result['seconds']),
+            'error': str(result['error']) if result['error'] is not None else None
+        } for result in results]
+    }
+    return results, stats
@@ -28,7 +28,9 @@ def check_and_install_dependencies():
         'telethon',
         'openpyxl',
         'python-dotenv',
-        'asyncio'
+        'asyncio',
+        'pyarrow',
+        'boto3'
     ]
     
     # Primero actualizar pip
@@ -58,6 +60,13 @@ from telethon.tl.types import Message, Channel, User
 from telethon.tl.custom import Message as CustomMessage
 from telethon.tl.types.messages import Messages
 from telethon.tl.types.messages import ChannelMessages
+from dataset_format import SNAPSHOT_FILE, write_snapshot
+from manifest import MANIFEST_FILE, build_manifest, describe_file, publish_dataset, read_manifest, write_manifest
+from config import Config
+from s3_client import get_s3_client
+from partitions import PARTITION_PREFIX, partition_slots, prune_partitions, update_partitions
+from scrape_pool import scrape_channels
+from checkpoints import CHECKPOINT_FILE, CheckpointStore
 
 # Set the working directory to the script's directory
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -318,6 +327,133 @@ def load_existing_message_ids(filename):
     except (FileNotFoundError, pd.errors.EmptyDataError):
         return set()
 
+def apply_view_refresh(existing_messages, view_updates):
+    """
+    Actualiza `Views` de los mensajes ya guardados con las vistas releídas en la
+    ventana de refresco. El score se recalcula al guardar.
+    """
+    if existing_messages.empty or not view_updates or 'Username' not in existing_messages.columns:
+        return existing_messages
+    updates = pd.DataFrame(view_updates).drop_duplicates(['Username', 'Message ID'], keep='last')
+    updates = updates.set_index(['Username', 'Message ID'])['Views']
+    keys = pd.MultiIndex.from_arrays([
+        existing_messages['Username'],
+        pd.to_numeric(existing_messages['Message ID'], errors='coerce')
+    ])
+    views = updates.reindex(keys).to_numpy()
+    found = pd.notna(views)
+    existing_messages = existing_messages.copy()
+    existing_messages['Views'] = existing_messages['Views'].where(~found, views)
+    print(f"Vistas actualizadas en {int(found.sum())} mensajes existentes")
+    return existing_messages
+
+def recompute_daily_averages(df, touched_keys):
+    """
+    Recalcula Average Views, Average Difference y Score de cada día (canal, fecha)
+    que contiene alguno de los mensajes de `touched_keys` ((Username, Message ID)
+    nuevos o con vistas releídas). La media se toma sobre todas las filas guardadas
+    de ese canal y día: en modo incremental una ejecución solo descarga parte de
+    los mensajes del día.
+    """
+    if df.empty or not touched_keys or 'Date Sent' not in df.columns or 'Views' not in df.columns:
+        return df
+    channels = df['Channel ID'] if 'Channel ID' in df.columns else df['Username']
+    days = pd.to_datetime(df['Date Sent'], errors='coerce', utc=True, format='mixed').dt.strftime('%Y-%m-%d')
+    views = pd.to_numeric(df['Views'], errors='coerce')
+    keys = pd.MultiIndex.from_arrays([df['Username'], pd.to_numeric(df['Message ID'], errors='coerce')])
+    groups = pd.MultiIndex.from_arrays([channels, days])
+    touched = groups.isin(groups[keys.isin(list(touched_keys))].unique()) & days.notna().to_numpy()
+    if not touched.any():
+        return df
+
+    # La media ignora los mensajes sin vistas, como en build_channel_rows
+    average = views.groupby([channels, days]).transform('mean').fillna(0)[touched]
+    current = views.fillna(0)[touched]
+    has_average = average > 0
+    df = df.copy()
+    df.loc[touched, 'Average Views'] = average
+    df.loc[touched, 'Average Difference'] = (current - average).where(has_average, 0)
+    df.loc[touched, 'Score'] = (current / average).where(has_average, 0)
+    print(f"Medias diarias recalculadas en {int(touched.sum())} mensajes")
+    return df
+
+def build_channel_rows(channel_details, messages_list, existing_ids):
+    """
+    Filas del dataset para los mensajes de un canal: las que no están ya en
+    `existing_ids`, con la media diaria de vistas y el score de los mensajes
+    descargados. Al guardar, `recompute_daily_averages()` rehace la media con las
+    filas ya guardadas del mismo día. Devuelve las filas nuevas y cuántos mensajes
+    ya existían.
+    """
+    # Group messages by their date
+    grouped_messages: Dict[str, List[Message]] = {}
+    for message in messages_list:
+        if message and message.date:
+            date_str = message.date.strftime('%Y-%m-%d')
+            if date_str not in grouped_messages:
+                grouped_messages[date_str] = []
+            grouped_messages[date_str].append(message)
+
+    # Calculate daily average views
+    daily_average_views: Dict[str, float] = {}
+    for date_str, daily_messages in grouped_messages.items():
+        views_list = [message.views for message in daily_messages if message.views is not None]
+        daily_average_views[date_str] = sum(views_list) / len(views_list) if views_list else 0
+
+    # Contadores para mensajes
+    mensajes_existentes = 0
+    all_data = []
+
+    for message in messages_list:
+        if not message or not message.date:
+            continue
+            
+        data: Dict[str, Any] = {}
+        data.update(extract_channel_details(channel_details))
+        data.update(extract_message_details(message))
+        
+        # Verificar si el mensaje ya existe en el dataset
+        message_key = (data['Username'], message.id)
+        if message_key in existing_ids:
+            mensajes_existentes += 1
+            continue
+        
+        # Update the URL and Embed columns using the channel's username
+        channel_username = data['Username']
+        if not channel_username:  # Si no hay username, usar el ID
+            channel_username = str(data['Channel ID'])
+        data['URL'] = f"https://t.me/s/{channel_username}/{message.id}"
+        data['Embed'] = f'<script async src="https://telegram.org/js/telegram-widget.js?22" data-telegram-post="{channel_username}/{message.id}" data-width="100%"></script>'
+        
+        date_str = message.date.strftime('%Y-%m-%d')
+        data['Average Views'] = daily_average_views.get(date_str, 0)
+        
+        # Calcular la diferencia con el promedio
+        if data['Average Views'] > 0:
+            data['Average Difference'] = (message.views or 0) - data['Average Views']
+            # Calcular el score como la proporción de views respecto a la media
+            data['Score'] = (message.views or 0) / data['Average Views']
+        else:
+            data['Average Difference'] = 0
+            data['Score'] = 0
+
+        # Añadir información de medios si existe
+        if message.media:
+            media_details = extract_media_details(message.media)
+            data.update(media_details)
+        else:
+            # Si no hay medios, establecer valores por defecto
+            data['Media Type'] = ''
+            data['Media Size'] = None
+            data['Media Caption'] = None
+        
+        # Inicializar Label como vacío
+        data['Label'] = ''
+
+        all_data.append(data)
+
+    return all_data, mensajes_existentes
+
 async def main():
     print("1. Iniciando script...")
     
@@ -346,10 +482,17 @@ async def main():
     print("7. Cargando datos existentes...")
     existing_messages = load_existing_data('telegram_messages.csv')
     existing_ids = load_existing_message_ids('telegram_messages.csv')
+
+    # Checkpoints por canal: solo se piden mensajes posteriores al último descargado
+    checkpoints = None
+    if Config.SCRAPER_INCREMENTAL:
+        checkpoints = CheckpointStore(CHECKPOINT_FILE, Config.SCRAPER_REFRESH_DAYS, Config.SCRAPER_REFRESH_MAX)
+        print(f"7b. Checkpoints cargados: {len(checkpoints.channels)} canales con scraping incremental")
     
     # Crear cliente
     print("8. Creando cliente...")
-    client = TelegramClient('anon', creds['API_ID'], creds['API_HASH'])
+    # Los FloodWait los gestiona el limitador compartido (pausa a todas las tareas), no Telethon
+    client = TelegramClient('anon', creds['API_ID'], creds['API_HASH'], flood_sleep_threshold=0)
     
     try:
         # Conectar
@@ -367,107 +510,56 @@ async def main():
         
         print("12. Conexión exitosa!")
         
-        all_data = []
-        for channel in channels:
-            try:
-                print(f"Procesando canal: {channel}")
-                channel_details = await client.get_entity(channel)
-                messages = await client.get_messages(
-                    channel,
-                    limit=max_messages,
-                    offset_date=time_days_ago
-                )
-                
-                if not messages:
-                    print(f"No se encontraron mensajes para el canal '{channel}'. Continuando con el siguiente.")
-                    continue
-                # Convert messages to list for easier handling
-                messages_list = []
-                if isinstance(messages, Message):
-                    messages_list = [messages]
-                else:
-                    messages_list = list(messages)
-
-                # Group messages by their date
-                grouped_messages: Dict[str, List[Message]] = {}
-                for message in messages_list:
-                    if message and message.date:
-                        date_str = message.date.strftime('%Y-%m-%d')
-                        if date_str not in grouped_messages:
-                            grouped_messages[date_str] = []
-                        grouped_messages[date_str].append(message)
-
-                # Calculate daily average views
-                daily_average_views: Dict[str, float] = {}
-                for date_str, daily_messages in grouped_messages.items():
-                    views_list = [message.views for message in daily_messages if message.views is not None]
-                    daily_average_views[date_str] = sum(views_list) / len(views_list) if views_list else 0
-
-                # Contadores para mensajes
-                mensajes_existentes = 0
-                mensajes_nuevos = 0
-
-                for message in messages_list:
-                    if not message or not message.date:
-                        continue
-                        
-                    data: Dict[str, Any] = {}
-                    data.update(extract_channel_details(channel_details))
-                    data.update(extract_message_details(message))
-                    
-                    # Verificar si el mensaje ya existe en el dataset
-                    message_key = (data['Username'], message.id)
-                    if message_key in existing_ids:
-                        mensajes_existentes += 1
-                        continue
-        
-                    # Update the URL and Embed columns using the channel's username
-                    channel_username = data['Username']
-                    if not channel_username:  # Si no hay username, usar el ID
-                        channel_username = str(data['Channel ID'])
-                    data['URL'] = f"https://t.me/s/{channel_username}/{message.id}"
-                    data['Embed'] = f'<script async src="https://telegram.org/js/telegram-widget.js?22" data-telegram-post="{channel_username}/{message.id}" data-width="100%"></script>'
-                    
-                    date_str = message.date.strftime('%Y-%m-%d')
-                    data['Average Views'] = daily_average_views.get(date_str, 0)
-                    
-                    # Calcular la diferencia con el promedio
-                    if data['Average Views'] > 0:
-                        data['Average Difference'] = (message.views or 0) - data['Average Views']
-                        # Calcular el score como la proporción de views respecto a la media
-                        data['Score'] = (message.views or 0) / data['Average Views']
-                    else:
-                        data['Average Difference'] = 0
-                        data['Score'] = 0
+        # Canales en paralelo con un limitador compartido; el procesado de cada canal sigue el orden de la lista
+        results, scrape_stats = await scrape_channels(
+            client,
+            channels,
+            limit=max_messages,
+            offset_date=time_days_ago,
+            concurrency=Config.SCRAPER_CONCURRENCY,
+            rate=Config.SCRAPER_REQUESTS_PER_SECOND,
+            burst=Config.SCRAPER_BURST,
+            max_retries=Config.SCRAPER_FLOOD_RETRIES,
+            max_flood_wait=Config.SCRAPER_MAX_FLOOD_WAIT,
+            min_ids={channel: checkpoints.min_id(channel) for channel in channels} if checkpoints else None,
+            refresh_ids={channel: checkpoints.refresh_ids(channel) for channel in channels} if checkpoints else None
+        )
 
-                    # Añadir información de medios si existe
-                    if message.media:
-                        media_details = extract_media_details(message.media)
-                        data.update(media_details)
-                    else:
-                        # Si no hay medios, establecer valores por defecto
-                        data['Media Type'] = ''
-                        data['Media Size'] = None
-                        data['Media Caption'] = None
-                    
-                    # Inicializar Label como vacío
-                    data['Label'] = ''
-
-                    all_data.append(data)
-                    mensajes_nuevos += 1
-
-                print(f"✓ Canal '{channel}': {mensajes_existentes} mensajes existentes, {mensajes_nuevos} nuevos mensajes añadidos")
-
-            except ChannelInvalidError:
+        all_data = []
+        view_updates = []
+        for result in results:
+            channel = result['channel']
+            if isinstance(result['error'], ChannelInvalidError):
                 print(f"✗ Canal '{channel}' inválido o no accesible. Continuando con el siguiente.")
-            except Exception as e:
-                print(f"Error al procesar {channel}: {str(e)}")
                 continue
-
-        if all_data:
+            if result['error'] is not None:
+                print(f"Error al procesar {channel}: {str(result['error'])}")
+                continue
+            username = getattr(result['entity'], 'username', None)
+            if username:
+                view_updates.extend({'Username': username, 'Message ID': message.id, 'Views': message.views or 0}
+                                    for message in result['refreshed'])
+            if checkpoints is not None:
+                checkpoints.update(channel, result['messages'], result['refreshed'])
+            if not result['messages']:
+                print(f"No se encontraron mensajes para el canal '{channel}'. Continuando con el siguiente.")
+                continue
+            rows, mensajes_existentes = build_channel_rows(result['entity'], result['messages'], existing_ids)
+            all_data.extend(rows)
+            print(f"✓ Canal '{channel}': {mensajes_existentes} mensajes existentes, {len(rows)} nuevos mensajes añadidos "
+                  f"({result['seconds']:.1f}s)")
+
+        print(f"12b. {scrape_stats['messages']} mensajes de {scrape_stats['channels']} canales en {scrape_stats['seconds']}s "
+              f"({scrape_stats['messages_per_second']} msg/s, {scrape_stats['failed']} con error, "
+              f"{scrape_stats['flood_waits']} FloodWait)")
+        if checkpoints is not None:
+            print(f"12c. Incremental en {scrape_stats['incremental']} canales, {scrape_stats['refreshed']} mensajes refrescados")
+
+        if all_data or view_updates:
             print("13. Guardando datos...")
+            existing_messages = apply_view_refresh(existing_messages, view_updates)
             # Convert the new data to a DataFrame
-            new_data_df = pd.DataFrame(all_data)
+            new_data_df = pd.DataFrame(all_data) if all_data else pd.DataFrame(columns=existing_messages.columns)
 
             # Asegurarse de que las columnas coincidan entre los DataFrames
             if not existing_messages.empty:
@@ -529,6 +621,11 @@ async def main():
             # Eliminar duplicados
             df.drop_duplicates(subset=['Message ID', 'Username'], inplace=True, keep='first')
 
+            # Medias diarias sobre todas las filas del canal y día, no solo las descargadas ahora
+            touched_keys = {(row['Username'], row['Message ID']) for row in all_data}
+            touched_keys.update((update['Username'], update['Message ID']) for update in view_updates)
+            df = recompute_daily_averages(df, touched_keys)
+
             # Recalcular el score para todos los mensajes
             df['Score'] = df.apply(
                 lambda row: (row['Views'] or 0) / row['Average Views'] if row['Average Views'] > 0 else 0,
@@ -583,6 +680,35 @@ async def main():
                 json.dump(json_data, f, ensure_ascii=False, indent=4)
             print("16. Datos guardados en telegram_messages.json")
 
+            # Guardar el snapshot columnar que el backend mapea en memoria
+            write_snapshot(df, SNAPSHOT_FILE)
+            print(f"16b. Datos guardados en {SNAPSHOT_FILE}")
+
+            # Distribución particionada por día y canal, para cargar solo la ventana reciente.
+            # Solo se reescriben los (día, canal) con mensajes nuevos o refrescados: las medias
+            # diarias se recalculan por (canal, día), así que el resto de particiones no cambia
+            previous = read_manifest(MANIFEST_FILE)
+            touched_rows = pd.MultiIndex.from_arrays([df['Username'], df['Message ID']]).isin(list(touched_keys))
+            partitions = update_partitions(df, '.', previous.get('partitions') if previous else None,
+                                           partition_slots(df[touched_rows]))
+            print(f"16b. {len(partitions)} particiones en {PARTITION_PREFIX}/")
+
+            # Manifiesto de esta versión: se sube al bucket después de los archivos que nombra
+            manifest = build_manifest([
+                describe_file(SNAPSHOT_FILE),
+                describe_file('telegram_messages.json')
+            ], len(df), partitions)
+            write_manifest(manifest, MANIFEST_FILE)
+            print(f"16c. Manifiesto guardado en {MANIFEST_FILE} (versión {manifest['version']})")
+
+            if Config.SCRAPER_PUBLISH:
+                # Publicación condicional: si otro escritor publicó entretanto, se combina y reintenta
+                published = publish_dataset(get_s3_client(), manifest)
+                print(f"16d. Dataset publicado en S3 (versión {published['version']})")
+
+            # Las versiones sustituidas de cada partición (y las descargadas al unir) ya no se usan
+            prune_partitions('.', {entry['key'] for entry in partitions})
+
             # Convertir todas las columnas de fecha a datetime sin zona horaria
             for col in ['Date Sent', 'Creation Date', 'Edit Date']:
                 if col in df.columns:
@@ -601,6 +727,10 @@ async def main():
             print("17. Datos guardados en telegram_data.xlsx")
         else:
             print("13. No hay datos para guardar")
+        if checkpoints is not None:
+            # Solo después de guardar los datos: si algo falla antes, se vuelve a descargar
+            checkpoints.save()
+            print(f"17b. Checkpoints guardados en {CHECKPOINT_FILE}")
         print("18. Cerrando conexión...")
         try:
             if client:
@@ -0,0 +1,50 @@
+# Columnas de mensaje que devuelve cada endpoint
+CARD_COLUMNS = ['Embed', 'Score', 'Message ID', 'URL', 'Label']
+API_COLUMNS = ['Message ID', 'Message Text', 'Title', 'Views', 'Average Views', 'Label']
+
+def _column_values(df, col, decimals=None, missing=None):
+    """Valores de una columna como lista de Python, con NaN/NaT sustituidos por `missing`."""
+    if col not in df.columns:
+        return [missing] * len(df)
+    series = df[col]
+    if decimals is not None and series.dtype.kind in 'fiu':
+        series = series.round(decimals)
+    values = series.to_numpy(dtype=object, copy=True)
+    values[series.isna().to_numpy()] = missing
+    return values.tolist()
+
+def to_records(df, columns, decimals=None, missing=None):
+    """
+    Convierte las columnas indicadas en una lista de dicts, columna a columna en lugar
+    de fila a fila. `decimals` asocia columnas numéricas al número de decimales a
+    redondear y `missing` el valor de los nulos por columna (None por defecto).
+    """
+    decimals = decimals or {}
+    missing = missing or {}
+    values = [_column_values(df, col, decimals.get(col), missing.get(col)) for col in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+def to_json_records(df, columns):
+    """
+    Codifica las columnas indicadas como un array JSON de objetos, directamente desde
+    los arrays de columna (los nulos se emiten como null). Las columnas que no existen
+    se emiten como null.
+    """
+    return df.reindex(columns=columns).to_json(orient='records', double_precision=15, force_ascii=False, date_format='iso')
+
+def iter_ndjson(df, columns, positions=None, chunk_size=1000):
+    """
+    Genera el NDJSON (un objeto por línea) de las columnas indicadas en bloques de
+    `chunk_size` filas, de modo que la memoria no depende del tamaño del dataset.
+    `positions` limita y ordena las filas; por defecto se recorre el dataset entero.
+    """
+    total = len(df) if positions is None else len(positions)
+    for start in range(0, total, chunk_size):
+        if positions is None:
+            chunk = df.iloc[start:start + chunk_size]
+        else:
+            chunk = df.iloc[positions[start:start + chunk_size]]
+        lines = chunk.reindex(columns=columns).to_json(
+            orient='records', lines=True, double_precision=15, force_ascii=False, date_format='iso'
+        )
+        yield lines.rstrip('\n') + '\n'
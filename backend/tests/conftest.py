@@ -0,0 +1,142 @@
+import io
+import hashlib
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from botocore.exceptions import ClientError
+from sqlalchemy import create_engine
+
+# Los módulos del backend se importan por nombre, como al ejecutar app.py desde backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db
+from dataset_cache import DatasetSnapshot
+from filter_index import FilterIndex
+from preprocessing import normalize_messages
+
+@pytest.fixture
+def engine(tmp_path):
+    # Un único archivo SQLite compartido, como el telegram_app.db de varios workers
+    engine = create_engine(f"sqlite:///{tmp_path / 'telegram_app.db'}")
+    db.metadata.create_all(engine)
+    return engine
+
+class FakeS3:
+    """Bucket en memoria con las operaciones de boto3 que usa el backend."""
+
+    class exceptions:
+        class NoSuchKey(ClientError):
+            def __init__(self, key):
+                super().__init__({'Error': {'Code': 'NoSuchKey', 'Message': key}}, 'GetObject')
+
+    def __init__(self):
+        self.objects = {}
+        # Se llama antes de cada put_object con la clave: permite intercalar otro escritor
+        self.before_put = None
+        # Subidas multiparte en curso: UploadId -> {número de parte: datos}
+        self.multipart = {}
+        self.aborted = []
+        # Se llama en cada upload_part con el número de parte: permite simular un fallo
+        self.before_part = None
+
+    @staticmethod
+    def etag(data):
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        if self.before_put is not None:
+            self.before_put(Key)
+        current = self.objects.get(Key)
+        if (IfMatch is not None and (current is None or self.etag(current) != IfMatch)) or \
+                (IfNoneMatch == '*' and current is not None):
+            raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': Key}}, 'PutObject')
+        self.objects[Key] = Body if isinstance(Body, bytes) else Body.encode('utf-8')
+        return {'ETag': self.etag(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {'Body': io.BytesIO(self.objects[Key]), 'ETag': self.etag(self.objects[Key])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        with open(Filename, 'rb') as f:
+            self.objects[Key] = f.read()
+
+    def download_file(self, Bucket, Key, Filename):
+        with open(Filename, 'wb') as f:
+            f.write(self.objects[Key])
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f"upload-{len(self.multipart) + len(self.aborted) + 1}"
+        self.multipart[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if self.before_part is not None:
+            self.before_part(PartNumber)
+        self.multipart[UploadId][PartNumber] = Body
+        return {'ETag': self.etag(Body)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.multipart.pop(UploadId)
+        self.objects[Key] = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.multipart.pop(UploadId)
+        self.aborted.append(UploadId)
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix='', StartAfter=''):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix) and key > StartAfter)
+        yield {'Contents': [{'Key': key} for key in keys]}
+
+class FakeS3Client:
+    """Sustituto de S3Client (s3_client.py) sobre un FakeS3."""
+
+    def __init__(self, s3=None):
+        self.s3_client = s3 or FakeS3()
+        self.bucket_name = 'test-bucket'
+
+    def check_connection(self):
+        return True
+
+@pytest.fixture
+def s3():
+    return FakeS3Client()
+
+def build_snapshot(version='v1'):
+    rng = np.random.default_rng(7)
+    count = 400
+    df = normalize_messages(pd.DataFrame({
+        'Title': rng.choice(['Canal A', 'Canal B', 'Canal C'], count),
+        'Message ID': rng.permutation(count),
+        'Date Sent': pd.Timestamp('2024-03-01') + pd.to_timedelta(rng.integers(0, 30, count), unit='D'),
+        # Puntuaciones con empates y nulos: el orden depende del desempate por Message ID
+        'Score': rng.choice([0.5, 1.0, 2.5, np.nan], count),
+        'Views': rng.integers(0, 1000, count),
+        'Media Type': rng.choice(['Photo', 'TEXT'], count),
+        'Label': np.array(['', 1, 0], dtype=object)[rng.integers(0, 3, count)]
+    }))
+    return DatasetSnapshot(df, version, FilterIndex(df))
+
+@pytest.fixture
+def make_snapshot():
+    """Snapshot de mensajes aleatorios (siempre los mismos) con índice, para la versión pedida."""
+    return build_snapshot
+
+def expected_ids(df, sort_column):
+    """Message ID en el orden de la API: descendente, nulos al final y desempate por Message ID."""
+    keys = -pd.to_numeric(df[sort_column], errors='coerce')
+    order = pd.DataFrame({'key': keys.fillna(np.inf), 'id': df['Message ID']}).sort_values(['key', 'id'], kind='stable')
+    return df.loc[order.index, 'Message ID'].tolist()
+
+@pytest.fixture
+def sorted_ids():
+    return expected_ids
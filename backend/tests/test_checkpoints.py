@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from checkpoints import CheckpointStore
+from scrape_pool import scrape_channels
+
+NOW = datetime(2024, 5, 10, 12, 0, tzinfo=timezone.utc)
+
+def make_message(message_id, views=None, age_days=0):
+    return SimpleNamespace(id=message_id, date=NOW - timedelta(days=age_days),
+                           views=message_id * 10 if views is None else views)
+
+class HistoryClient:
+    """Cliente falso que aplica `min_id`/`reverse`/`limit` como Telegram a la historia del canal."""
+
+    def __init__(self, history):
+        self.history = history
+        self.requests = []
+
+    async def get_entity(self, channel):
+        return SimpleNamespace(username=channel)
+
+    async def get_messages(self, entity, limit=None, min_id=None, reverse=False, ids=None, **kwargs):
+        messages = self.history[entity.username]
+        if ids is not None:
+            return [message for message in messages if message.id in ids]
+        self.requests.append({'min_id': min_id, 'reverse': reverse})
+        if min_id is not None:
+            messages = [message for message in messages if message.id > min_id]
+        ordered = sorted(messages, key=lambda message: message.id, reverse=not reverse)
+        return ordered[:limit]
+
+def scrape(client, store, limit):
+    results, _ = asyncio.run(scrape_channels(
+        client, ['canal'], limit=limit, rate=100, burst=10,
+        min_ids={'canal': store.min_id('canal')}, refresh_ids={'canal': store.refresh_ids('canal', NOW)}
+    ))
+    store.update('canal', results[0]['messages'], results[0]['refreshed'], now=NOW)
+    store.save()
+    return [message.id for message in results[0]['messages']]
+
+def test_runs_resume_from_the_saved_high_water_mark(tmp_path):
+    path = str(tmp_path / 'checkpoints.json')
+    client = HistoryClient({'canal': [make_message(i) for i in range(1, 6)]})
+
+    # Sin checkpoint se descarga la historia reciente
+    assert sorted(scrape(client, CheckpointStore(path), limit=100)) == [1, 2, 3, 4, 5]
+    assert client.requests[-1]['min_id'] is None
+
+    # Llegan más mensajes de los que caben en una ejecución: cada una sigue donde terminó la anterior
+    client.history['canal'] += [make_message(i) for i in range(6, 13)]
+    assert scrape(client, CheckpointStore(path), limit=3) == [6, 7, 8]
+    assert client.requests[-1] == {'min_id': 5, 'reverse': True}
+    assert scrape(client, CheckpointStore(path), limit=3) == [9, 10, 11]
+    assert scrape(client, CheckpointStore(path), limit=3) == [12]
+    assert scrape(client, CheckpointStore(path), limit=3) == []
+    assert CheckpointStore(path).min_id('canal') == 12
+
+def test_refresh_window_drops_old_and_settled_messages(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.json'), refresh_days=3, refresh_max=3)
+    store.update('canal', [make_message(1, age_days=5), make_message(2), make_message(3), make_message(4),
+                           make_message(5)], now=NOW)
+    # Fuera de la ventana por antigüedad (1) y por tamaño (2)
+    assert store.refresh_ids('canal', NOW) == [3, 4, 5]
+
+    # Las vistas de 4 no cambian entre dos lecturas: deja de pedirse
+    store.update('canal', [], refreshed=[make_message(3, views=99), make_message(4)], now=NOW)
+    assert store.refresh_ids('canal', NOW) == [3, 5]
+
+def test_unreadable_checkpoints_start_from_scratch(tmp_path):
+    path = tmp_path / 'checkpoints.json'
+    path.write_text('{ no es json')
+    store = CheckpointStore(str(path))
+    assert store.channels == {} and store.min_id('canal') is None
@@ -0,0 +1,92 @@
+import os
+import base64
+import hashlib
+import threading
+import time
+import zlib
+import pytest
+import disk_cache
+from disk_cache import DiskCache
+from downloads import download_to_file
+from s3_client import object_checksums
+
+DATA = b'telegram' * 1000
+
+def fill(tmp_path):
+    with open(tmp_path, 'wb') as f:
+        f.write(DATA)
+
+def test_store_requires_and_verifies_a_checksum(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1 << 20)
+    with pytest.raises(ValueError):
+        cache.store('bucket', 'a.json', 'etag-1', fill)
+    with pytest.raises(ValueError):
+        cache.store('bucket', 'a.json', 'etag-1', fill, checksums={'md5': hashlib.md5(b'otro').hexdigest()})
+    assert cache.lookup('bucket', 'a.json', 'etag-1') is None
+
+    crc = f"{zlib.crc32(DATA):08x}"
+    path = cache.store('bucket', 'a.json', 'etag-1', fill, checksums={'crc32': crc, 'md5': hashlib.md5(DATA).hexdigest()})
+    assert cache.lookup('bucket', 'a.json', 'etag-1') == path
+    assert cache.lookup('bucket', 'a.json', 'etag-1', sha256=hashlib.sha256(DATA).hexdigest()) == path
+
+def test_object_checksums_only_trusts_full_object_values():
+    sha = hashlib.sha256(DATA).digest()
+    single = object_checksums({'ETag': f'"{hashlib.md5(DATA).hexdigest()}"',
+                               'ChecksumSHA256': base64.b64encode(sha).decode()})
+    assert single == {'sha256': sha.hex(), 'md5': hashlib.md5(DATA).hexdigest()}
+    # Multiparte: el ETag no es un MD5 y el CRC32 compuesto no describe el objeto entero
+    assert object_checksums({'ETag': '"abc-3"', 'ChecksumCRC32': 'OiaFbg=='}) == {}
+    assert object_checksums({'ETag': '"abc-3"', 'ChecksumCRC32': 'OiaFbg==', 'ChecksumType': 'FULL_OBJECT'}) == \
+        {'crc32': base64.b64decode('OiaFbg==').hex()}
+    assert object_checksums({'ETag': '"0123"', 'ServerSideEncryption': 'aws:kms'}) == {}
+
+def test_concurrent_downloads_of_the_same_path_do_not_mix(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1 << 20)
+    path = str(tmp_path / 'unverified.arrow')
+    contents = [bytes([value]) * 64 * 1024 for value in (1, 2)]
+    both_started = threading.Barrier(2)
+
+    def download(data):
+        def fetch_range(start, end):
+            # Las dos descargas escriben sus rangos a la vez
+            both_started.wait()
+            time.sleep(0.01)
+            yield data[start:end + 1]
+        download_to_file(fetch_range, len(data), path, lock=cache.exclusive, part_size=len(data))
+
+    threads = [threading.Thread(target=download, args=(data,)) for data in contents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(path, 'rb') as f:
+        assert f.read() in contents
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.download')] == []
+
+def test_hits_check_size_and_mtime_without_rehashing(tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path), max_bytes=1 << 20)
+    path = cache.store('bucket', 'a.arrow', 'etag-1', fill, sha256=hashlib.sha256(DATA).hexdigest())
+
+    def no_rehash(path):
+        raise AssertionError("Un acierto no debe recalcular el SHA-256")
+    monkeypatch.setattr(disk_cache, 'file_sha256', no_rehash)
+    assert cache.lookup('bucket', 'a.arrow', 'etag-1') == path
+    monkeypatch.undo()
+
+    # Mismo tamaño pero modificado después de guardarlo: se comprueba entero y se descarta
+    with open(path, 'r+b') as f:
+        f.write(b'X')
+    os.utime(path, ns=(0, 0))
+    assert cache.lookup('bucket', 'a.arrow', 'etag-1') is None
+    assert cache.stats()['entries'] == 0
+
+def test_stats_use_running_counters(tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path), max_bytes=len(DATA) * 2)
+    for tag in ('etag-1', 'etag-2', 'etag-3'):
+        cache.store('bucket', 'a.arrow', tag, fill, sha256=hashlib.sha256(DATA).hexdigest())
+
+    monkeypatch.setattr(disk_cache.os, 'listdir', lambda path: pytest.fail("stats() no debe recorrer el directorio"))
+    stats = cache.stats()
+    # El tercer guardado desalojó la entrada más antigua
+    assert stats['entries'] == 2 and stats['bytes'] == len(DATA) * 2
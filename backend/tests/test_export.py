@@ -0,0 +1,87 @@
+import io
+import os
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from export import ExportSources, export_columns, iter_export, read_export_rows, write_export_source
+from jobs import JOB_DONE, JobRunner, run_export
+from preprocessing import normalize_messages
+
+def make_messages():
+    return normalize_messages(pd.DataFrame({
+        'Channel ID': [100, 100, 200, 200],
+        'Title': ['Canal A', 'Canal A', 'Canal B', None],
+        'Message ID': [1, 2, 1, 2],
+        'Date Sent': ['2024-01-01T10:00:00', '2024-01-02T11:30:00', None, '2024-01-03T00:00:00'],
+        'Views': [10, None, 30, 40],
+        'Score': [1.0, 0.5, None, 2.0],
+        'Media Type': ['Photo', '', 'Video', None],
+        'Media Size': [None, 1024, None, 2048],
+        'Mixed': [1, 'dos', None, 3.5],
+        'Label': [1, '', 1, pd.NA]
+    }))
+
+def export_bytes(df, positions, export_format):
+    return b''.join(iter_export(df, positions, export_format, chunk_size=2))
+
+def test_export_source_rows_match_direct_export(tmp_path):
+    df = make_messages()
+    positions = np.array([0, 2, 3], dtype=np.int32)
+    path = write_export_source(df, str(tmp_path / 'source.arrow'))
+    frame = read_export_rows(path, positions, df['Label'].to_numpy()[positions], export_columns(df))
+
+    assert list(frame.columns) == export_columns(df)
+    for export_format in ('csv', 'csv.gz'):
+        assert export_bytes(frame, np.arange(len(frame)), export_format) == export_bytes(df, positions, export_format)
+    direct = pq.read_table(io.BytesIO(export_bytes(df, positions, 'parquet'))).to_pandas()
+    from_source = pq.read_table(io.BytesIO(export_bytes(frame, np.arange(len(frame)), 'parquet'))).to_pandas()
+    pd.testing.assert_frame_equal(from_source, direct)
+
+def test_export_without_rows_writes_header_only(tmp_path):
+    df = make_messages()
+    path = write_export_source(df, str(tmp_path / 'source.arrow'))
+    frame = read_export_rows(path, np.array([], dtype=np.int32), df['Label'].to_numpy()[:0], export_columns(df))
+    assert export_bytes(frame, np.arange(0), 'csv').decode('utf-8').strip() == ','.join(export_columns(df))
+
+def test_export_sources_are_kept_while_jobs_use_them(tmp_path):
+    df = make_messages()
+    sources = ExportSources(str(tmp_path), kept=1)
+
+    with sources.use(df, 'v1') as first:
+        with sources.use(df, 'v1') as again:
+            assert again == first
+        # Una versión más reciente no desaloja la fuente que sigue en uso
+        with sources.use(df, 'v2') as second:
+            assert os.path.exists(first) and os.path.exists(second)
+        assert os.path.exists(first)
+    # Liberada, solo se conserva la más reciente
+    assert not os.path.exists(first) and os.path.exists(second)
+
+    with sources.use(df, None) as unversioned:
+        assert os.path.exists(unversioned)
+    assert not os.path.exists(unversioned)
+
+def test_job_writes_its_source_and_releases_it_when_done(tmp_path):
+    df = make_messages()
+    sources = ExportSources(str(tmp_path / 'sources'), kept=0)
+    positions = np.array([0, 2], dtype=np.int32)
+
+    def prepare(params):
+        @contextmanager
+        def build(job):
+            with sources.use(df, 'v1') as source:
+                yield run_export, (source, positions, df['Label'].to_numpy()[positions], export_columns(df),
+                                   'csv', 'local', f"export-{job.id}", str(tmp_path))
+        return 'v1', None, build
+
+    runner = JobRunner(max_workers=1, artifact_dir=str(tmp_path))
+    runner.register('export', prepare)
+    job = runner.submit('export', {})
+    assert runner.wait(job, 120) and job.status == JOB_DONE
+
+    with open(job.result['path'], 'rb') as f:
+        assert f.read() == export_bytes(df, positions, 'csv')
+    # La ruta en el servidor no sale en la respuesta de la API
+    assert 'path' not in job.to_dict()['result'] and job.to_dict()['result']['rows'] == 2
+    assert os.listdir(tmp_path / 'sources') == []
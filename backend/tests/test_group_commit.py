@@ -0,0 +1,73 @@
+import threading
+import pytest
+from label_log import GroupCommitWriter, make_label_event
+
+class FakeLog:
+    """Registro de etiquetas falso: guarda cada `append()` y puede fallar a demanda."""
+
+    def __init__(self):
+        self.batches = []
+        self.fail = None
+
+    def append(self, events):
+        if self.fail is not None:
+            raise self.fail
+        self.batches.append(list(events))
+        return f"v{len(self.batches)}"
+
+def events(*message_ids):
+    return [make_label_event('canal', message_id, 1) for message_id in message_ids]
+
+def test_requests_in_the_same_window_share_one_flush():
+    log = FakeLog()
+    published = []
+    # Ventana larga: el flush lo dispara max_events, no el tiempo
+    writer = GroupCommitWriter(log, window=30, max_events=4, on_flush=lambda: published.append(len(log.batches)))
+
+    futures = [writer.submit(events(1, 2)), writer.submit(events(3)), writer.submit(events(4))]
+
+    assert [future.result(5) for future in futures] == ['v1', 'v1', 'v1']
+    assert [[event['message_id'] for event in batch] for batch in log.batches] == [[1, 2, 3, 4]]
+    # on_flush se llama una vez, después de persistir
+    assert published == [1]
+    stats = writer.stats()
+    assert stats['flushes'] == 1 and stats['events'] == 4 and stats['max_batch'] == 4
+
+def test_window_closes_a_partial_batch():
+    log = FakeLog()
+    writer = GroupCommitWriter(log, window=0.05, max_events=500)
+
+    assert writer.write(events(1), timeout=5) == 'v1'
+    assert writer.write(events(2), timeout=5) == 'v2'
+    assert len(log.batches) == 2
+
+def test_failed_flush_fails_every_request_in_the_batch():
+    log = FakeLog()
+    log.fail = ConnectionError("S3 no disponible")
+    writer = GroupCommitWriter(log, window=30, max_events=2)
+
+    futures = [writer.submit(events(1)), writer.submit(events(2))]
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            future.result(5)
+    assert writer.stats()['errors'] == 1 and writer.stats()['flushes'] == 0
+
+    # El escritor sigue vivo: el siguiente lote se persiste
+    log.fail = None
+    assert writer.write(events(1, 2), timeout=5) == 'v1'
+
+def test_concurrent_writers_are_all_confirmed():
+    log = FakeLog()
+    writer = GroupCommitWriter(log, window=0.05, max_events=500)
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(writer.write(events(i), timeout=5)))
+               for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 20
+    assert sorted(event['message_id'] for batch in log.batches for event in batch) == list(range(20))
+    # Las 20 peticiones se agrupan en menos flushes que peticiones
+    assert len(log.batches) < 20
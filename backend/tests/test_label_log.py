@@ -0,0 +1,46 @@
+import time
+from sqlalchemy import create_engine
+from label_log import LABEL_LOG_PREFIX, LABEL_SNAPSHOT_PREFIX, LabelLog, make_label_event
+from label_store import LabelStore
+from models import db
+
+def old_event(channel, message_id, label, age=3600):
+    # Fuera del margen de sincronización: el segmento ya se puede compactar
+    return dict(make_label_event(channel, message_id, label), ts=time.time() - age)
+
+def segment_keys(s3, prefix=LABEL_LOG_PREFIX):
+    return sorted(key for key in s3.s3_client.objects if key.startswith(prefix))
+
+def test_applied_segments_checks_keys_in_chunks(engine):
+    store = LabelStore(lambda: engine)
+    keys = [f"{LABEL_LOG_PREFIX}{i:06d}.jsonl" for i in range(1500)]
+    store.write([], keys[:1200])
+    assert store.applied_segments(keys) == set(keys[:1200])
+    # Un segmento repetido dentro de un lote grande se descarta igual
+    assert store.write([dict(make_label_event('100', 1, 1), segment=keys[0])], keys[:1000]) == 0
+
+def test_sync_compacts_and_new_worker_restores_from_snapshot(engine, s3, tmp_path):
+    log_a = LabelLog(LabelStore(lambda: engine), get_client=lambda: s3, compact_segments=3)
+    for message_id in (1, 2, 3):
+        log_a.append([old_event('100', message_id, 1, age=3600 - message_id)])
+    log_a.append([old_event('100', 1, 0, age=3000)])
+    assert log_a.sync() is False
+
+    snapshots = segment_keys(s3, LABEL_SNAPSHOT_PREFIX)
+    assert len(snapshots) == 1
+    # Los segmentos incluidos en el snapshot pueden expirar en el bucket
+    for key in segment_keys(s3):
+        s3.s3_client.delete_object(Bucket=s3.bucket_name, Key=key)
+    log_a.append([make_label_event('200', 7, 1)])
+
+    other = create_engine(f"sqlite:///{tmp_path / 'other.db'}")
+    db.metadata.create_all(other)
+    log_b = LabelLog(LabelStore(lambda: other), get_client=lambda: s3, compact_segments=3)
+    assert log_b.sync() is True
+
+    _, labels_a = log_a.store.frame()
+    _, labels_b = log_b.store.frame()
+    assert labels_b.sort_index().to_dict() == labels_a.sort_index().to_dict()
+    assert labels_b[('100', 1)] == 0
+    # Con todo aplicado no se vuelve a cargar el snapshot
+    assert log_b.sync() is False
@@ -0,0 +1,73 @@
+import pandas as pd
+from dataset_cache import DatasetCache
+from filter_index import FilterIndex
+from label_log import LabelLog, make_label_event
+from label_store import LabelStore
+from preprocessing import normalize_messages
+
+def make_messages():
+    return pd.DataFrame({
+        'Channel ID': [100, 100, 200],
+        'Title': ['Canal A', 'Canal A', 'Canal B'],
+        'Message ID': [1, 2, 1],
+        'Date Sent': ['2024-01-01', '2024-01-02', '2024-01-02'],
+        'Score': [1.0, 2.0, 3.0],
+        'Label': ['', '', '']
+    })
+
+def make_worker(engine):
+    log = LabelLog(LabelStore(lambda: engine))
+    cache = DatasetCache(
+        lambda version: (None, version) if version else (make_messages(), 'v1'),
+        preprocess=normalize_messages,
+        build_index=FilterIndex,
+        overlay=log,
+        revalidate_interval=0
+    )
+    return log, cache
+
+def label_of(snapshot, channel_id, message_id):
+    df = snapshot.df
+    row = df[(df['Channel ID'] == channel_id) & (df['Message ID'] == message_id)]
+    return row['Label'].iloc[0]
+
+def test_label_written_by_another_worker_reaches_snapshot(engine):
+    _, cache_a = make_worker(engine)
+    log_b, _ = make_worker(engine)
+    before = cache_a.refresh()
+    assert before.overlay_version is None
+
+    log_b.append([make_label_event('100', 2, 1)])
+    after = cache_a.refresh()
+
+    assert after.version != before.version
+    assert after.overlay_version == log_b.version
+    assert label_of(after, 100, 2) == 1
+    positions = after.index.resolve(label=1)
+    assert list(after.df['Message ID'].iloc[positions]) == [2]
+
+def test_refresh_keeps_snapshot_when_labels_unchanged(engine):
+    log_a, cache_a = make_worker(engine)
+    log_a.append([make_label_event('200', 1, 0)])
+    first = cache_a.refresh()
+    assert cache_a.refresh() is first
+    assert label_of(first, 200, 1) == 0
+
+def test_apply_overlay_updates_labels_in_place(engine):
+    log_a, cache_a = make_worker(engine)
+    log_a.append([make_label_event('100', 1, 0)])
+    before = cache_a.refresh()
+
+    log_a.append([make_label_event('100', 1, 1), make_label_event('200', 1, 1)])
+    previous, published, changes = cache_a.apply_overlay()
+
+    assert previous is before
+    assert sorted(changes) == [(0, 1), (2, 1)]
+    assert published.overlay_version == log_a.version
+    assert list(published.df['Label']) == [1, '', 1]
+    # Los datos y el resto del índice se comparten con el snapshot anterior
+    assert published.index.rank_orders is before.index.rank_orders
+    rebuilt = FilterIndex(published.df)
+    for label in (0, 1, 'none'):
+        assert list(published.index.resolve(label=label)) == list(rebuilt.resolve(label=label))
+    assert list(before.index.resolve(label=0)) == [0]
@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+from dataset_format import read_snapshot
+from manifest import MANIFEST_FILE, ManifestConflict, build_manifest, merge_manifests, publish_dataset, \
+    read_manifest_from_s3
+from partitions import write_partitions
+
+def make_messages(rows):
+    return pd.DataFrame([{
+        'Channel ID': 100,
+        'Title': 'Canal A',
+        'Message ID': message_id,
+        'Date Sent': f'2024-05-0{day}T12:00:00',
+        'Views': views
+    } for message_id, day, views in rows])
+
+def write_dataset(directory, rows):
+    directory.mkdir()
+    partitions = write_partitions(make_messages(rows), str(directory))
+    return build_manifest([], len(rows), partitions), str(directory)
+
+def published_rows(s3, tmp_path):
+    manifest = read_manifest_from_s3(s3)
+    rows = {}
+    for entry in manifest['partitions']:
+        path = tmp_path / 'check.arrow'
+        path.write_bytes(s3.s3_client.objects[entry['key']])
+        part = read_snapshot(str(path))
+        assert len(part) == entry['rows']
+        rows[entry['date']] = dict(zip(part['Message ID'].tolist(), part['Views'].tolist()))
+    return manifest, rows
+
+def test_writers_of_the_same_partition_keep_both_rows(s3, tmp_path):
+    theirs, theirs_dir = write_dataset(tmp_path / 'b', [(1, 1, 10), (2, 1, 20)])
+    publish_dataset(s3, theirs, theirs_dir)
+
+    # Mismo día y canal: el mensaje 2 con vistas nuevas y el 3 que el otro escritor no tiene
+    ours, ours_dir = write_dataset(tmp_path / 'a', [(2, 1, 25), (3, 1, 30), (5, 2, 50)])
+    published = publish_dataset(s3, ours, ours_dir)
+
+    manifest, rows = published_rows(s3, tmp_path)
+    assert manifest['version'] == published['version']
+    assert rows == {'2024-05-01': {1: 10, 2: 25, 3: 30}, '2024-05-02': {5: 50}}
+    assert manifest['rows'] == 4
+
+def test_concurrent_publish_retries_with_the_union(s3, tmp_path):
+    ours, ours_dir = write_dataset(tmp_path / 'a', [(2, 1, 25), (3, 1, 30)])
+    theirs, theirs_dir = write_dataset(tmp_path / 'b', [(1, 1, 10), (4, 3, 40)])
+
+    def publish_theirs_first(key):
+        # El otro escritor publica entre nuestra lectura del manifiesto y nuestra escritura
+        if key == MANIFEST_FILE:
+            s3.s3_client.before_put = None
+            publish_dataset(s3, theirs, theirs_dir)
+
+    s3.s3_client.before_put = publish_theirs_first
+    publish_dataset(s3, ours, ours_dir)
+
+    _, rows = published_rows(s3, tmp_path)
+    assert rows == {'2024-05-01': {1: 10, 2: 25, 3: 30}, '2024-05-03': {4: 40}}
+
+def test_overlap_without_merge_is_a_conflict(tmp_path):
+    theirs, _ = write_dataset(tmp_path / 'b', [(1, 1, 10)])
+    ours, _ = write_dataset(tmp_path / 'a', [(2, 1, 20)])
+    with pytest.raises(ManifestConflict):
+        merge_manifests(theirs, ours)
+    assert merge_manifests(ours, ours) is ours
@@ -0,0 +1,42 @@
+import pytest
+from pagination import CursorError, fetch_page
+from query import parse_query, run_query
+from query_cache import QueryCache
+
+def test_cursor_pages_follow_the_query_order(make_snapshot, sorted_ids):
+    snapshot = make_snapshot()
+    df = snapshot.df
+    plan = parse_query({'channel': ['Canal A', 'Canal C'], 'label': '1', 'sortBy': 'score'})
+    result = run_query(plan, snapshot, QueryCache())
+
+    # Recorrer todas las páginas por cursor: ni repetidos ni saltos, en el orden de pandas
+    served, cursor = [], None
+    while True:
+        positions, cursor = fetch_page(snapshot, result, 0, 7, cursor)
+        served.extend(df['Message ID'].iloc[positions])
+        if cursor is None:
+            break
+    mask = df['Title'].isin(['Canal A', 'Canal C']) & (df['Label'] == 1)
+    assert served == sorted_ids(df[mask], 'Score')
+
+    offset_page, _ = fetch_page(snapshot, result, 7, 7)
+    assert list(df['Message ID'].iloc[offset_page]) == served[7:14]
+
+def test_cursor_from_another_version_seeks_by_key(make_snapshot):
+    snapshot = make_snapshot()
+    result = run_query(parse_query({'sortBy': 'views'}), snapshot)
+    _, cursor = fetch_page(snapshot, result, 0, 10)
+    same_version, _ = fetch_page(snapshot, result, 0, 10, cursor)
+
+    # Un cursor emitido por otra versión continúa desde su clave (valor, Message ID), no desde el rango
+    refreshed = make_snapshot('v2')
+    other_version, _ = fetch_page(refreshed, run_query(parse_query({'sortBy': 'views'}), refreshed), 0, 10, cursor)
+    assert list(refreshed.df['Message ID'].iloc[other_version]) == list(snapshot.df['Message ID'].iloc[same_version])
+
+def test_cursor_must_match_the_query(make_snapshot):
+    snapshot = make_snapshot()
+    _, cursor = fetch_page(snapshot, run_query(parse_query({'sortBy': 'views'}), snapshot), 0, 10)
+    with pytest.raises(CursorError):
+        fetch_page(snapshot, run_query(parse_query({'sortBy': 'score'}), snapshot), 0, 10, cursor)
+    with pytest.raises(CursorError):
+        fetch_page(snapshot, run_query(parse_query({'sortBy': 'views'}), snapshot), 0, 10, 'no-es-un-cursor')
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+from dataset_cache import DatasetCache
+from filter_index import FilterIndex
+from partitions import partition_labels, prune_partitions, update_partitions, write_partitions
+from preprocessing import MEDIA_TYPE_COLUMN, normalize_messages
+
+def make_messages(start, count, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Channel ID': rng.integers(1, 4, count),
+        'Title': rng.choice(['Canal A', 'Canal B', '', f'Canal {seed}'], count),
+        'Message ID': np.arange(start, start + count) % 7,
+        'Date Sent': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 20, count), unit='D'),
+        # Muchos empates (y nulos) para probar la mezcla de las permutaciones
+        'Score': rng.choice([1.0, 2.0, np.nan], count),
+        'Views': rng.integers(0, 3, count),
+        'Media Type': rng.choice(['Photo', 'text', f'Video{seed}'], count),
+        'Label': rng.choice(['', 1, 0], count).astype(object)
+    })
+
+def assert_same_index(index, expected):
+    assert index.size == expected.size
+    assert index.channel_postings.keys() == expected.channel_postings.keys()
+    for channel, positions in expected.channel_postings.items():
+        assert list(index.channel_postings[channel]) == list(positions)
+    for name in ('media_type_bitmaps', 'label_bitmaps'):
+        bitmaps, expected_bitmaps = getattr(index, name), getattr(expected, name)
+        assert bitmaps.keys() == expected_bitmaps.keys()
+        for key, bitmap in expected_bitmaps.items():
+            assert bitmaps[key].tobytes() == bitmap.tobytes()
+    for name in ('scores', 'date_order', 'sorted_days', 'message_ids'):
+        np.testing.assert_array_equal(getattr(index, name), getattr(expected, name))
+    for sort_by, order in expected.rank_orders.items():
+        np.testing.assert_array_equal(index.rank_orders[sort_by], order)
+        np.testing.assert_array_equal(index.ranks[sort_by], expected.ranks[sort_by])
+        np.testing.assert_array_equal(index.rank_keys[sort_by], expected.rank_keys[sort_by])
+
+def test_extended_index_matches_a_rebuild():
+    hot = normalize_messages(make_messages(0, 300, 1))
+    cold = normalize_messages(make_messages(300, 200, 2))
+    cache = DatasetCache(lambda version: (hot, 'v1'), build_index=FilterIndex, revalidate_interval=60)
+    snapshot = cache.refresh()
+
+    extended = cache.extend(snapshot, cold, 'v2', None)
+
+    df = extended.df
+    assert len(df) == 500 and extended.version == 'v2'
+    assert isinstance(df[MEDIA_TYPE_COLUMN].dtype, pd.CategoricalDtype)
+    assert_same_index(extended.index, FilterIndex(df))
+
+def test_extend_refuses_a_stale_snapshot():
+    cache = DatasetCache(lambda version: (make_messages(0, 10, 1), 'v1'), preprocess=normalize_messages,
+                         build_index=FilterIndex, revalidate_interval=60)
+    stale = cache.refresh()
+    current = cache.extend(stale, make_messages(10, 5, 2), 'v2', None)
+
+    # Otra petición ya amplió el snapshot: hay que recalcular sobre el vigente
+    assert cache.extend(stale, make_messages(20, 5, 3), 'v3', None) is None
+    assert cache.snapshot is current
+    assert len(cache.extend(current, make_messages(20, 5, 3), 'v3', None).df) == 20
+
+def test_update_rewrites_only_changed_partitions_and_prunes_old_files(tmp_path):
+    df = make_messages(0, 60, 1)
+    first = write_partitions(df, str(tmp_path))
+    changed_slot = (first[0]['date'], first[0]['channel'])
+    days, channels = partition_labels(df)
+    in_slot = ((days == changed_slot[0]) & (channels == changed_slot[1])).to_numpy()
+    df.loc[in_slot, 'Score'] = 99.0
+
+    second = update_partitions(df, str(tmp_path), first, {changed_slot})
+
+    by_slot = {(entry['date'], entry['channel']): entry for entry in second}
+    assert by_slot.keys() == {(entry['date'], entry['channel']) for entry in first}
+    assert by_slot[changed_slot]['key'] != first[0]['key']
+    assert all(by_slot[(entry['date'], entry['channel'])] is entry for entry in first[1:])
+    assert prune_partitions(str(tmp_path), {entry['key'] for entry in second}) == 1
+    assert not (tmp_path / first[0]['key']).exists()
+    assert all((tmp_path / entry['key']).exists() for entry in second)
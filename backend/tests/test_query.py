@@ -0,0 +1,37 @@
+import numpy as np
+from query import parse_query, run_query
+from query_cache import QueryCache
+
+def test_filtered_query_matches_pandas(make_snapshot, sorted_ids):
+    snapshot = make_snapshot()
+    df = snapshot.df
+    plan = parse_query({'channel': ['Canal A', 'Canal C'], 'dateStart': '2024-03-05', 'dateEnd': '2024-03-20',
+                        'mediaType': 'photo', 'label': '1', 'scoreMin': '0.6', 'sortBy': 'score'})
+    mask = df['Title'].isin(['Canal A', 'Canal C']) & (df['Date Sent'] >= '2024-03-05') & \
+        (df['Date Sent'] < '2024-03-21') & (df['Media Type'] == 'Photo') & (df['Label'] == 1) & (df['Score'] >= 0.6)
+
+    result = run_query(plan, snapshot, QueryCache())
+    assert result.total == mask.sum()
+    positions = result.page(snapshot.index, 0, result.total)
+    assert list(df['Message ID'].iloc[positions]) == sorted_ids(df[mask], 'Score')
+
+def test_query_without_filters_sorts_everything(make_snapshot, sorted_ids):
+    snapshot = make_snapshot()
+    result = run_query(parse_query({'sortBy': 'views'}), snapshot)
+    positions = result.page(snapshot.index, 0, snapshot.index.size)
+    assert list(snapshot.df['Message ID'].iloc[positions]) == sorted_ids(snapshot.df, 'Views')
+
+def test_query_string_and_json_params_compile_to_the_same_plan(make_snapshot):
+    # index y /api/messages reciben request.args; /filter_messages y /load_more, el cuerpo JSON
+    args = parse_query({'channel': 'Canal A,Canal B', 'label': '0', 'dateEnd': '2024-03-10', 'sortBy': 'views'})
+    body = parse_query({'channel': ['Canal A', 'Canal B'], 'label': 0, 'dateEnd': '2024-03-10',
+                        'scoreMin': '', 'sortBy': 'views'})
+    assert args.filters == body.filters and args.sort_by == body.sort_by
+
+    snapshot = make_snapshot()
+    cache = QueryCache()
+    # Sin caché o con ella, el resultado es el mismo, y la segunda petición lo reutiliza
+    cached = run_query(args, snapshot, cache)
+    assert run_query(body, snapshot, cache) is cached
+    np.testing.assert_array_equal(cached.page(snapshot.index, 0, cached.total),
+                                  run_query(body, snapshot).page(snapshot.index, 0, cached.total))
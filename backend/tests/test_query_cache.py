@@ -0,0 +1,47 @@
+import numpy as np
+from dataset_cache import DatasetSnapshot
+from filter_index import FilterIndex
+from query import parse_query, run_query
+from query_cache import QueryCache
+
+def test_equivalent_queries_share_an_entry(make_snapshot):
+    snapshot = make_snapshot()
+    cache = QueryCache()
+    first = run_query(parse_query({'channel': 'Canal B,Canal A', 'mediaType': 'PHOTO', 'sortBy': 'score'}), snapshot, cache)
+    # Mismo filtro con otro orden de canales, otras mayúsculas y parámetros vacíos
+    second = run_query(parse_query({'channel': ['Canal A', 'Canal B'], 'mediaType': 'photo', 'label': '',
+                                    'sortBy': 'score'}), snapshot, cache)
+    assert second is first
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+def test_cache_is_bounded_and_skips_unversioned_snapshots(make_snapshot):
+    snapshot = make_snapshot()
+    channels = ('Canal A', 'Canal B', 'Canal C')
+    sizes = [run_query(parse_query({'channel': channel}), snapshot).nbytes for channel in channels]
+    cache = QueryCache(max_bytes=sizes[1] + sizes[2])
+    for channel in channels:
+        run_query(parse_query({'channel': channel}), snapshot, cache)
+    # La más antigua se desaloja al superar el límite de memoria
+    assert cache.stats()['entries'] == 2 and cache.stats()['bytes'] == cache.max_bytes
+
+    unversioned = DatasetSnapshot(snapshot.df, None, snapshot.index)
+    run_query(parse_query({'channel': 'Canal A'}), unversioned, cache)
+    assert run_query(parse_query({'channel': 'Canal A'}), unversioned, cache) is not \
+        run_query(parse_query({'channel': 'Canal A'}), unversioned, cache)
+
+def test_label_change_drops_only_affected_cached_queries(make_snapshot):
+    snapshot = make_snapshot()
+    cache = QueryCache()
+    labeled = run_query(parse_query({'label': '1'}), snapshot, cache)
+    other_label = run_query(parse_query({'label': '0'}), snapshot, cache)
+    channel = run_query(parse_query({'channel': 'Canal B'}), snapshot, cache)
+    position = int(np.flatnonzero(snapshot.df['Label'] == '')[0])
+
+    cache.rebase('v1', 'v2', {position: FilterIndex.parse_label(1)})
+    relabeled = make_snapshot('v2')
+
+    # La consulta por canal no depende de etiquetas y sigue en caché; la de Label == 1 se recalcula
+    assert run_query(parse_query({'channel': 'Canal B'}), relabeled, cache) is channel
+    assert run_query(parse_query({'label': '1'}), relabeled, cache) is not labeled
+    # Label == 0 no contenía la fila ni la incluye ahora: también se conserva
+    assert run_query(parse_query({'label': '0'}), relabeled, cache) is other_label
@@ -0,0 +1,128 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from telethon.errors import ChannelInvalidError, FloodWaitError
+import scrape_pool
+from scrape_pool import scrape_channels
+
+class FakeClock:
+    """Reloj virtual: las esperas del limitador avanzan el tiempo sin dormir."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await asyncio.sleep(0)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scrape_pool, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(scrape_pool, 'asyncio', SimpleNamespace(
+        Lock=asyncio.Lock, gather=asyncio.gather, sleep=clock.sleep))
+    return clock
+
+class FakeClient:
+    """Cliente de Telethon falso: `get_entity()` y `get_messages()` asíncronos."""
+
+    def __init__(self, messages, floods=None, invalid=(), refresh_errors=()):
+        self.messages = messages
+        # Canal -> segundos de FloodWait de cada petición de mensajes, en orden
+        self.floods = {channel: list(waits) for channel, waits in (floods or {}).items()}
+        self.invalid = set(invalid)
+        self.refresh_errors = set(refresh_errors)
+        self.requests = []
+
+    async def get_entity(self, channel):
+        self.requests.append(('entity', channel))
+        if channel in self.invalid:
+            raise ChannelInvalidError(request=None)
+        return SimpleNamespace(username=channel)
+
+    async def get_messages(self, entity, limit=None, ids=None, **kwargs):
+        channel = entity.username
+        self.requests.append(('messages', channel))
+        if self.floods.get(channel):
+            raise FloodWaitError(request=None, capture=self.floods[channel].pop(0))
+        if ids is not None:
+            if channel in self.refresh_errors:
+                raise ConnectionError("sin conexión")
+            return [message if message.id in ids else None for message in self.messages[channel]]
+        return self.messages[channel][:limit]
+
+def make_messages(count):
+    return [SimpleNamespace(id=message_id, views=message_id * 10) for message_id in range(1, count + 1)]
+
+def run(client, channels, **kwargs):
+    return asyncio.run(scrape_channels(client, channels, limit=100, **kwargs))
+
+def test_flood_wait_pauses_all_requests_and_retries(clock):
+    client = FakeClient({'a': make_messages(3), 'b': make_messages(2)}, floods={'a': [30]})
+
+    results, stats = run(client, ['a', 'b'], concurrency=2, rate=100, burst=10)
+
+    assert [len(result['messages']) for result in results] == [3, 2]
+    assert stats['flood_waits'] == 1 and stats['failed'] == 0
+    # Se espera lo que pide Telegram (más un segundo de margen) antes del reintento
+    assert clock.now >= 31
+    assert client.requests.count(('messages', 'a')) == 2
+
+def test_flood_wait_too_long_or_repeated_fails_only_that_channel(clock):
+    client = FakeClient({'a': make_messages(1), 'b': make_messages(1), 'c': make_messages(1)},
+                        floods={'a': [600], 'b': [5, 5, 5]})
+
+    results, stats = run(client, ['a', 'b', 'c'], concurrency=1, rate=100, burst=10,
+                         max_retries=2, max_flood_wait=300)
+
+    assert isinstance(results[0]['error'], FloodWaitError) and results[0]['error'].seconds == 600
+    # Una espera mayor que max_flood_wait no se intenta: ni pausa ni reintento
+    assert client.requests.count(('messages', 'a')) == 1
+    assert isinstance(results[1]['error'], FloodWaitError)
+    assert client.requests.count(('messages', 'b')) == 3
+    assert results[2]['error'] is None and len(results[2]['messages']) == 1
+    assert stats['failed'] == 2 and stats['flood_waits'] == 2
+
+def test_token_bucket_limits_request_rate(clock):
+    channels = [f"canal{i}" for i in range(5)]
+    client = FakeClient({channel: make_messages(1) for channel in channels})
+
+    results, stats = run(client, channels, concurrency=5, rate=2, burst=1)
+
+    assert all(result['error'] is None for result in results)
+    # 10 peticiones (entidad y mensajes por canal) a 2/s con ráfaga de 1: la primera
+    # sale al momento y cada una de las otras espera medio segundo
+    assert len(client.requests) == 10
+    assert clock.now == pytest.approx(4.5)
+    assert stats['throttled_seconds'] == pytest.approx(4.5)
+
+def test_history_request_takes_one_token_per_hundred_messages(clock):
+    client = FakeClient({'a': make_messages(1)})
+
+    asyncio.run(scrape_channels(client, ['a'], limit=300, rate=1, burst=4))
+
+    # get_entity gasta 1 de la ráfaga de 4 y get_messages(limit=300) necesita 3: no hay espera
+    assert clock.now == 0
+    asyncio.run(scrape_channels(client, ['a'], limit=400, rate=1, burst=4))
+    assert clock.now == pytest.approx(1)
+
+def test_channel_errors_are_reported_per_channel(clock):
+    client = FakeClient({'a': make_messages(2), 'c': make_messages(4)}, invalid={'b'}, refresh_errors={'c'})
+
+    results, stats = run(client, ['a', 'b', 'c'], concurrency=3, rate=100, burst=10,
+                         refresh_ids={'a': [1, 3], 'c': [2]})
+
+    assert [result['channel'] for result in results] == ['a', 'b', 'c']
+    assert isinstance(results[1]['error'], ChannelInvalidError)
+    assert results[1]['messages'] == []
+    # Los ids borrados (None) se descartan del refresco
+    assert [message.id for message in results[0]['refreshed']] == [1]
+    # Un fallo al refrescar conserva los mensajes nuevos del canal
+    assert results[2]['error'] is None and len(results[2]['messages']) == 4 and results[2]['refreshed'] == []
+    assert stats['failed'] == 1
+    assert [entry['error'] is not None for entry in stats['per_channel']] == [False, True, False]
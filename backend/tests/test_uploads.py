@@ -0,0 +1,48 @@
+import hashlib
+import pytest
+from uploads import MIN_PART_SIZE, multipart_upload
+
+def make_chunks(count, size=1024 * 1024):
+    # Bloques más pequeños que una parte: se reagrupan
+    return [bytes([i % 251]) * size for i in range(count)]
+
+def test_large_stream_is_uploaded_in_ordered_parts(s3):
+    chunks = make_chunks(12)
+    data = b''.join(chunks)
+
+    stats = multipart_upload(s3, 'exports/grande.csv', iter(chunks), part_size=MIN_PART_SIZE, max_workers=2)
+
+    assert s3.s3_client.objects['exports/grande.csv'] == data
+    assert stats['parts'] == 3 and stats['size'] == len(data)
+    assert stats['sha256'] == hashlib.sha256(data).hexdigest()
+    assert s3.s3_client.multipart == {}
+
+def test_small_stream_uses_a_single_put(s3):
+    stats = multipart_upload(s3, 'exports/pequeño.csv', iter([b'a,b\n', b'1,2\n']))
+    assert s3.s3_client.objects['exports/pequeño.csv'] == b'a,b\n1,2\n'
+    assert stats['parts'] == 1 and s3.s3_client.multipart == {}
+
+def test_failed_part_aborts_the_upload(s3):
+    def fail_second_part(number):
+        if number == 2:
+            raise ConnectionError("se perdió la conexión")
+    s3.s3_client.before_part = fail_second_part
+
+    with pytest.raises(ConnectionError):
+        multipart_upload(s3, 'exports/grande.csv', iter(make_chunks(12)), part_size=MIN_PART_SIZE, max_workers=2)
+
+    # Ni objeto a medias ni partes huérfanas
+    assert 'exports/grande.csv' not in s3.s3_client.objects
+    assert s3.s3_client.multipart == {} and s3.s3_client.aborted == ['upload-1']
+
+def test_failing_source_aborts_the_upload(s3):
+    def chunks():
+        # Falla con dos partes ya enviadas
+        yield from make_chunks(12)
+        raise ValueError("error al generar la exportación")
+
+    with pytest.raises(ValueError):
+        multipart_upload(s3, 'exports/grande.csv', chunks(), part_size=MIN_PART_SIZE, max_workers=2)
+
+    assert 'exports/grande.csv' not in s3.s3_client.objects
+    assert s3.s3_client.multipart == {} and len(s3.s3_client.aborted) == 1
@@ -0,0 +1,138 @@
+import io
+import time
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+from config import Config
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# S3 exige partes de al menos 5 MiB, salvo la última
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Compresiones de `compress_chunks()` (códecs de streaming de pyarrow) y su tipo MIME
+COMPRESSION_TYPES = {
+    'gzip': 'application/gzip',
+    'zstd': 'application/zstd'
+}
+
+class ChunkSink(io.RawIOBase):
+    """Archivo de solo escritura que acumula lo escrito hasta que se recoge con `drain()`."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+def compress_chunks(chunks, compression):
+    """Comprime sobre la marcha un flujo de bloques de bytes con 'gzip' o 'zstd'."""
+    if compression is None:
+        yield from chunks
+        return
+    if compression not in COMPRESSION_TYPES:
+        raise ValueError(f"Compresión no soportada: {compression}")
+    sink = ChunkSink()
+    stream = pa.CompressedOutputStream(pa.PythonFile(sink, mode='w'), compression)
+    for chunk in chunks:
+        stream.write(chunk)
+        data = sink.drain()
+        if data:
+            yield data
+    stream.close()
+    yield sink.drain()
+
+def _split_parts(chunks, part_size, digest):
+    """Reagrupa los bloques en partes de `part_size` bytes (la última, menor) y calcula el checksum."""
+    buffer = bytearray()
+    for chunk in chunks:
+        digest.update(chunk)
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+def multipart_upload(s3_client, key, chunks, content_type='application/octet-stream', part_size=None, max_workers=None):
+    """
+    Sube a `key` el flujo de bloques de bytes `chunks`. Los bloques se reagrupan en
+    partes que se suben en paralelo con una subida multiparte; como mucho hay
+    `max_workers` partes en vuelo más la que se está llenando, así que la memoria no
+    depende del tamaño del objeto. Si todo cabe en una parte se usa un único PUT.
+    El SHA-256 del objeto se calcula mientras se sube, para el manifiesto. Si la
+    subida falla se aborta para no dejar partes huérfanas. Devuelve las estadísticas.
+    """
+    part_size = max(part_size or Config.S3_UPLOAD_PART_SIZE, MIN_PART_SIZE)
+    max_workers = max_workers or Config.S3_UPLOAD_CONCURRENCY
+    client = s3_client.s3_client
+    bucket = s3_client.bucket_name
+    digest = hashlib.sha256()
+    started = time.monotonic()
+
+    parts = _split_parts(chunks, part_size, digest)
+    first = next(parts, b'')
+    second = next(parts, None)
+    if second is None:
+        client.put_object(Bucket=bucket, Key=key, Body=first, ContentType=content_type)
+        total, uploaded = len(first), [first]
+    else:
+        upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)['UploadId']
+
+        def upload_part(number, data):
+            response = client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data)
+            return {'PartNumber': number, 'ETag': response['ETag']}, len(data)
+
+        completed = []
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload') as pool:
+                in_flight = deque()
+                number = 0
+                for data in _chain(first, second, parts):
+                    number += 1
+                    in_flight.append(pool.submit(upload_part, number, data))
+                    if len(in_flight) >= max_workers:
+                        completed.append(in_flight.popleft().result())
+                completed.extend(future.result() for future in in_flight)
+            client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                             MultipartUpload={'Parts': [part for part, _ in completed]})
+        except BaseException:
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+        total, uploaded = sum(size for _, size in completed), completed
+    elapsed = max(time.monotonic() - started, 1e-6)
+
+    stats = {
+        'key': key,
+        'size': total,
+        'sha256': digest.hexdigest(),
+        'parts': len(uploaded),
+        'seconds': round(elapsed, 3),
+        'throughput_mbps': round(total / elapsed / (1024 * 1024), 2)
+    }
+    logger.info(f"Subida {key}: {total / (1024 * 1024):.1f} MB en {stats['seconds']}s "
+                f"({stats['throughput_mbps']} MB/s, {stats['parts']} partes)")
+    return stats
+
+def _chain(first, second, rest):
+    yield first
+    yield second
+    yield from rest
@@ -260,6 +260,8 @@ function FilterBar({ onFilterChange, onChannelsLoad }) {
             <MenuItem value="score">Puntuación (Score)</MenuItem>
             <MenuItem value="views">Número de vistas</MenuItem>
             <MenuItem value="date">Fecha</MenuItem>
+            <MenuItem value="difference">Diferencia con la media</MenuItem>
+            <MenuItem value="members">Miembros del canal</MenuItem>
             <MenuItem value="channel">Canal</MenuItem>
           </TextField>
         </Grid>